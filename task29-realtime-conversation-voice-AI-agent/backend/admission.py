@@ -0,0 +1,77 @@
+import logging
+from collections import Counter
+from diagnostics import LoopLagMonitor
+from metrics import MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+# Rejection reasons, also naming the admission_rejected_<reason> gauges
+CALLS = "calls"
+LOOP_LAG = "loop_lag"
+INBOUND_BACKLOG = "inbound_backlog"
+
+
+class AdmissionController:
+    """
+    Decides at /incoming_call whether this worker can take one more call in real time.
+
+    A call is refused when any limit is reached (0 disables a limit):
+      - calls: calls streaming plus calls answered whose stream hasn't opened yet,
+      - loop lag: the worst event-loop lag over the last second, which every
+        call on the worker already suffers as audio jitter,
+      - inbound backlog: the deepest Twilio -> Gemini queue of any call, which
+        grows when audio can't be sent to Gemini as fast as it arrives.
+    Refused calls get hold/overflow TwiML instead, so overload degrades new
+    calls rather than the ones already connected.
+
+    Args:
+        max_calls: Concurrent calls.
+        max_loop_lag_ms: Recent loop lag.
+        max_inbound_backlog_ms: Audio waiting in any call's inbound queue.
+        lag_monitor: Source of loop lag samples.
+        registry: Receives admission gauges.
+    """
+
+    def __init__(self, max_calls: int = 0, max_loop_lag_ms: float = 0, max_inbound_backlog_ms: float = 0,
+                 lag_monitor: LoopLagMonitor = None, registry: MetricsRegistry = None):
+        self.max_calls = max_calls
+        self.max_loop_lag_ms = max_loop_lag_ms
+        self.max_inbound_backlog_ms = max_inbound_backlog_ms
+        self.lag_monitor = lag_monitor
+        self.registry = registry
+        self.admitted = 0
+        self.rejected = Counter()
+
+    def usage(self, calls: int, queues) -> dict:
+        """Current value of each limited quantity. `queues` are the live calls' audio queues."""
+        return {
+            CALLS: calls,
+            LOOP_LAG: self.lag_monitor.recent_max_lag * 1000.0 if self.lag_monitor else 0.0,
+            INBOUND_BACKLOG: max((q.depth_ms() for q in queues if q.name == "inbound"), default=0.0),
+        }
+
+    def limits(self) -> dict:
+        return {CALLS: self.max_calls, LOOP_LAG: self.max_loop_lag_ms, INBOUND_BACKLOG: self.max_inbound_backlog_ms}
+
+    def check(self, calls: int, queues) -> str:
+        """Returns None if the call is admitted, else the first limit it hit."""
+        usage = self.usage(calls, queues)
+        for reason, limit in self.limits().items():
+            if limit and usage[reason] >= limit:
+                self.rejected[reason] += 1
+                if self.registry:
+                    self.registry.set_gauge(f"admission_rejected_{reason}", self.rejected[reason])
+                logger.debug(f"Admission limit hit: {reason} at {usage[reason]:.0f} (limit {limit:.0f})")
+                return reason
+        self.admitted += 1
+        if self.registry:
+            self.registry.set_gauge("admission_admitted", self.admitted)
+        return None
+
+    def stats(self, calls: int, queues) -> dict:
+        return {
+            "limits": self.limits(),
+            "usage": self.usage(calls, queues),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+        }
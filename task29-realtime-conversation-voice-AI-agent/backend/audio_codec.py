@@ -0,0 +1,273 @@
+import logging
+from functools import lru_cache
+from math import gcd
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# --- G.711 μ-law constants (14-bit magnitude domain, as in the reference codec) ---
+MULAW_BIAS = 0x21   # 33, added before the segment search
+MULAW_CLIP = 8159   # Largest 14-bit magnitude that still fits after biasing
+
+
+def _build_mulaw_decode_table() -> np.ndarray:
+    """Builds the 256-entry μ-law byte -> int16 sample table (ITU-T G.711)."""
+    codes = np.arange(256, dtype=np.int32)
+    inverted = ~codes & 0xFF
+    sign = inverted & 0x80
+    exponent = (inverted >> 4) & 0x07
+    mantissa = inverted & 0x0F
+    # Decoding works in the 16-bit domain, where the bias is 0x84 (33 << 2)
+    magnitude = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    return np.where(sign != 0, -magnitude, magnitude).astype(np.int16)
+
+
+def _build_mulaw_encode_table() -> np.ndarray:
+    """Builds the 65536-entry int16 sample -> μ-law byte table.
+
+    The table is indexed by the sample's bit pattern read as uint16, so
+    encoding a whole buffer is a single lookup with no per-sample branching.
+    """
+    samples = np.arange(65536, dtype=np.uint16).view(np.int16).astype(np.int32) >> 2
+    mask = np.where(samples < 0, 0x7F, 0xFF)
+    magnitude = np.minimum(np.abs(samples), MULAW_CLIP) + MULAW_BIAS
+    # Segment is the position of the highest set bit above bit 5
+    segment = np.maximum(np.floor(np.log2(magnitude)).astype(np.int32) - 5, 0)
+    mantissa = (magnitude >> (np.minimum(segment, 7) + 1)) & 0x0F
+    codes = np.where(segment >= 8, 0x7F, (segment << 4) | mantissa)
+    return (codes ^ mask).astype(np.uint8)
+
+
+MULAW_DECODE_TABLE = _build_mulaw_decode_table()
+MULAW_ENCODE_TABLE = _build_mulaw_encode_table()
+# Squared amplitude of each μ-law code, so frame energy is one lookup + mean
+MULAW_POWER_TABLE = MULAW_DECODE_TABLE.astype(np.float32) ** 2
+
+
+def mulaw_decode(mulaw: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    """Decodes an array of μ-law bytes (uint8) to int16 PCM samples, optionally into `out`."""
+    return np.take(MULAW_DECODE_TABLE, mulaw, out=out)
+
+
+def mulaw_encode(pcm: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    """Encodes an array of int16 PCM samples to μ-law bytes (uint8), optionally into `out`."""
+    return np.take(MULAW_ENCODE_TABLE, pcm.view(np.uint16), out=out)
+
+
+def mulaw_level_dbfs(mulaw: np.ndarray) -> float:
+    """Returns the RMS level of μ-law encoded audio in dBFS, without decoding it."""
+    if mulaw.size == 0:
+        return float("-inf")
+    mean_square = float(np.take(MULAW_POWER_TABLE, mulaw).mean())
+    if mean_square == 0.0:
+        return float("-inf")
+    return float(10.0 * np.log10(mean_square / (32768.0 * 32768.0)))
+
+
+# --- Polyphase resampling ---
+
+@lru_cache(maxsize=None)
+def design_polyphase_filter(up: int, down: int, zero_crossings: int = 8, beta: float = 6.0) -> np.ndarray:
+    """
+    Designs a Kaiser-windowed sinc low-pass and splits it into polyphase branches.
+
+    Args:
+        up: Interpolation factor L.
+        down: Decimation factor M.
+        zero_crossings: Sinc zero crossings kept on each side of the centre tap.
+        beta: Kaiser window shape parameter (6.0 gives ~60 dB stopband).
+
+    Returns:
+        A read-only float32 array of shape (up, taps_per_phase). Each row is
+        already time-reversed so a branch is applied as a plain dot product
+        against a window of consecutive input samples.
+    """
+    factor = max(up, down)
+    taps_per_phase = -(-2 * zero_crossings * factor // up)  # ceil division
+    num_taps = taps_per_phase * up
+    # Cutoff relative to the upsampled rate, pulled in slightly for a transition band
+    cutoff = 0.5 / factor * 0.92
+    n = np.arange(num_taps) - (num_taps - 1) / 2.0
+    prototype = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(num_taps, beta)
+    prototype *= up / prototype.sum()  # Unity DC gain after zero stuffing
+    # Branch p holds taps h[p], h[p + L], h[p + 2L], ...
+    phases = prototype.reshape(taps_per_phase, up).T[:, ::-1]
+    phases = np.ascontiguousarray(phases, dtype=np.float32)
+    phases.flags.writeable = False
+    return phases
+
+
+def resampled_length(num_samples: int, up: int, down: int, position: int = 0) -> int:
+    """Number of output samples a block of `num_samples` yields, given the carried grid position."""
+    span = num_samples * up - position
+    return -(-span // down) if span > 0 else 0
+
+
+def polyphase_filter_block(buffer: np.ndarray, phases: np.ndarray, up: int, down: int,
+                           position: int, num_out: int, out: np.ndarray) -> None:
+    """
+    Runs the polyphase filter over a history-prefixed block, writing into `out`.
+
+    Works on the last axis, so `buffer` may be 1-D (one stream) or 2-D (one
+    row per stream, all sharing the same grid position). Outputs are grouped
+    by filter branch: within a group the input windows advance by a fixed
+    stride, so each group is a single strided matmul with no gathered copies.
+
+    Args:
+        buffer: float32 samples, prefixed with taps_per_phase - 1 history samples.
+        phases: Branch matrix from `design_polyphase_filter(up, down)`.
+        up: Interpolation factor L.
+        down: Decimation factor M.
+        position: Upsampled-grid position of the first output, relative to the
+            first new (non-history) sample.
+        num_out: Number of output samples to produce.
+        out: float32 destination with at least `num_out` samples on the last axis.
+    """
+    taps_per_phase = phases.shape[1]
+    windows = np.lib.stride_tricks.sliding_window_view(buffer, taps_per_phase, axis=-1)
+    # Branch selection repeats every `period` outputs
+    period = up // gcd(up, down)
+    window_stride = down * period // up
+    for offset in range(min(period, num_out)):
+        grid = position + offset * down
+        count = -(-(num_out - offset) // period)
+        first = grid // up
+        stop = first + (count - 1) * window_stride + 1
+        np.matmul(
+            windows[..., first:stop:window_stride, :],
+            phases[grid % up],
+            out=out[..., offset:num_out:period],
+        )
+
+
+def polyphase_resample(samples: np.ndarray, up: int, down: int) -> np.ndarray:
+    """
+    Resamples a block of int16 samples by the rational factor up/down.
+
+    The block is treated as starting from silence, so this suits one-off
+    chunks; use a `StreamingResampler` for continuous streams.
+    """
+    phases = design_polyphase_filter(up, down)
+    taps_per_phase = phases.shape[1]
+    num_out = resampled_length(len(samples), up, down)
+    if num_out == 0:
+        return np.zeros(0, dtype=np.int16)
+
+    buffer = np.zeros(taps_per_phase - 1 + len(samples), dtype=np.float32)
+    buffer[taps_per_phase - 1:] = samples
+    output = np.empty(num_out, dtype=np.float32)
+    polyphase_filter_block(buffer, phases, up, down, 0, num_out, output)
+    return np.clip(np.rint(output), -32768, 32767).astype(np.int16)
+
+
+class StreamingResampler:
+    """
+    Stateful polyphase resampler for one continuous stream.
+
+    Filter history and the fractional position on the upsampled grid are
+    carried between calls, so consecutive blocks join without a discontinuity
+    and blocks whose length isn't a multiple of the decimation factor don't
+    drift. Work and output buffers are preallocated and reused; they only
+    grow if a block exceeds the largest seen so far.
+    """
+
+    def __init__(self, up: int, down: int, max_block: int = 4800):
+        self.up = up
+        self.down = down
+        self.phases = design_polyphase_filter(up, down)
+        self.history_length = self.phases.shape[1] - 1
+        self._position = 0
+        self._allocate(max_block)
+        self._buffer[:self.history_length] = 0.0
+
+    def _allocate(self, max_block: int) -> None:
+        history = self._buffer[:self.history_length].copy() if hasattr(self, "_buffer") else None
+        self._capacity = max_block
+        self._buffer = np.zeros(self.history_length + max_block, dtype=np.float32)
+        max_out = resampled_length(max_block, self.up, self.down) + 1
+        self._filtered = np.empty(max_out, dtype=np.float32)
+        self._output = np.empty(max_out, dtype=np.int16)
+        if history is not None:
+            self._buffer[:self.history_length] = history
+
+    def reset(self) -> None:
+        """Clears filter history, e.g. after the stream was flushed."""
+        self._buffer[:self.history_length] = 0.0
+        self._position = 0
+
+    def get_state(self) -> tuple:
+        """Returns (history, position): a copy of the filter history and the carried grid position."""
+        return self._buffer[:self.history_length].copy(), self._position
+
+    def set_state(self, history: np.ndarray, position: int) -> None:
+        """Restores state captured by `get_state`, e.g. after processing elsewhere."""
+        self._buffer[:self.history_length] = history
+        self._position = position
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """
+        Resamples the next block of the stream.
+
+        Returns:
+            int16 samples as a view into an internal buffer. The view is only
+            valid until the next call, so copy (e.g. `.tobytes()`) before reuse.
+        """
+        num_in = len(samples)
+        if num_in > self._capacity:
+            self._allocate(num_in)
+        history = self.history_length
+        num_out = resampled_length(num_in, self.up, self.down, self._position)
+
+        self._buffer[history:history + num_in] = samples
+        block = self._buffer[:history + num_in]
+        if num_out:
+            polyphase_filter_block(block, self.phases, self.up, self.down,
+                                   self._position, num_out, self._filtered)
+        self._position += num_out * self.down - num_in * self.up
+        # Keep the tail as history for the next block
+        if history:
+            self._buffer[:history] = block[-history:]
+
+        filtered = self._filtered[:num_out]
+        np.rint(filtered, out=filtered)
+        np.clip(filtered, -32768, 32767, out=filtered)
+        output = self._output[:num_out]
+        output[:] = filtered
+        return output
+
+
+def resample_batch(resamplers: list, blocks: np.ndarray) -> np.ndarray:
+    """
+    Advances several independent streams by one block each in a single pass.
+
+    All resamplers must share the same ratio and current grid position, and
+    `blocks` holds one equal-length row per resampler. Each stream's history
+    and position are updated exactly as `StreamingResampler.process` would.
+
+    Returns:
+        A new int16 array of shape (len(resamplers), num_out).
+    """
+    first = resamplers[0]
+    up, down, position = first.up, first.down, first._position
+    history = first.history_length
+    rows, num_in = blocks.shape
+    num_out = resampled_length(num_in, up, down, position)
+
+    buffer = np.empty((rows, history + num_in), dtype=np.float32)
+    for row, resampler in enumerate(resamplers):
+        buffer[row, :history] = resampler._buffer[:history]
+    buffer[:, history:] = blocks
+    filtered = np.empty((rows, num_out), dtype=np.float32)
+    if num_out:
+        polyphase_filter_block(buffer, first.phases, up, down, position, num_out, filtered)
+
+    next_position = position + num_out * down - num_in * up
+    for row, resampler in enumerate(resamplers):
+        if history:
+            resampler._buffer[:history] = buffer[row, -history:]
+        resampler._position = next_position
+
+    np.rint(filtered, out=filtered)
+    np.clip(filtered, -32768, 32767, out=filtered)
+    return filtered.astype(np.int16)
@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import time
+from collections import deque
+import numpy as np
+from audio_codec import mulaw_level_dbfs
+
+logger = logging.getLogger(__name__)
+
+# Overload policies
+DROP_OLDEST = "drop_oldest"     # Discard the oldest audio to make room
+DROP_SILENCE = "drop_silence"   # Discard the oldest silent audio first, then the oldest audio
+BACKPRESSURE = "backpressure"   # Make the producer wait for room
+QUEUE_POLICIES = (DROP_OLDEST, DROP_SILENCE, BACKPRESSURE)
+
+MULAW_BYTES_PER_MS = 8 # 8kHz, 1 byte per sample
+SILENCE_THRESHOLD_DBFS = -45.0
+
+
+def mulaw_bytes_level_dbfs(item: bytes) -> float:
+    return mulaw_level_dbfs(np.frombuffer(item, dtype=np.uint8))
+
+
+class BoundedAudioQueue:
+    """
+    Per-call audio queue bounded by duration, with a configurable overload policy.
+
+    Drop-in for the asyncio.Queue usage in the gateway (put/get/put_nowait/
+    get_nowait/empty/qsize). Audio items are bytes (mulaw by default; see
+    bytes_per_ms and level_dbfs) and count against the capacity; control
+    items (None for end of stream, b"" for end of turn) are never dropped
+    and never block. Depth, high-water mark, drops and producer wait time
+    are tracked for monitoring.
+
+    Args:
+        capacity_ms: Audio the queue may hold.
+        policy: One of QUEUE_POLICIES.
+        name: Label used in logs and stats.
+        bytes_per_ms: Audio bytes per millisecond of the queued format.
+        level_dbfs: Level of one audio item in the queued format, for DROP_SILENCE.
+    """
+
+    def __init__(self, capacity_ms: int, policy: str = DROP_OLDEST, name: str = "audio",
+                 bytes_per_ms: int = MULAW_BYTES_PER_MS, level_dbfs=mulaw_bytes_level_dbfs):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown queue policy '{policy}'. Expected one of: {', '.join(QUEUE_POLICIES)}")
+        self.name = name
+        self.policy = policy
+        self.bytes_per_ms = bytes_per_ms
+        self.level_dbfs = level_dbfs
+        self.capacity_bytes = capacity_ms * bytes_per_ms
+        self._items = deque()
+        self._audio_bytes = 0
+        self._getters = deque()
+        self._putters = deque()
+        # Gauges and counters
+        self.high_water_bytes = 0
+        self.dropped_items = 0
+        self.dropped_bytes = 0
+        self.producer_wait_seconds = 0.0
+
+    # --- asyncio.Queue-compatible API ---
+
+    def qsize(self) -> int:
+        return len(self._items)
+
+    def empty(self) -> bool:
+        return not self._items
+
+    def depth_ms(self) -> float:
+        return self._audio_bytes / self.bytes_per_ms
+
+    def _is_full_for(self, item) -> bool:
+        # An item larger than the whole capacity is still accepted into an empty queue
+        return bool(item) and self._audio_bytes > 0 and self._audio_bytes + len(item) > self.capacity_bytes
+
+    def put_nowait(self, item):
+        if self._is_full_for(item):
+            if self.policy == BACKPRESSURE:
+                raise asyncio.QueueFull
+            self._make_room(len(item))
+        self._append(item)
+
+    async def put(self, item):
+        if self.policy == BACKPRESSURE and self._is_full_for(item):
+            started = time.monotonic()
+            loop = asyncio.get_running_loop()
+            while self._is_full_for(item):
+                putter = loop.create_future()
+                self._putters.append(putter)
+                try:
+                    await putter
+                except BaseException:
+                    putter.cancel()
+                    try:
+                        self._putters.remove(putter)
+                    except ValueError:
+                        pass
+                    if not self._is_full_for(item) and not putter.cancelled():
+                        self._wake(self._putters)
+                    raise
+            self.producer_wait_seconds += time.monotonic() - started
+        self.put_nowait(item)
+
+    def get_nowait(self):
+        if not self._items:
+            raise asyncio.QueueEmpty
+        item = self._items.popleft()
+        if item:
+            self._audio_bytes -= len(item)
+            self._wake(self._putters)
+        return item
+
+    async def get(self):
+        loop = asyncio.get_running_loop()
+        while not self._items:
+            getter = loop.create_future()
+            self._getters.append(getter)
+            try:
+                await getter
+            except BaseException:
+                getter.cancel()
+                try:
+                    self._getters.remove(getter)
+                except ValueError:
+                    pass
+                if self._items and not getter.cancelled():
+                    self._wake(self._getters)
+                raise
+        return self.get_nowait()
+
+    def task_done(self):
+        pass # Nothing joins these queues; kept for asyncio.Queue compatibility
+
+    # --- Internals ---
+
+    def _append(self, item):
+        self._items.append(item)
+        if item:
+            self._audio_bytes += len(item)
+            self.high_water_bytes = max(self.high_water_bytes, self._audio_bytes)
+        self._wake(self._getters)
+
+    @staticmethod
+    def _wake(waiters: deque):
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    def _drop_at(self, index: int):
+        item = self._items[index]
+        del self._items[index]
+        self._audio_bytes -= len(item)
+        self.dropped_items += 1
+        self.dropped_bytes += len(item)
+
+    def _make_room(self, needed: int):
+        """Drops audio per policy until `needed` more bytes fit (or no audio is left)."""
+        if self.policy == DROP_SILENCE:
+            index = 0
+            while index < len(self._items) and self._audio_bytes + needed > self.capacity_bytes:
+                item = self._items[index]
+                if item and self.level_dbfs(item) < SILENCE_THRESHOLD_DBFS:
+                    self._drop_at(index)
+                else:
+                    index += 1
+        index = 0
+        while index < len(self._items) and self._audio_bytes + needed > self.capacity_bytes:
+            if self._items[index]:
+                self._drop_at(index)
+            else:
+                index += 1 # Keep control signals in place
+
+    def clear_audio(self) -> int:
+        """Removes all queued audio (e.g. on barge-in), keeping control signals. Returns items removed."""
+        removed = sum(1 for item in self._items if item)
+        self._items = deque(item for item in self._items if not item)
+        self._audio_bytes = 0
+        self._wake(self._putters)
+        return removed
+
+    def withdraw(self, item) -> bool:
+        """Takes back audio that is still queued (e.g. for a turn interrupted meanwhile). Returns False if it is gone."""
+        for index in range(len(self._items) - 1, -1, -1):
+            if self._items[index] is item:
+                del self._items[index]
+                self._audio_bytes -= len(item)
+                self._wake(self._putters)
+                return True
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "queue": self.name,
+            "policy": self.policy,
+            "depth_items": len(self._items),
+            "depth_ms": self.depth_ms(),
+            "high_water_ms": self.high_water_bytes / self.bytes_per_ms,
+            "capacity_ms": self.capacity_bytes / self.bytes_per_ms,
+            "dropped_items": self.dropped_items,
+            "dropped_ms": self.dropped_bytes / self.bytes_per_ms,
+            "producer_wait_seconds": self.producer_wait_seconds,
+        }
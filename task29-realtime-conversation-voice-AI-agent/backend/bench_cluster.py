@@ -0,0 +1,184 @@
+"""
+Load test for cluster.py: how many real-time calls N worker processes sustain.
+
+Starts the cluster with an echo stand-in for Gemini Live (every audio chunk
+sent comes straight back as 24 kHz model audio, so each call exercises the
+full inbound and outbound conversion, queueing and 20 ms pacing path), then
+places simulated Twilio calls: POST /incoming_call, open the stream URL it
+returns (which pins the call to a worker) and send a 20 ms media frame every
+20 ms. A call counts as sustained if the gap between the media frames it
+gets back stays under --max-gap-ms at p99.
+
+Callers run in their own processes (--client-procs) so the load generator is
+not the bottleneck; on a machine with fewer cores than workers + callers the
+numbers measure contention, not scaling.
+
+Usage: python bench_cluster.py [--workers 1 2 4] [--calls 20 40 80] [--seconds 10] [--client-procs 2]
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import json
+import multiprocessing
+import os
+import re
+import socket
+import time
+import numpy as np
+
+FRAME_MS = 20
+STREAM_URL = re.compile(rb'url="wss?://[^/"]+(/[^"]*)"')
+ECHO_TURN_CHUNKS = 50 # Echoed chunks per model turn before a generation_complete
+
+
+# --- Gemini stand-in (installed in each worker via cluster.py --setup) ---
+
+class EchoSession:
+    """Answers every audio chunk with the same duration of 24 kHz model audio."""
+
+    def __init__(self):
+        self._replies = asyncio.Queue()
+
+    async def send_realtime_input(self, audio=None, **kwargs):
+        if audio is not None:
+            pcm16k = np.frombuffer(audio.data, dtype="<i2")
+            self._replies.put_nowait(np.repeat(pcm16k, 3)[::2].tobytes()) # 16k -> 24k samples
+
+    async def send_client_content(self, **kwargs):
+        pass
+
+    async def send_tool_response(self, **kwargs):
+        pass
+
+    async def receive(self):
+        from google.genai import types
+        for _ in range(ECHO_TURN_CHUNKS):
+            pcm24k = await self._replies.get()
+            yield types.LiveServerMessage(server_content=types.LiveServerContent(model_turn=types.Content(
+                parts=[types.Part(inline_data=types.Blob(data=pcm24k, mime_type="audio/pcm;rate=24000"))])))
+        yield types.LiveServerMessage(server_content=types.LiveServerContent(generation_complete=True, turn_complete=True))
+
+
+def install_fake_gemini():
+    """cluster.py worker setup hook: every genai.Client connects to an EchoSession."""
+    from google import genai
+    real_client = genai.Client
+
+    @contextlib.asynccontextmanager
+    async def connect(model=None, config=None):
+        yield EchoSession()
+
+    def client(*args, **kwargs):
+        instance = real_client(*args, **kwargs)
+        instance.aio.live.connect = connect
+        return instance
+
+    genai.Client = client
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+
+# --- Simulated callers ---
+
+async def http_post(port: int, path: str, form: str) -> bytes:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = form.encode()
+    writer.write(f"POST {path} HTTP/1.1\r\nhost: localhost\r\ncontent-type: application/x-www-form-urlencoded\r\n"
+                 f"content-length: {len(body)}\r\nconnection: close\r\n\r\n".encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return response
+
+
+async def place_call(port: int, call_id: str, seconds: float) -> dict:
+    import websockets
+    twiml = await http_post(port, "/incoming_call", f"CallSid={call_id}")
+    path = STREAM_URL.search(twiml).group(1).decode()
+    arrivals = []
+    async with websockets.connect(f"ws://127.0.0.1:{port}{path}", max_size=None) as ws:
+        await ws.send(json.dumps({"event": "connected"}))
+        await ws.send(json.dumps({"event": "start", "start": {"streamSid": f"MZ{call_id}", "callSid": call_id}}))
+
+        async def listen():
+            async for message in ws:
+                if '"media"' in message:
+                    arrivals.append(time.monotonic())
+
+        listener = asyncio.create_task(listen())
+        tone = (np.sin(np.arange(160) / 3) * 60 + 128).astype(np.uint8).tobytes() # Non-silent mulaw frame
+        media = json.dumps({"event": "media", "streamSid": f"MZ{call_id}", "media": {"payload": base64.b64encode(tone).decode()}})
+        started = time.monotonic()
+        for frame in range(int(seconds * 1000 / FRAME_MS)):
+            await asyncio.sleep(max(0.0, started + frame * FRAME_MS / 1000 - time.monotonic()))
+            await ws.send(media)
+        await asyncio.sleep(0.5) # Let the tail of the echo drain
+        listener.cancel()
+    gaps = np.diff(arrivals) * 1000 if len(arrivals) > 1 else np.array([float("inf")])
+    return {"frames": len(arrivals), "p99_gap_ms": float(np.percentile(gaps, 99))}
+
+
+def run_callers(port: int, call_ids: list, seconds: float, ramp_s: float) -> list:
+    async def main():
+        async def staggered(index, call_id):
+            await asyncio.sleep(ramp_s * index / max(1, len(call_ids)))
+            try:
+                return await place_call(port, call_id, seconds)
+            except Exception as e:
+                return {"frames": 0, "p99_gap_ms": float("inf"), "error": f"{type(e).__name__}: {e}"}
+        return await asyncio.gather(*(staggered(i, c) for i, c in enumerate(call_ids)))
+    return asyncio.run(main())
+
+
+def worker_loads(port: int) -> list:
+    with socket.create_connection(("127.0.0.1", port)) as conn:
+        conn.sendall(b"GET /cluster HTTP/1.1\r\nhost: localhost\r\n\r\n")
+        response = b""
+        while chunk := conn.recv(65536):
+            response += chunk
+    return [w["connections_routed"] for w in json.loads(response.split(b"\r\n\r\n", 1)[1])["workers"]]
+
+
+def bench(workers: int, calls: int, args) -> dict:
+    import cluster
+    context = multiprocessing.get_context("spawn")
+    server = context.Process(target=cluster.run, args=(workers, "127.0.0.1", args.port, "bench_cluster:install_fake_gemini"))
+    server.start()
+    time.sleep(args.startup_s)
+    try:
+        groups = [[f"CA{workers}x{calls}x{i}" for i in range(g, calls, args.client_procs)] for g in range(args.client_procs)]
+        with context.Pool(args.client_procs) as pool:
+            results = sum(pool.starmap(run_callers, [(args.port, group, args.seconds, args.ramp_s) for group in groups]), [])
+        routed = worker_loads(args.port)
+    finally:
+        os.kill(server.pid, 15)
+        server.join(30)
+    sustained = sum(1 for r in results if r["p99_gap_ms"] <= args.max_gap_ms)
+    expected_frames = args.seconds * 1000 / FRAME_MS
+    return {
+        "sustained": sustained,
+        "delivered": float(np.mean([r["frames"] for r in results])) / expected_frames,
+        "p99_gap_ms": float(np.median([r["p99_gap_ms"] for r in results])),
+        "errors": sum(1 for r in results if "error" in r),
+        "routed": routed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--calls", type=int, nargs="+", default=[20, 40, 80])
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--ramp-s", type=float, default=2.0)
+    parser.add_argument("--client-procs", type=int, default=2)
+    parser.add_argument("--max-gap-ms", type=float, default=100.0)
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--startup-s", type=float, default=4.0)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPU cores; calls are sustained if p99 gap between returned frames <= {args.max_gap_ms:.0f} ms\n")
+    print(f"{'workers':>7} {'calls':>6} {'sustained':>9} {'delivered':>9} {'median p99 gap':>15} {'errors':>6}  connections per worker")
+    for workers in args.workers:
+        for calls in args.calls:
+            r = bench(workers, calls, args)
+            print(f"{workers:>7} {calls:>6} {r['sustained']:>9} {r['delivered']:>8.0%} {r['p99_gap_ms']:>12.1f} ms {r['errors']:>6}  {r['routed']}")
@@ -0,0 +1,111 @@
+"""
+Load test for reservations.py: many callers booking the same few slots at once.
+
+Each process opens its own ReservationBook on one shared database file, as
+the workers of cluster.py do, and fires all its booking attempts
+concurrently (a random party of 1-6 for one of --slots slots; a refused
+attempt then asks for alternative slots, as reserveTable does). Afterwards it
+checks that no slot holds more than its capacity, that every slot's seat
+count matches its reservations, and that every refusal was right (the slot
+had no room for that party). Also reports booking latency and the worst
+event-loop lag seen meanwhile, which stays low because the queries run off the loop.
+
+Usage: python bench_reservations.py [--attempts 100 500] [--processes 1 4] [--slots 3] [--seats 40]
+"""
+import argparse
+import asyncio
+import datetime
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import numpy as np
+from reservations import SLOT_FORMAT, ReservationBook
+
+DAY = datetime.datetime(2030, 1, 15)
+LAG_TICK_S = 0.005
+
+
+def slots(count: int) -> list:
+    return [DAY.replace(hour=19) + datetime.timedelta(minutes=30 * i) for i in range(count)]
+
+
+def run_process(path: str, attempts: int, slot_count: int, seats: int, seed: int) -> dict:
+    async def main():
+        book = ReservationBook(path, seats_per_slot=seats)
+        rng = random.Random(seed)
+        requests = [(rng.choice(slots(slot_count)), rng.randint(1, 6)) for _ in range(attempts)]
+        latencies, refused = [], []
+        max_lag = 0.0
+
+        async def watch_lag():
+            nonlocal max_lag
+            while True:
+                started = time.perf_counter()
+                await asyncio.sleep(LAG_TICK_S)
+                max_lag = max(max_lag, time.perf_counter() - started - LAG_TICK_S)
+
+        async def attempt(when, party_size):
+            started = time.perf_counter()
+            if await book.book(when, party_size, "bench") is None:
+                await book.alternatives(when, party_size, DAY.replace(hour=11), DAY.replace(hour=20, minute=30))
+                refused.append((when.strftime(SLOT_FORMAT), party_size))
+            latencies.append(time.perf_counter() - started)
+
+        watcher = asyncio.create_task(watch_lag())
+        started = time.perf_counter()
+        await asyncio.gather(*(attempt(when, party_size) for when, party_size in requests))
+        elapsed = time.perf_counter() - started
+        watcher.cancel()
+        book.close()
+        return {"latencies": latencies, "refused": refused, "elapsed": elapsed, "max_lag": max_lag}
+    return asyncio.run(main())
+
+
+def bench(attempts: int, processes: int, args) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "reservations.db")
+        ReservationBook(path).close() # Create the schema before the processes race for it
+        per_process = [attempts // processes + (i < attempts % processes) for i in range(processes)]
+        with multiprocessing.get_context("spawn").Pool(processes) as pool:
+            results = pool.starmap(run_process, [(path, n, args.slots, args.seats, i) for i, n in enumerate(per_process)])
+        db = sqlite3.connect(path)
+        booked = dict(db.execute("SELECT slot, seats_booked FROM slots"))
+        reserved = dict(db.execute("SELECT slot, SUM(party_size) FROM reservations GROUP BY slot"))
+        confirmed = db.execute("SELECT COUNT(*) FROM reservations").fetchone()[0]
+        db.close()
+    refused = [r for result in results for r in result["refused"]]
+    latencies = np.array([l for result in results for l in result["latencies"]]) * 1000
+    return {
+        "confirmed": confirmed,
+        "refused": len(refused),
+        "seats": sum(booked.values()),
+        "overbooked": sum(1 for seats in booked.values() if seats > args.seats),
+        "mismatched": sum(1 for slot, seats in booked.items() if reserved.get(slot, 0) != seats),
+        "wrong_refusals": sum(1 for slot, party_size in refused if args.seats - booked.get(slot, 0) >= party_size),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "per_s": attempts / max(result["elapsed"] for result in results),
+        "max_lag_ms": max(result["max_lag"] for result in results) * 1000,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--attempts", type=int, nargs="+", default=[100, 500])
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--slots", type=int, default=3)
+    parser.add_argument("--seats", type=int, default=40)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPU cores; {args.slots} slots of {args.seats} seats = {args.slots * args.seats} seats\n")
+    print(f"{'procs':>5} {'attempts':>8} {'confirmed':>9} {'refused':>7} {'seats':>5} {'overbooked':>10} {'mismatched':>10} "
+          f"{'wrong refusals':>14} {'p50 ms':>7} {'p99 ms':>7} {'attempts/s':>10} {'max lag ms':>10}")
+    for processes in args.processes:
+        for attempts in args.attempts:
+            r = bench(attempts, processes, args)
+            print(f"{processes:>5} {attempts:>8} {r['confirmed']:>9} {r['refused']:>7} {r['seats']:>5} {r['overbooked']:>10} "
+                  f"{r['mismatched']:>10} {r['wrong_refusals']:>14} {r['p50_ms']:>7.1f} {r['p99_ms']:>7.1f} "
+                  f"{r['per_s']:>10.0f} {r['max_lag_ms']:>10.1f}")
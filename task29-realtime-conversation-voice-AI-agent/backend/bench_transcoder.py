@@ -0,0 +1,133 @@
+"""
+Benchmarks audio conversion CPU cost per call: per-call conversion vs cross-call batching.
+
+Simulates N concurrent calls, each sending a 160-byte Twilio frame every 20 ms
+and receiving a 40 ms Gemini audio chunk every 40 ms, and reports how many
+calls one core could keep in real time with each strategy.
+
+With --modes it also replays the schedule through BatchTranscoder in each
+execution mode and reports how long the event loop was blocked per batch.
+
+Usage: python bench_transcoder.py [--calls 1 10 100 500] [--seconds 2] [--window-ms 5] [--modes inline thread process]
+"""
+import argparse
+import asyncio
+import time
+import numpy as np
+from transcoder import BatchTranscoder
+from utils import AudioPipeline, convert_batch, mulaw8k_to_pcm16k, pcm24k_to_mulaw8k
+
+FRAME_MS = 20
+TWILIO_FRAME_BYTES = 160  # 20 ms of mulaw @ 8kHz
+GEMINI_CHUNK_MS = 40
+GEMINI_CHUNK_BYTES = 1920  # 40 ms of PCM16 @ 24kHz
+
+
+def make_schedule(num_calls: int, seconds: float, window_ms: float):
+    """Yields, per collection window, the (call, direction) events that arrive in it."""
+    rng = np.random.default_rng(0)
+    inbound_phase = rng.uniform(0, FRAME_MS, num_calls)
+    outbound_phase = rng.uniform(0, GEMINI_CHUNK_MS, num_calls)
+    events = []
+    for call in range(num_calls):
+        events += [(t, call, AudioPipeline.INBOUND) for t in np.arange(inbound_phase[call], seconds * 1000, FRAME_MS)]
+        events += [(t, call, AudioPipeline.OUTBOUND) for t in np.arange(outbound_phase[call], seconds * 1000, GEMINI_CHUNK_MS)]
+    events.sort()
+    windows = {}
+    for t, call, direction in events:
+        windows.setdefault(int(t // window_ms), []).append((call, direction))
+    return [windows[key] for key in sorted(windows)]
+
+
+def run(num_calls: int, seconds: float, window_ms: float) -> dict:
+    rng = np.random.default_rng(1)
+    inbound_frame = rng.integers(0, 256, TWILIO_FRAME_BYTES, dtype=np.uint8).tobytes()
+    outbound_chunk = (rng.standard_normal(GEMINI_CHUNK_BYTES // 2) * 3000).astype("<i2").tobytes()
+    chunk_for = {AudioPipeline.INBOUND: inbound_frame, AudioPipeline.OUTBOUND: outbound_chunk}
+    schedule = make_schedule(num_calls, seconds, window_ms)
+
+    def fresh_pipelines():
+        return {(call, direction): AudioPipeline(direction)
+                for call in range(num_calls) for direction in (AudioPipeline.INBOUND, AudioPipeline.OUTBOUND)}
+
+    # One-shot functions (stateless, per chunk)
+    started = time.process_time()
+    for window in schedule:
+        for _, direction in window:
+            if direction == AudioPipeline.INBOUND:
+                mulaw8k_to_pcm16k(inbound_frame)
+            else:
+                pcm24k_to_mulaw8k(outbound_chunk)
+    one_shot = time.process_time() - started
+
+    # Per-call streaming pipelines, each chunk converted on its own
+    pipelines = fresh_pipelines()
+    started = time.process_time()
+    for window in schedule:
+        for call, direction in window:
+            pipelines[(call, direction)].convert(chunk_for[direction])
+    per_call = time.process_time() - started
+
+    # Cross-call batches, one convert_batch per collection window
+    pipelines = fresh_pipelines()
+    started = time.process_time()
+    for window in schedule:
+        convert_batch([pipelines[event] for event in window], [chunk_for[direction] for _, direction in window])
+    batched = time.process_time() - started
+
+    def calls_per_core(cpu_seconds):
+        return num_calls * seconds / cpu_seconds if cpu_seconds else float("inf")
+
+    return {
+        "calls": num_calls,
+        "one_shot": calls_per_core(one_shot),
+        "per_call": calls_per_core(per_call),
+        "batched": calls_per_core(batched),
+    }
+
+
+async def run_mode(mode: str, num_calls: int, seconds: float, window_ms: float) -> dict:
+    """Replays the schedule in real time through a BatchTranscoder and returns its stats."""
+    rng = np.random.default_rng(1)
+    chunk_for = {
+        AudioPipeline.INBOUND: rng.integers(0, 256, TWILIO_FRAME_BYTES, dtype=np.uint8).tobytes(),
+        AudioPipeline.OUTBOUND: (rng.standard_normal(GEMINI_CHUNK_BYTES // 2) * 3000).astype("<i2").tobytes(),
+    }
+    transcoder = BatchTranscoder(window_ms=window_ms, mode=mode)
+    pipelines = {}
+    pending = set()
+    try:
+        for window in make_schedule(num_calls, seconds, window_ms):
+            for call, direction in window:
+                pipeline = pipelines.setdefault((call, direction), AudioPipeline(direction))
+                pending.add(asyncio.ensure_future(transcoder.convert(pipeline, chunk_for[direction])))
+            await asyncio.sleep(window_ms / 1000.0)
+        await asyncio.gather(*pending)
+        return transcoder.stats()
+    finally:
+        transcoder.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, nargs="+", default=[1, 10, 100, 500])
+    parser.add_argument("--seconds", type=float, default=2.0, help="Simulated audio per call")
+    parser.add_argument("--window-ms", type=float, default=5.0, help="Batch collection window")
+    parser.add_argument("--modes", nargs="*", default=[], help="Execution modes to compare for loop blocking")
+    args = parser.parse_args()
+
+    print(f"Calls-per-core for audio conversion only (window {args.window_ms} ms, {args.seconds} s simulated)")
+    print(f"{'calls':>6} {'one-shot':>12} {'per-call':>12} {'batched':>12} {'speedup':>8}")
+    for num_calls in args.calls:
+        result = run(num_calls, args.seconds, args.window_ms)
+        print(f"{result['calls']:>6} {result['one_shot']:>12.0f} {result['per_call']:>12.0f} "
+              f"{result['batched']:>12.0f} {result['batched'] / result['per_call']:>7.1f}x")
+
+    if args.modes:
+        num_calls = args.calls[-1]
+        print(f"\nEvent-loop blocking per batch with {num_calls} calls")
+        print(f"{'mode':>8} {'batches':>8} {'mean ms':>9} {'max ms':>9} {'total s':>9}")
+        for mode in args.modes:
+            stats = asyncio.run(run_mode(mode, num_calls, args.seconds, args.window_ms))
+            print(f"{mode:>8} {stats['batches']:>8} {stats['mean_loop_blocked_ms']:>9.3f} "
+                  f"{stats['max_loop_blocked_ms']:>9.3f} {stats['loop_blocked_seconds']:>9.3f}")
@@ -0,0 +1,71 @@
+"""
+Micro-benchmark: generic JSON framing vs the twilio_framing fast paths.
+
+Compares, per 20 ms media frame:
+  - inbound:  json.loads + base64.b64decode  vs  parse_twilio_message
+  - outbound: dict + json.dumps + b64encode   vs  TwilioMessageFormatter.media
+
+Usage: python bench_twilio_framing.py [--iterations 200000]
+"""
+import argparse
+import base64
+import json
+import os
+import timeit
+from twilio_framing import TwilioMessageFormatter, parse_twilio_message
+
+STREAM_SID = "MZ18ad3ab5a668481ce02b83e7395059f0"
+
+
+def make_inbound_message(frame: bytes) -> str:
+    # Same field order and separators Twilio uses
+    return json.dumps({
+        "event": "media",
+        "sequenceNumber": "3",
+        "media": {"track": "inbound", "chunk": "1", "timestamp": "5", "payload": base64.b64encode(frame).decode("ascii")},
+        "streamSid": STREAM_SID,
+    }, separators=(",", ":"))
+
+
+def json_inbound(message: str) -> bytes:
+    data = json.loads(message)
+    if data.get("event") == "media":
+        return base64.b64decode(data["media"]["payload"])
+    return None
+
+
+def json_outbound(frame: bytes) -> str:
+    return json.dumps({
+        "event": "media",
+        "streamSid": STREAM_SID,
+        "media": {"payload": base64.b64encode(frame).decode("utf-8")},
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+
+    frame = os.urandom(160)
+    message = make_inbound_message(frame)
+    formatter = TwilioMessageFormatter(STREAM_SID)
+
+    # Both paths must agree before timing them
+    assert parse_twilio_message(message)[2] == json_inbound(message) == frame
+    assert json.loads(formatter.media(frame)) == json.loads(json_outbound(frame))
+
+    cases = [
+        ("inbound  json.loads + b64decode", lambda: json_inbound(message)),
+        ("inbound  fast path", lambda: parse_twilio_message(message)),
+        ("outbound dict + json.dumps", lambda: json_outbound(frame)),
+        ("outbound preformatted template", lambda: formatter.media(frame)),
+    ]
+    print(f"{'case':<34} {'us/frame':>9} {'frames/s':>12}")
+    results = {}
+    for name, func in cases:
+        seconds = min(timeit.repeat(func, number=args.iterations, repeat=3)) / args.iterations
+        results[name] = seconds
+        print(f"{name:<34} {seconds * 1e6:>9.2f} {1 / seconds:>12.0f}")
+    print(f"\nInbound speedup:  {results[cases[0][0]] / results[cases[1][0]]:.1f}x")
+    print(f"Outbound speedup: {results[cases[2][0]] / results[cases[3][0]]:.1f}x")
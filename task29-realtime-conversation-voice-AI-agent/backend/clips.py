@@ -0,0 +1,108 @@
+import itertools
+import logging
+import os
+import struct
+from collections import Counter
+import numpy as np
+from audio_codec import mulaw_decode, polyphase_resample
+from outbound import TWILIO_FRAME_BYTES
+from utils import OUTBOUND_RESAMPLE_RATIO, TWILIO_SAMPLE_RATE
+
+logger = logging.getLogger(__name__)
+
+# Clip names; a clip may have variants (filler.ulaw, filler-2.ulaw, ...), played in turn
+GREETING = "greeting"
+FILLER = "filler"
+APOLOGY = "apology"
+HOLD = "hold"
+BUSY = "busy"
+
+CLIP_EXTENSION = ".ulaw"
+MULAW_SILENCE = 0xFF
+WAVE_FORMAT_MULAW = 7
+
+
+def mulaw_wav(mulaw: bytes) -> bytes:
+    """Wraps raw 8 kHz mulaw in a WAV container, for TwiML <Play>."""
+    fmt = struct.pack("<HHIIHHH", WAVE_FORMAT_MULAW, 1, TWILIO_SAMPLE_RATE, TWILIO_SAMPLE_RATE, 1, 8, 0)
+    fact = struct.pack("<I", len(mulaw))
+    body = (b"WAVE" + b"fmt " + struct.pack("<I", len(fmt)) + fmt + b"fact" + struct.pack("<I", len(fact)) + fact
+            + b"data" + struct.pack("<I", len(mulaw)) + mulaw + (b"\x00" if len(mulaw) % 2 else b""))
+    return b"RIFF" + struct.pack("<I", len(body)) + body
+
+
+class ClipCache:
+    """
+    Pre-rendered prompts (greeting, "one moment while I check", apologies,
+    hold messages) as 8 kHz mulaw, read once into memory.
+
+    A clip is ready to queue for twilio_sender as it is: no synthesis or
+    conversion per call, and it is padded with silence to whole 20 ms frames
+    so it never leaves a partial frame behind in the scheduler. Raw PCM
+    streams get the same clips as 24 kHz PCM16, converted once at load. The
+    audio is also served as WAV for TwiML <Play> (hold and busy prompts).
+
+    Clips are `<name>.ulaw` files of headerless mulaw (render_clips.py makes
+    them, or e.g. `sox in.wav -r 8000 -c 1 -e u-law -t raw greeting.ulaw`).
+    A missing clip means the caller keeps what it did without one.
+
+    Args:
+        directory: Where the clip files are; a missing directory gives an empty cache.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._clips = {} # name -> [mulaw variants]
+        self._pcm24k = {} # name -> [the same variants as 24 kHz PCM16]
+        self._wavs = {} # name -> WAV of the first variant
+        self._turns = {} # name -> variant counter
+        self.plays = Counter()
+        self.load()
+
+    def load(self):
+        clips = {}
+        if os.path.isdir(self.directory):
+            for filename in sorted(os.listdir(self.directory), key=lambda f: os.path.splitext(f)[0].partition("-")[::2]):
+                stem, extension = os.path.splitext(filename)
+                if extension != CLIP_EXTENSION:
+                    continue
+                with open(os.path.join(self.directory, filename), "rb") as f:
+                    mulaw = f.read()
+                if mulaw:
+                    padding = -len(mulaw) % TWILIO_FRAME_BYTES
+                    clips.setdefault(stem.partition("-")[0], []).append(mulaw + bytes([MULAW_SILENCE]) * padding)
+        self._clips = clips
+        down, up = OUTBOUND_RESAMPLE_RATIO # Back up from 8 kHz to 24 kHz
+        self._pcm24k = {name: [polyphase_resample(mulaw_decode(np.frombuffer(mulaw, dtype=np.uint8)), up, down).astype("<i2").tobytes()
+                               for mulaw in variants] for name, variants in clips.items()}
+        self._wavs = {name: mulaw_wav(variants[0]) for name, variants in clips.items()}
+        self._turns = {name: itertools.count() for name in clips}
+        if clips:
+            logger.info(f"Loaded {sum(map(len, clips.values()))} audio clips from {self.directory}: {', '.join(sorted(clips))}")
+        else:
+            logger.info(f"No audio clips in {self.directory}; using TwiML <Say> and no filler audio")
+
+    def has(self, name: str) -> bool:
+        return name in self._clips
+
+    def get(self, name: str, pcm24k: bool = False) -> bytes:
+        """The clip's audio (the next variant each time), or None if there is no such clip."""
+        variants = (self._pcm24k if pcm24k else self._clips).get(name)
+        if not variants:
+            return None
+        self.plays[name] += 1
+        return variants[next(self._turns[name]) % len(variants)]
+
+    def wav(self, name: str) -> bytes:
+        return self._wavs.get(name)
+
+    def seconds(self, name: str) -> float:
+        variants = self._clips.get(name) or [b""]
+        return max(map(len, variants)) / TWILIO_SAMPLE_RATE
+
+    def stats(self) -> dict:
+        return {
+            "directory": self.directory,
+            "clips": {name: {"variants": len(variants), "seconds": round(self.seconds(name), 2)} for name, variants in self._clips.items()},
+            "plays": dict(self.plays),
+        }
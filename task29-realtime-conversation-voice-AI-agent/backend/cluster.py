@@ -0,0 +1,323 @@
+"""
+Multi-process deployment of the voice gateway with call affinity.
+
+    python cluster.py --workers 4 --port 5000
+
+One dispatcher process owns the public port. For each connection it reads
+the HTTP request head, picks a worker and hands the socket itself to that
+worker (SCM_RIGHTS over a Unix socketpair); the worker's uvicorn serves it
+as if it had accepted it. The dispatcher never touches audio, so each call's
+media stays on one worker core.
+
+Routing:
+  - POST /incoming_call goes to the worker with the fewest live calls
+    (reported by the workers) plus calls it was just handed that haven't
+    opened their stream yet. That worker answers with a stream URL of
+    /audio_stream/w<index>, so...
+  - /audio_stream/w<index> (or /pcm_stream/w<index>) goes back to the same worker, where the call's
+    pre-warmed Gemini session is waiting (per-worker registries, no shared state).
+  - ?worker=<index> on any path (e.g. /metrics, /diagnostics) targets a worker;
+    anything else goes to the least-loaded worker.
+  - GET /cluster is answered by the dispatcher: per-worker load as JSON.
+
+Only a connection's first request is routed, so workers answer every plain
+HTTP request with `Connection: close`: a keep-alive client (ngrok, Twilio,
+a reverse proxy) then comes back through the dispatcher for its next one.
+
+SIGTERM to the dispatcher drains every worker (see drain.py) and exits once
+they have; connections keep being dispatched meanwhile.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import re
+import signal
+import socket
+import sys
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+WORKER_STREAM_PATH = re.compile(r"^/(?:audio|pcm)_stream/w(\d+)")
+WORKER_QUERY = re.compile(r"[?&]worker=(\d+)")
+MAX_HEAD_BYTES = 16384
+HEAD_TIMEOUT_S = 10.0
+PENDING_TTL_S = 30.0 # A call routed at /incoming_call counts against its worker until its stream arrives
+LOAD_REPORT_INTERVAL_S = 0.1
+DRAIN_DEADLINE_S = float(os.getenv("DRAIN_DEADLINE_S", "300")) # As in main.py
+
+
+# --- Dispatcher (parent process) ---
+
+class WorkerHandle:
+    """The dispatcher's view of one worker process."""
+
+    def __init__(self, index: int, process, channel: socket.socket):
+        self.index = index
+        self.process = process
+        self.channel = channel # Parent end of the socketpair: sockets out, load reports in
+        self.live_calls = 0
+        self.pending = deque() # Routing times of calls whose stream hasn't arrived yet
+        self.routed = 0
+
+    def load(self, now: float) -> int:
+        while self.pending and now - self.pending[0] > PENDING_TTL_S:
+            self.pending.popleft()
+        return self.live_calls + len(self.pending)
+
+    def status(self, now: float) -> dict:
+        return {
+            "worker": self.index,
+            "pid": self.process.pid,
+            "alive": self.process.is_alive(),
+            "live_calls": self.live_calls,
+            "pending_calls": len(self.pending),
+            "load": self.load(now),
+            "connections_routed": self.routed,
+        }
+
+
+class Dispatcher:
+    def __init__(self, workers: list):
+        self.workers = workers
+
+    def least_loaded(self) -> WorkerHandle:
+        now = time.monotonic()
+        alive = [w for w in self.workers if w.process.is_alive()] or self.workers
+        return min(alive, key=lambda w: (w.load(now), w.routed))
+
+    def route(self, method: str, path: str) -> WorkerHandle:
+        match = WORKER_STREAM_PATH.match(path) or WORKER_QUERY.search(path)
+        if match and int(match.group(1)) < len(self.workers):
+            worker = self.workers[int(match.group(1))]
+            if WORKER_STREAM_PATH.match(path) and worker.pending:
+                worker.pending.popleft() # The call's stream arrived; it now counts as live
+            return worker
+        worker = self.least_loaded()
+        if method == "POST" and path.startswith("/incoming_call"):
+            worker.pending.append(time.monotonic())
+        return worker
+
+    async def serve(self, listener: socket.socket):
+        loop = asyncio.get_running_loop()
+        for worker in self.workers:
+            loop.add_reader(worker.channel, self._read_load_report, worker)
+        while True:
+            conn, _ = await loop.sock_accept(listener)
+            asyncio.create_task(self._dispatch(conn))
+
+    def _read_load_report(self, worker: WorkerHandle):
+        try:
+            message = worker.channel.recv(64)
+        except BlockingIOError:
+            return
+        except OSError:
+            message = b""
+        if not message:
+            asyncio.get_running_loop().remove_reader(worker.channel)
+            return
+        if message.startswith(b"load "):
+            worker.live_calls = int(message[5:])
+
+    async def _dispatch(self, conn: socket.socket):
+        loop = asyncio.get_running_loop()
+        conn.setblocking(False)
+        try:
+            head = await asyncio.wait_for(self._read_head(conn), timeout=HEAD_TIMEOUT_S)
+            request_line = head.split(b"\r\n", 1)[0].decode("latin-1")
+            method, path = (request_line.split(" ") + ["", ""])[:2]
+            if path == "/cluster":
+                await self._respond_status(conn)
+                return
+            worker = self.route(method, path)
+            await self._hand_over(worker, conn, head)
+        except Exception as e:
+            logger.warning(f"Dropping connection during dispatch: {type(e).__name__} - {e}")
+        finally:
+            conn.close() # The worker has its own duplicate of the descriptor
+
+    async def _read_head(self, conn: socket.socket) -> bytes:
+        loop = asyncio.get_running_loop()
+        head = b""
+        while b"\r\n\r\n" not in head:
+            chunk = await loop.sock_recv(conn, 4096)
+            if not chunk:
+                raise ConnectionError("client closed before sending a request")
+            head += chunk
+            if len(head) > MAX_HEAD_BYTES:
+                raise ValueError("request head too large")
+        return head # Whatever was read (head and any body bytes) is replayed by the worker
+
+    async def _hand_over(self, worker: WorkerHandle, conn: socket.socket, prefix: bytes):
+        for _ in range(1000):
+            try:
+                socket.send_fds(worker.channel, [prefix], [conn.fileno()])
+                worker.routed += 1
+                return
+            except BlockingIOError:
+                await asyncio.sleep(0.001) # Worker is momentarily behind on taking connections
+        raise ConnectionError(f"worker {worker.index} is not accepting connections")
+
+    async def _respond_status(self, conn: socket.socket):
+        now = time.monotonic()
+        body = json.dumps({"workers": [w.status(now) for w in self.workers]}).encode()
+        response = (b"HTTP/1.1 200 OK\r\ncontent-type: application/json\r\n"
+                    + f"content-length: {len(body)}\r\nconnection: close\r\n\r\n".encode() + body)
+        await asyncio.get_running_loop().sock_sendall(conn, response)
+
+
+# --- Worker process ---
+
+class CloseAfterResponse:
+    """ASGI wrapper that ends every HTTP response with `Connection: close` (websockets pass through)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def send_closing(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), (b"connection", b"close")]}
+            await send(message)
+        await self.app(scope, receive, send_closing)
+
+
+async def _receive_connections(channel: socket.socket, server, config):
+    """Serves sockets handed over by the dispatcher with this worker's uvicorn protocol."""
+    loop = asyncio.get_running_loop()
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    def create_protocol():
+        return config.http_protocol_class(config=config, server_state=server.server_state,
+                                          app_state=server.lifespan.state)
+
+    ready = asyncio.Event()
+    loop.add_reader(channel, ready.set)
+    while not server.should_exit:
+        await ready.wait()
+        ready.clear()
+        while True:
+            try:
+                prefix, fds, _, _ = socket.recv_fds(channel, MAX_HEAD_BYTES + 4096, 1)
+            except BlockingIOError:
+                break
+            if not fds: # Dispatcher went away
+                server.should_exit = True
+                return
+            sock = socket.socket(fileno=fds[0])
+            sock.setblocking(False)
+            _, protocol = await loop.connect_accepted_socket(create_protocol, sock)
+            protocol.data_received(prefix) # Replay the request head the dispatcher read
+
+
+async def _report_load(channel: socket.socket, server):
+    """Tells the dispatcher this worker's live call count whenever it changes."""
+    main = sys.modules["main"]
+    last = None
+    while not server.should_exit:
+        count = len(main.active_calls)
+        if count != last:
+            try:
+                channel.send(f"load {count}".encode())
+                last = count
+            except BlockingIOError:
+                pass
+        await asyncio.sleep(LOAD_REPORT_INTERVAL_S)
+
+
+def worker_main(index: int, channel: socket.socket, setup: str = None):
+    os.environ["WORKER_ID"] = str(index) # main.py builds /audio_stream/w<index> stream URLs from this
+    import uvicorn
+    if setup: # e.g. "bench_cluster:install_fake_gemini" for load tests
+        module_name, func_name = setup.split(":")
+        __import__(module_name)
+        getattr(sys.modules[module_name], func_name)()
+
+    config = uvicorn.Config("main:app", lifespan="on", ws_ping_interval=20, ws_ping_timeout=20,
+                            loop="asyncio", log_level="info")
+    config.load() # Imports main
+    config.loaded_app = CloseAfterResponse(config.loaded_app) # The next request must be routed afresh
+    from drain import DrainingServer
+    server = DrainingServer(config, sys.modules["main"].drain) # SIGTERM drains this worker's calls
+    channel.setblocking(False)
+
+    async def run():
+        tasks = [asyncio.create_task(_receive_connections(channel, server, config)),
+                 asyncio.create_task(_report_load(channel, server))]
+        await server.serve(sockets=[]) # No listener of its own: connections come from the dispatcher
+        for task in tasks:
+            task.cancel()
+
+    asyncio.run(run())
+
+
+# --- Entry point ---
+
+def start_workers(count: int, setup: str = None) -> list:
+    context = multiprocessing.get_context("spawn")
+    workers = []
+    for index in range(count):
+        parent_end, child_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        process = context.Process(target=worker_main, args=(index, child_end, setup), name=f"voice-worker-{index}")
+        process.start()
+        child_end.close()
+        parent_end.setblocking(False)
+        workers.append(WorkerHandle(index, process, parent_end))
+    return workers
+
+
+def stop_workers(workers: list, timeout: float = DRAIN_DEADLINE_S + 30.0):
+    """Drains every worker (SIGTERM), waiting up to `timeout` before killing stragglers."""
+    for worker in workers:
+        if worker.process.is_alive():
+            os.kill(worker.process.pid, signal.SIGTERM)
+    deadline = time.monotonic() + timeout
+    for worker in workers:
+        worker.process.join(max(0.0, deadline - time.monotonic()))
+        if worker.process.is_alive():
+            worker.process.kill()
+
+
+def run(workers: int, host: str = "0.0.0.0", port: int = 5000, setup: str = None):
+    listener = socket.create_server((host, port), backlog=2048, reuse_port=False)
+    listener.setblocking(False)
+    handles = start_workers(workers, setup)
+    logger.info(f"Voice gateway cluster: {workers} workers behind http://{host}:{port}")
+
+    async def serve():
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        dispatcher = asyncio.create_task(Dispatcher(handles).serve(listener))
+        await stop.wait()
+        # Keep dispatching while workers drain: streams of calls they already answered still
+        # need to reach them, and their /incoming_call answers new callers with hold TwiML
+        logger.info("Draining workers...")
+        await asyncio.to_thread(stop_workers, handles)
+        dispatcher.cancel()
+
+    try:
+        asyncio.run(serve())
+    finally:
+        listener.close()
+        stop_workers(handles, timeout=5.0) # Only left running if the drain was interrupted
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--setup", default=None, help="module:function to call in each worker before serving")
+    args = parser.parse_args()
+    run(args.workers, args.host, args.port, args.setup)
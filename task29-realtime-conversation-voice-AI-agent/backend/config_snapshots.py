@@ -0,0 +1,121 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from metrics import MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigSnapshot:
+    """
+    One immutable version of the call configuration: system prompt, tool
+    registry (functions and their declarations) and the LiveConnectConfig built from them.
+
+    A call keeps the snapshot its Gemini session was opened with for its whole
+    life (including resumed and compacted sessions), whatever is reloaded meanwhile.
+    """
+
+    def __init__(self, version: int, digest: str, system_prompt: str, tools, live_config):
+        self.version = version
+        self.digest = digest
+        self.system_prompt = system_prompt
+        self.tools = tools
+        self.live_config = live_config
+        self.loaded_at = time.time()
+
+    def describe(self) -> dict:
+        return {"version": self.version, "digest": self.digest[:12], "loaded_at": self.loaded_at}
+
+
+class SnapshotStore:
+    """
+    Holds the current ConfigSnapshot and replaces it when its source files change.
+
+    A background task checks the sources' mtimes every `poll_interval_s`;
+    when one changed, their contents are hashed and, if different, `build()`
+    makes the next version. A build that fails (e.g. a syntax error in the
+    tools module) is logged and the current version stays in place.
+
+    Args:
+        build: Returns `(system_prompt, tools, live_config)` from the current sources.
+        sources: Files the snapshot is built from.
+        poll_interval_s: How often to look for changes (0 disables the watcher).
+        registry: Receives the `config_version` gauge.
+    """
+
+    def __init__(self, build, sources: list, poll_interval_s: float = 2.0, registry: MetricsRegistry = None):
+        self._build = build
+        self.sources = sources
+        self.poll_interval = poll_interval_s
+        self.registry = registry
+        self._mtimes = None
+        self._current = None
+        self._task = None
+        self.failed_reloads = 0
+        self.reload()
+
+    @property
+    def current(self) -> ConfigSnapshot:
+        return self._current
+
+    def _digest(self) -> str:
+        digest = hashlib.sha256()
+        for path in self.sources:
+            with open(path, "rb") as f:
+                digest.update(f.read())
+        return digest.hexdigest()
+
+    def reload(self) -> bool:
+        """Builds a new version if the sources' contents changed. Returns True if it did."""
+        self._mtimes = [os.stat(path).st_mtime_ns for path in self.sources]
+        digest = self._digest()
+        if self._current is not None and digest == self._current.digest:
+            return False
+        try:
+            system_prompt, tools, live_config = self._build()
+        except Exception as e:
+            if self._current is None:
+                raise
+            self.failed_reloads += 1
+            logger.error(f"Config reload failed, keeping version {self._current.version}: {type(e).__name__} - {e}")
+            return False
+        version = self._current.version + 1 if self._current else 1
+        self._current = ConfigSnapshot(version, digest, system_prompt, tools, live_config)
+        if self.registry:
+            self.registry.set_gauge("config_version", version)
+        logger.info(f"Call config version {version} loaded ({digest[:12]}) from {', '.join(self.sources)}")
+        return True
+
+    def changed(self) -> bool:
+        """Cheap check: has any source's mtime moved since the last reload?"""
+        try:
+            return [os.stat(path).st_mtime_ns for path in self.sources] != self._mtimes
+        except OSError:
+            return False # Mid-save; look again next time
+
+    def start(self):
+        if self.poll_interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._watch(), name="config-snapshot-watcher")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            if self.changed():
+                try:
+                    self.reload()
+                except OSError as e:
+                    logger.warning(f"Config sources unreadable, will retry: {e}")
+
+    def stats(self) -> dict:
+        return {**self._current.describe(), "sources": self.sources, "failed_reloads": self.failed_reloads}
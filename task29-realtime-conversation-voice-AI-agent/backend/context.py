@@ -0,0 +1,111 @@
+import logging
+from collections import deque
+from google.genai import types
+from metrics import MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+USER = "user"
+MODEL = "model"
+
+
+class ConversationTranscript:
+    """
+    Rolling text transcript of a call, built from Gemini's audio transcriptions.
+
+    Audio turns cost far more context tokens than their text, so a session
+    can be compacted by starting a fresh one seeded with this transcript.
+    Transcription fragments arrive incrementally and are merged into the
+    current turn; only the most recent `max_turns` turns are kept.
+    """
+
+    def __init__(self, max_turns: int = 40, max_chars: int = 6000):
+        self._turns = deque(maxlen=max_turns) # [role, text]
+        self.max_chars = max_chars
+
+    def add(self, role: str, text: str):
+        if not text:
+            return
+        if self._turns and self._turns[-1][0] == role:
+            self._turns[-1][1] += text
+        else:
+            self._turns.append([role, text])
+
+    def add_note(self, text: str):
+        """Records a non-spoken fact the model should keep, e.g. a tool result."""
+        self._turns.append([MODEL, f"[{text}]"])
+
+    def __len__(self) -> int:
+        return len(self._turns)
+
+    def as_contents(self) -> list:
+        """The newest turns that fit in `max_chars`, oldest first, as Gemini Content objects."""
+        contents = []
+        remaining = self.max_chars
+        for role, text in reversed(self._turns):
+            text = text.strip()
+            if not text:
+                continue
+            if len(text) > remaining:
+                break
+            remaining -= len(text)
+            contents.append(types.Content(role=role, parts=[types.Part(text=text)]))
+        contents.reverse()
+        # Gemini expects the history to start with a user turn
+        while contents and contents[0].role != USER:
+            contents.pop(0)
+        return contents
+
+
+class ContextMonitor:
+    """
+    Tracks one call's context size from `usage_metadata` and decides when to compact.
+
+    The server-side sliding window (LiveConnectConfig.context_window_compression)
+    is the first line of defence; compaction here is a backstop for when the
+    context still grows past `compact_tokens` (e.g. compression disabled, or
+    long tool results). Tokens per turn feed the `context_prompt_tokens`
+    histogram so growth over a call is visible.
+
+    Args:
+        compact_tokens: Prompt size that triggers a compaction (0 disables).
+        registry: Receives the token histogram and compaction gauge.
+    """
+
+    def __init__(self, compact_tokens: int = 0, registry: MetricsRegistry = None):
+        self.compact_tokens = compact_tokens
+        self.registry = registry
+        self.prompt_tokens = 0
+        self.total_tokens = 0
+        self.peak_prompt_tokens = 0
+        self.compactions = 0
+        self._compaction_due = False
+
+    def on_usage(self, usage):
+        self.prompt_tokens = usage.prompt_token_count or 0
+        self.total_tokens = usage.total_token_count or self.total_tokens
+        self.peak_prompt_tokens = max(self.peak_prompt_tokens, self.prompt_tokens)
+        if self.registry:
+            self.registry.observe("context_prompt_tokens", self.prompt_tokens)
+        if self.compact_tokens and self.prompt_tokens >= self.compact_tokens and not self._compaction_due:
+            logger.warning(f"Gemini context at {self.prompt_tokens} prompt tokens (threshold {self.compact_tokens}). Compaction due.")
+            self._compaction_due = True
+
+    @property
+    def compaction_due(self) -> bool:
+        return self._compaction_due
+
+    def compacted(self):
+        self._compaction_due = False
+        self.compactions += 1
+        self.prompt_tokens = 0
+        if self.registry:
+            self.registry.add_gauge("context_compactions", 1)
+
+    def stats(self) -> dict:
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "peak_prompt_tokens": self.peak_prompt_tokens,
+            "total_tokens": self.total_tokens,
+            "compactions": self.compactions,
+        }
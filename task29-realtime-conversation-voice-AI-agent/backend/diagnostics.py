@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+from metrics import MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+CALL_TASK_SEPARATOR = "/" # Per-call tasks are named "<call tag>/<role>", e.g. "call-12/twilio_sender"
+
+
+def call_task_name(call_tag: str, role: str) -> str:
+    return f"{call_tag}{CALL_TASK_SEPARATOR}{role}"
+
+
+def tasks_per_call() -> dict:
+    """Counts live asyncio tasks by call tag (tasks without one are grouped under "other")."""
+    counts = Counter()
+    for task in asyncio.all_tasks():
+        name = task.get_name()
+        tag = name.split(CALL_TASK_SEPARATOR, 1)[0] if CALL_TASK_SEPARATOR in name else "other"
+        counts[tag] += 1
+    return dict(counts)
+
+
+def describe_callback(callback) -> dict:
+    """
+    Attributes an event-loop callback to the code that ran in it.
+
+    Task steps are resolved to the task name and its coroutine (qualified
+    name, plus the file:line where it is now suspended, i.e. the await right
+    after the code that blocked). Plain callbacks report their function name.
+    """
+    owner = getattr(callback, "__self__", None)
+    if isinstance(owner, asyncio.Task):
+        coro = owner.get_coro()
+        frame = getattr(coro, "cr_frame", None)
+        return {
+            "task": owner.get_name(),
+            "coroutine": getattr(coro, "__qualname__", repr(coro)),
+            "location": f"{frame.f_code.co_filename}:{frame.f_lineno}" if frame else None,
+        }
+    func = getattr(callback, "func", callback) # functools.partial
+    return {
+        "task": None,
+        "coroutine": getattr(func, "__qualname__", repr(func)),
+        "location": None,
+    }
+
+
+class SlowCallbackDetector:
+    """
+    Times every event-loop callback and records the ones that block too long.
+
+    Wraps `asyncio.Handle._run`, the one place every callback and task step
+    goes through, so it works with uvicorn's loop without asyncio debug mode
+    (whose per-callback overhead is far higher). Cost is two perf_counter
+    calls per callback; attribution only happens for slow ones.
+
+    Args:
+        threshold_ms: Callbacks running longer than this are recorded and logged.
+        registry: Receives a `slow_callback_seconds` histogram and `slow_callbacks` gauge.
+        history: Number of recent slow callbacks kept for the diagnostics endpoint.
+    """
+
+    def __init__(self, threshold_ms: float = 20.0, registry: MetricsRegistry = None, history: int = 100):
+        self.threshold = threshold_ms / 1000.0
+        self.registry = registry
+        self.recent = deque(maxlen=history)
+        self.count = 0
+        self._original_run = None
+
+    def install(self):
+        if self._original_run is not None:
+            return
+        original_run = asyncio.events.Handle._run
+        detector = self
+        perf_counter = time.perf_counter
+
+        def _timed_run(handle):
+            started = perf_counter()
+            original_run(handle)
+            elapsed = perf_counter() - started
+            if elapsed >= detector.threshold:
+                detector._record(handle, elapsed)
+
+        self._original_run = original_run
+        asyncio.events.Handle._run = _timed_run
+        logger.info(f"Slow-callback detector installed (threshold {self.threshold * 1000:.0f} ms)")
+
+    def uninstall(self):
+        if self._original_run is not None:
+            asyncio.events.Handle._run = self._original_run
+            self._original_run = None
+
+    def _record(self, handle, elapsed: float):
+        try:
+            culprit = describe_callback(handle._callback)
+        except Exception as e: # Never let diagnostics break the loop
+            culprit = {"task": None, "coroutine": f"<unknown: {e}>", "location": None}
+        self.count += 1
+        self.recent.append({"at": time.time(), "duration_ms": elapsed * 1000.0, **culprit})
+        if self.registry:
+            self.registry.observe("slow_callback_seconds", elapsed)
+            self.registry.set_gauge("slow_callbacks", self.count)
+        logger.warning(f"Event loop blocked for {elapsed * 1000:.1f} ms by {culprit['coroutine']} "
+                       f"(task {culprit['task']}, at {culprit['location']})")
+
+
+class LoopLagMonitor:
+    """
+    Samples event-loop lag: how late a timer fires compared to when it was due.
+
+    Any callback that blocks the loop delays every call's audio by the same
+    amount, so this is the jitter all calls on the worker share.
+
+    Args:
+        interval_ms: Sampling period.
+        registry: Receives a `loop_lag_seconds` histogram and `loop_lag_ms` gauge.
+        recent_window_s: Span of samples behind `recent_max_lag`.
+    """
+
+    def __init__(self, interval_ms: float = 100.0, registry: MetricsRegistry = None, recent_window_s: float = 1.0):
+        self.interval = interval_ms / 1000.0
+        self.registry = registry
+        self.recent = deque(maxlen=max(1, int(recent_window_s / self.interval)))
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.samples = 0
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="loop-lag-monitor")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            due = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - due)
+            self.last_lag = lag
+            self.recent.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            self.samples += 1
+            if self.registry:
+                self.registry.observe("loop_lag_seconds", lag)
+                self.registry.set_gauge("loop_lag_ms", lag * 1000.0)
+
+    @property
+    def recent_max_lag(self) -> float:
+        """Worst lag in seconds over the last `recent_window_s`, steadier than a single sample."""
+        return max(self.recent, default=0.0)
+
+    def stats(self) -> dict:
+        return {
+            "interval_ms": self.interval * 1000.0,
+            "last_lag_ms": self.last_lag * 1000.0,
+            "recent_max_lag_ms": self.recent_max_lag * 1000.0,
+            "max_lag_ms": self.max_lag * 1000.0,
+            "samples": self.samples,
+        }
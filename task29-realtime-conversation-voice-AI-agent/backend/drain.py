@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import os
+import signal
+import time
+import uvicorn
+from metrics import MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+SERVING = "serving"
+DRAINING = "draining"
+DRAINED = "drained"
+
+
+class DrainController:
+    """
+    Takes a worker out of service without cutting off the calls it is handling.
+
+    `begin()` (from SIGTERM or the admin endpoint) switches to draining:
+    /incoming_call stops admitting calls, and the calls already in progress
+    (or answered and about to stream) run until they end or `deadline_s`
+    passes. Then `on_drained` ends the process; by default it sends this
+    process SIGTERM, which a plain uvicorn answers with its usual graceful
+    shutdown (closing any calls still left after the deadline).
+
+    Args:
+        deadline_s: Longest wait for calls in progress.
+        live_calls: Returns the number of calls still in progress.
+        registry: Receives the `draining` and `drain_remaining_calls` gauges.
+    """
+
+    def __init__(self, deadline_s: float, live_calls, registry: MetricsRegistry = None,
+                 poll_interval_s: float = 0.5):
+        self.deadline = deadline_s
+        self.live_calls = live_calls
+        self.registry = registry
+        self.poll_interval = poll_interval_s
+        self.on_drained = lambda: os.kill(os.getpid(), signal.SIGTERM)
+        self.state = SERVING
+        self.reason = None
+        self.started_at = None
+        self.abandoned_calls = 0
+        self._task = None
+
+    @property
+    def draining(self) -> bool:
+        return self.state != SERVING
+
+    def begin(self, reason: str) -> bool:
+        """Starts draining. Returns False if already draining."""
+        if self.state != SERVING:
+            return False
+        self.state = DRAINING
+        self.reason = reason
+        self.started_at = time.monotonic()
+        if self.registry:
+            self.registry.set_gauge("draining", 1)
+        logger.warning(f"Draining ({reason}): refusing new calls, waiting up to {self.deadline:.0f} s "
+                       f"for {self.live_calls()} calls in progress.")
+        self._task = asyncio.create_task(self._run(), name="drain")
+        return True
+
+    async def _run(self):
+        while True:
+            remaining = self.live_calls()
+            if self.registry:
+                self.registry.set_gauge("drain_remaining_calls", remaining)
+            elapsed = time.monotonic() - self.started_at
+            if remaining == 0 or elapsed >= self.deadline:
+                break
+            await asyncio.sleep(self.poll_interval)
+        self.abandoned_calls = remaining
+        self.state = DRAINED
+        if remaining:
+            logger.warning(f"Drain deadline reached after {elapsed:.1f} s with {remaining} calls still in progress; they will be closed.")
+        else:
+            logger.info(f"Drained after {elapsed:.1f} s: no calls in progress.")
+        self.on_drained()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "reason": self.reason,
+            "deadline_s": self.deadline,
+            "draining_for_s": time.monotonic() - self.started_at if self.started_at else None,
+            "live_calls": self.live_calls(),
+            "abandoned_calls": self.abandoned_calls,
+        }
+
+
+class DrainingServer(uvicorn.Server):
+    """
+    uvicorn server whose first SIGTERM drains calls instead of shutting down.
+
+    The server exits on its own once drained (exit status 0). A second
+    SIGTERM, or SIGINT at any time, shuts down right away as uvicorn normally does.
+    """
+
+    def __init__(self, config: uvicorn.Config, drain: DrainController):
+        super().__init__(config)
+        self.drain = drain
+        self._loop = None
+        drain.on_drained = self._exit
+
+    async def serve(self, sockets=None):
+        self._loop = asyncio.get_running_loop()
+        await super().serve(sockets=sockets)
+
+    def _exit(self):
+        self.should_exit = True
+
+    def handle_exit(self, sig, frame):
+        if sig == signal.SIGTERM and self.drain.state == SERVING and self._loop is not None:
+            self._loop.call_soon_threadsafe(self.drain.begin, "SIGTERM")
+            return
+        super().handle_exit(sig, frame)
@@ -0,0 +1,91 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Hot-path event kinds (short strings, interned, so recording allocates only the tuple)
+TWILIO_MEDIA_IN = "twilio_in"         # a: mulaw bytes
+GEMINI_AUDIO_OUT = "gemini_out"       # a: PCM bytes sent to Gemini
+GEMINI_AUDIO_IN = "gemini_in"         # a: PCM bytes received from Gemini
+OUTBOUND_QUEUED = "queued"            # a: mulaw bytes queued for Twilio
+OUTBOUND_STALE = "stale"              # a: mulaw bytes dropped (converted for an interrupted turn)
+OUTBOUND_CARRY = "carry"              # conversion produced no output yet (odd byte carried)
+TWILIO_FRAMES_OUT = "twilio_out"      # a: media frames sent, b: marks sent in this batch
+MARK_SENT = "mark_sent"               # a: mark name
+MARK_ECHO = "mark_echo"               # a: mark name, b: ms since sent
+VAD_EVENT = "vad"                     # a: speech_start / speech_end
+BARGE_IN = "barge_in"                 # a: frames dropped, b: ms to silence
+SESSION_SWITCH = "session_switch"     # a: reason, b: switchover gap in ms
+CLIP_PLAYED = "clip"                  # a: clip name, b: mulaw bytes queued
+
+
+class CallEventLog:
+    """
+    Fixed-size in-memory ring of hot-path events for one call.
+
+    Recording appends a `(monotonic time, kind, a, b)` tuple to a
+    preallocated list; nothing is formatted and no handler runs. The ring is
+    written to the real logger only when asked:
+      - `flush()` at call end (at `flush_level`, DEBUG by default, so INFO stays readable),
+      - `flush(logging.ERROR, reason)` on errors, giving the events leading up to them,
+      - every `sample_every`-th event, which is logged on its own as a sample.
+
+    Args:
+        call_tag: Prefix for flushed lines.
+        capacity: Events kept; older ones are overwritten.
+        sample_every: Log one event in this many as it happens (0 disables sampling).
+        flush_level: Level used by `flush()` when none is given.
+    """
+
+    def __init__(self, call_tag: str, capacity: int = 1024, sample_every: int = 0,
+                 flush_level: int = logging.DEBUG):
+        self.call_tag = call_tag
+        self.capacity = max(1, capacity)
+        self.sample_every = sample_every
+        self.flush_level = flush_level
+        self._events = [None] * self.capacity
+        self._next = 0 # Total events recorded; the write index is this modulo capacity
+        self._flushed = 0 # Events already written out by a flush
+        self.started_at = time.monotonic()
+
+    def record(self, kind: str, a=None, b=None):
+        event = (time.monotonic(), kind, a, b)
+        self._events[self._next % self.capacity] = event
+        self._next += 1
+        if self.sample_every and self._next % self.sample_every == 0:
+            logger.info(f"[{self.call_tag}] sample #{self._next}: {self._format(event)}")
+
+    def __len__(self) -> int:
+        return min(self._next, self.capacity)
+
+    def events(self) -> list:
+        """Buffered events, oldest first."""
+        if self._next <= self.capacity:
+            return self._events[:self._next]
+        start = self._next % self.capacity
+        return self._events[start:] + self._events[:start]
+
+    def _format(self, event) -> str:
+        at, kind, a, b = event
+        fields = " ".join(str(value) for value in (a, b) if value is not None)
+        return f"+{(at - self.started_at) * 1000:9.1f} ms {kind} {fields}".rstrip()
+
+    def flush(self, level: int = None, reason: str = "call end"):
+        """
+        Writes events not yet flushed to the logger in one record, oldest first.
+
+        Formatting only happens if the logger is enabled for `level`. Events
+        overwritten before a flush are reported as a count.
+        """
+        level = self.flush_level if level is None else level
+        pending = self._next - self._flushed
+        if pending <= 0 or not logger.isEnabledFor(level):
+            self._flushed = self._next
+            return
+        events = self.events()[-min(pending, self.capacity):]
+        overwritten = pending - len(events)
+        lines = [f"[{self.call_tag}] {len(events)} hot-path events ({reason})"
+                 + (f", {overwritten} older events overwritten" if overwritten else "") + ":"]
+        lines.extend(f"  {self._format(event)}" for event in events)
+        logger.log(level, "\n".join(lines))
+        self._flushed = self._next
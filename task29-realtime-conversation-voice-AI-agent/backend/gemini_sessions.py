@@ -0,0 +1,413 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from metrics import MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+CONNECT_RETRY_SECONDS = 5.0 # Back-off after a failed warm-up connect
+MAX_BUFFERED_SENDS = 500 # Inbound messages held during a switchover (~30 s of coalesced audio)
+
+
+def parse_duration_seconds(value) -> float:
+    """Parses a protobuf duration string such as "9.5s" (as in GoAway.time_left). None if unparseable."""
+    try:
+        return float(str(value).rstrip("s"))
+    except (TypeError, ValueError):
+        return None
+
+
+class WarmSession:
+    """An open Gemini Live session, the context manager that owns it and the config snapshot it was opened with."""
+
+    def __init__(self, context_manager, session, opened_at: float, snapshot=None):
+        self.context_manager = context_manager
+        self.session = session
+        self.opened_at = opened_at
+        self.snapshot = snapshot
+
+
+class GeminiSessionPool:
+    """
+    Keeps Gemini Live sessions connected ahead of the calls that will use them.
+
+    `/incoming_call` leases a session for the call SID: an idle warm one if
+    available, otherwise a connect is started right away so it overlaps the
+    TwiML greeting. When the Twilio stream starts, `session(call_sid)` hands
+    that session over, so the caller no longer waits for the connect handshake.
+    A background task keeps `size` idle sessions ready, recycles idle ones
+    after `idle_ttl_s` (before the server would time them out), and closes
+    leases that no stream claimed within `lease_ttl_s`. Idle sessions opened
+    with an older config snapshot are recycled as soon as a new one is loaded.
+
+    Args:
+        connect: Callable taking `config=` and returning a
+            `client.aio.live.connect(...)` context manager.
+        current_snapshot: Returns the ConfigSnapshot new sessions are opened with.
+        size: Idle sessions to keep warm (0 only leases per call).
+        idle_ttl_s: Max age of an idle warm session.
+        lease_ttl_s: How long a leased session waits for its stream.
+        registry: Receives connect/wait histograms and pool gauges.
+    """
+
+    def __init__(self, connect, current_snapshot, size: int = 2, idle_ttl_s: float = 120.0, lease_ttl_s: float = 30.0,
+                 registry: MetricsRegistry = None):
+        self._connect = connect
+        self._current_snapshot = current_snapshot
+        self.size = size
+        self.idle_ttl = idle_ttl_s
+        self.lease_ttl = lease_ttl_s
+        self.registry = registry
+        self._idle = deque() # WarmSession, oldest first
+        self._leases = {} # call SID -> (future resolving to a WarmSession, leased at)
+        self._connecting = 0
+        self._retry_after = 0.0
+        self._wake = None
+        self._maintainer = None
+        # Counters
+        self.hits = 0   # Calls served by a session that was already connected
+        self.misses = 0 # Calls that had to wait for (part of) a connect
+
+    async def start(self):
+        self._wake = asyncio.Event()
+        self._maintainer = asyncio.create_task(self._maintain(), name="gemini-session-pool")
+
+    async def close(self):
+        if self._maintainer:
+            self._maintainer.cancel()
+            try:
+                await self._maintainer
+            except asyncio.CancelledError:
+                pass
+        for future, _ in self._leases.values():
+            if future.done() and not future.cancelled() and not future.exception():
+                await self._close(future.result())
+            else:
+                future.cancel()
+        self._leases.clear()
+        while self._idle:
+            await self._close(self._idle.popleft())
+
+    # --- Leasing ---
+
+    def lease(self, call_sid: str):
+        """Reserves a session for a call that is about to connect its stream."""
+        if not call_sid or call_sid in self._leases:
+            return
+        warm = self._take_idle()
+        if warm:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(warm)
+        else:
+            future = asyncio.ensure_future(self._open())
+        self._leases[call_sid] = (future, time.monotonic())
+        self._notify()
+
+    @asynccontextmanager
+    async def session(self, call_sid: str = None, resume_config=None):
+        """
+        Yields the call's ResumableSession and closes it afterwards.
+
+        Uses the call's lease if there is one, else an idle warm session,
+        else connects now (a cold start). `resume_config(live_config, handle)`
+        builds the config for replacement sessions; without it the session can't be resumed.
+        """
+        started = time.monotonic()
+        entry = self._leases.pop(call_sid, None) if call_sid else None
+        if entry:
+            future = entry[0]
+            ready = future.done()
+            warm = await future
+        elif warm := self._take_idle():
+            ready = True
+        else:
+            ready = False
+            warm = await self._open()
+        self._notify()
+
+        waited = time.monotonic() - started
+        if ready:
+            self.hits += 1
+        else:
+            self.misses += 1
+        if self.registry:
+            self.registry.observe("session_wait_seconds", waited)
+            self.registry.set_gauge("session_pool_hits", self.hits)
+            self.registry.set_gauge("session_pool_misses", self.misses)
+        logger.info(f"Gemini session for call {call_sid} ready after {waited * 1000:.0f} ms "
+                    f"({'warm' if ready else 'connect in progress'}, session age {time.monotonic() - warm.opened_at:.1f} s)")
+        resumable = ResumableSession(self, warm, resume_config, registry=self.registry)
+        try:
+            yield resumable
+        finally:
+            await resumable.close()
+
+    # --- Internals ---
+
+    def _take_idle(self) -> WarmSession:
+        """Oldest idle session on the current config, if any; outdated ones are closed on the way."""
+        current = self._current_snapshot()
+        while self._idle:
+            warm = self._idle.popleft()
+            if warm.snapshot is current:
+                return warm
+            asyncio.create_task(self._close(warm))
+        return None
+
+    def _notify(self):
+        if self._wake:
+            self._wake.set()
+
+    async def _open(self, snapshot=None, config=None) -> WarmSession:
+        """Opens a session on `snapshot` (default: the current one), with `config` overriding its live config."""
+        started = time.monotonic()
+        snapshot = snapshot or self._current_snapshot()
+        context_manager = self._connect(config=config or snapshot.live_config)
+        session = await context_manager.__aenter__()
+        opened_at = time.monotonic()
+        if self.registry:
+            self.registry.observe("session_connect_seconds", opened_at - started)
+        return WarmSession(context_manager, session, opened_at, snapshot)
+
+    async def _close(self, warm: WarmSession):
+        try:
+            await warm.context_manager.__aexit__(None, None, None)
+        except Exception as e:
+            logger.warning(f"Error closing Gemini session: {type(e).__name__} - {e}")
+
+    async def _refill(self):
+        self._connecting += 1
+        try:
+            self._idle.append(await self._open())
+        except Exception as e:
+            logger.error(f"Failed to pre-warm Gemini session: {type(e).__name__} - {e}")
+            self._retry_after = time.monotonic() + CONNECT_RETRY_SECONDS
+        finally:
+            self._connecting -= 1
+            self._notify()
+
+    async def _maintain(self):
+        while True:
+            now = time.monotonic()
+            # Recycle idle sessions before the server drops them, and any opened with an outdated config
+            current = self._current_snapshot()
+            for warm in [w for w in self._idle if now - w.opened_at > self.idle_ttl or w.snapshot is not current]:
+                self._idle.remove(warm)
+                asyncio.create_task(self._close(warm))
+            # Close leases no stream claimed (e.g. the caller hung up during the greeting)
+            for call_sid, (future, leased_at) in list(self._leases.items()):
+                if now - leased_at > self.lease_ttl:
+                    del self._leases[call_sid]
+                    logger.info(f"Releasing unclaimed Gemini session lease for call {call_sid}")
+                    future.add_done_callback(self._close_abandoned)
+            # Top up the warm pool
+            if now >= self._retry_after:
+                for _ in range(self.size - len(self._idle) - self._connecting):
+                    asyncio.create_task(self._refill())
+            if self.registry:
+                self.registry.set_gauge("session_pool_idle", len(self._idle))
+                self.registry.set_gauge("session_pool_leased", len(self._leases))
+
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+
+    def _close_abandoned(self, future):
+        if not future.cancelled() and not future.exception():
+            asyncio.create_task(self._close(future.result()))
+
+    @property
+    def leased(self) -> int:
+        """Calls answered at /incoming_call whose stream hasn't claimed its session yet."""
+        return len(self._leases)
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "idle": len(self._idle),
+            "connecting": self._connecting,
+            "leased": len(self._leases),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class ResumableSession:
+    """
+    One call's Gemini Live session, replaceable mid-call via session resumption.
+
+    Stands in for the live session object (`send_realtime_input`,
+    `send_client_content`, `send_tool_response`, `receive`). The receiver
+    feeds it resumption handles and GoAway notices:
+      - on GoAway, the replacement session is connected right away with the
+        latest handle, while the old one keeps serving the current turn;
+      - `switch()` (at the next turn boundary, or when the old connection
+        drops) splices the replacement in. Sends made while switching, or that
+        fail on a dropped connection, are buffered and replayed in order on the
+        new session, so no caller audio is lost.
+    Switchover gaps go to the `session_switchover_seconds` histogram.
+    """
+
+    def __init__(self, pool: GeminiSessionPool, warm: WarmSession, resume_config=None,
+                 registry: MetricsRegistry = None):
+        self._pool = pool
+        self._warm = warm
+        self._resume_config = resume_config
+        self.registry = registry
+        self.handle = None # Latest resumable state from session_resumption_update
+        self._next = None # Task connecting the replacement session
+        self._switching = False
+        self._broken = False # A send failed; hold sends until the switch
+        self._closed = False
+        self._buffered = deque(maxlen=MAX_BUFFERED_SENDS) # (method name, kwargs)
+        # Counters
+        self.switchovers = 0
+        self.switchover_gaps = []
+
+    @property
+    def session(self):
+        return self._warm.session
+
+    @property
+    def snapshot(self):
+        """The config snapshot this call runs on; kept across resumption and compaction."""
+        return self._warm.snapshot
+
+    @property
+    def can_resume(self) -> bool:
+        return (not self._closed and self._resume_config is not None
+                and (self.handle is not None or self._next is not None))
+
+    @property
+    def resume_pending(self) -> bool:
+        """A GoAway arrived and a replacement is connecting (or connected)."""
+        return self._next is not None
+
+    # --- Resumption bookkeeping ---
+
+    def on_resumption_update(self, update):
+        if update.resumable and update.new_handle:
+            self.handle = update.new_handle
+
+    def on_go_away(self, time_left=None):
+        """Starts connecting the replacement now, well before `time_left` runs out."""
+        if self._next is not None:
+            return
+        if not self.can_resume:
+            logger.warning(f"Gemini GoAway (time left {time_left}) but no resumption handle yet; the call will end with the session.")
+            return
+        seconds = parse_duration_seconds(time_left)
+        logger.info(f"Gemini GoAway: connecting replacement session now ({seconds if seconds is not None else '?'} s left on current).")
+        self._next = asyncio.create_task(self._open_resumed())
+
+    def _open_resumed(self):
+        return self._pool._open(self.snapshot, self._resume_config(self.snapshot.live_config, self.handle))
+
+    async def switch(self, reason: str) -> bool:
+        """
+        Replaces the current session with the resumed one and replays buffered sends.
+
+        Returns:
+            True if the call continues on a new session.
+        """
+        if not self.can_resume:
+            return False
+        started = time.monotonic()
+        self._switching = True
+        try:
+            if self._next is None:
+                self._next = asyncio.create_task(self._open_resumed())
+            new_warm = await self._next
+        except Exception as e:
+            logger.error(f"Gemini session resumption failed ({reason}): {type(e).__name__} - {e}")
+            self._switching = False
+            return False
+        finally:
+            self._next = None
+        await self._splice(new_warm, started, reason)
+        return True
+
+    async def compact(self, seed_contents: list) -> bool:
+        """
+        Moves the call to a fresh session seeded with a text history, dropping
+        the accumulated audio context. Call between turns.
+
+        Returns:
+            True if the call continues on the compacted session.
+        """
+        if self._closed or self._next is not None:
+            return False # A GoAway switch is already under way
+        started = time.monotonic()
+        self._switching = True
+        try:
+            new_warm = await self._pool._open(self.snapshot)
+            if seed_contents:
+                await new_warm.session.send_client_content(turns=seed_contents, turn_complete=False)
+        except Exception as e:
+            logger.error(f"Gemini context compaction failed: {type(e).__name__} - {e}")
+            self._switching = False
+            return False
+        self.handle = None # Handles from the old session would restore the old, large context
+        await self._splice(new_warm, started, "compaction")
+        return True
+
+    async def _splice(self, new_warm: WarmSession, started: float, reason: str):
+        """Makes `new_warm` current, replays sends buffered meanwhile and closes the old session."""
+        old_warm, self._warm = self._warm, new_warm
+        self._broken = False
+        try:
+            while self._buffered:
+                method, kwargs = self._buffered.popleft()
+                await getattr(new_warm.session, method)(**kwargs)
+        except Exception as e:
+            logger.error(f"Error replaying buffered input on new session: {type(e).__name__} - {e}")
+        self._switching = False
+        asyncio.create_task(self._pool._close(old_warm))
+
+        gap = time.monotonic() - started
+        self.switchovers += 1
+        self.switchover_gaps.append(gap)
+        if self.registry:
+            self.registry.observe("session_switchover_seconds", gap)
+        logger.info(f"Gemini session replaced ({reason}) after a {gap * 1000:.0f} ms switchover.")
+
+    async def close(self):
+        self._closed = True # The call is over; a receive error now is not a drop to recover from
+        if self._next is not None:
+            self._next.cancel()
+            try:
+                await self._pool._close(await self._next)
+            except BaseException:
+                pass
+        await self._pool._close(self._warm)
+
+    # --- Session API ---
+
+    async def _send(self, method: str, kwargs: dict):
+        if self._switching or self._broken:
+            self._buffered.append((method, kwargs))
+            return
+        try:
+            await getattr(self.session, method)(**kwargs)
+        except Exception:
+            if not self.can_resume:
+                raise
+            # The connection dropped; the receiver sees it too and switches sessions
+            self._broken = True
+            self._buffered.append((method, kwargs))
+
+    async def send_realtime_input(self, **kwargs):
+        await self._send("send_realtime_input", kwargs)
+
+    async def send_client_content(self, **kwargs):
+        await self._send("send_client_content", kwargs)
+
+    async def send_tool_response(self, **kwargs):
+        await self._send("send_tool_response", kwargs)
+
+    def receive(self):
+        return self.session.receive()
@@ -0,0 +1,227 @@
+import logging
+import time
+from collections import deque
+import numpy as np
+from audio_codec import mulaw_level_dbfs
+from utils import GEMINI_INPUT_SAMPLE_RATE, GEMINI_INPUT_SAMPLE_WIDTH, TWILIO_SAMPLE_RATE
+
+logger = logging.getLogger(__name__)
+
+# Allowed payload sizes for one send_realtime_input call
+MIN_COALESCE_MS = 40
+MAX_COALESCE_MS = 100
+
+# Frames quieter than this are treated as non-speech for boundary detection
+DEFAULT_SPEECH_THRESHOLD_DBFS = -45.0
+
+
+def pcm16_level_dbfs(pcm_data: bytes) -> float:
+    """Returns the RMS level of 16-bit PCM in dBFS (-inf for digital silence)."""
+    samples = np.frombuffer(pcm_data, dtype="<i2").astype(np.float32)
+    if samples.size == 0:
+        return float("-inf")
+    mean_square = float(np.dot(samples, samples)) / samples.size
+    if mean_square == 0.0:
+        return float("-inf")
+    return float(10.0 * np.log10(mean_square / (32768.0 * 32768.0)))
+
+
+class InboundCoalescer:
+    """
+    Combines 20 ms inbound PCM frames into larger payloads for Gemini.
+
+    Frames are appended to a reusable buffer and released as one payload
+    when any of these happen:
+      - the buffer holds `coalesce_ms` of audio,
+      - the oldest buffered frame has waited `deadline_ms` of wall time
+        (check with `time_until_deadline()` / `flush_due()`),
+      - speech ends: a quiet frame follows a voiced one, so the end of an
+        utterance reaches Gemini's turn detection without waiting for the
+        buffer to fill.
+
+    Args:
+        coalesce_ms: Target payload duration, clamped to 40-100 ms.
+        deadline_ms: Max wall time a frame may sit in the buffer (defaults to coalesce_ms).
+        speech_threshold_dbfs: Level separating speech from line noise.
+    """
+
+    def __init__(self, coalesce_ms: int = 60, deadline_ms: float = None,
+                 speech_threshold_dbfs: float = DEFAULT_SPEECH_THRESHOLD_DBFS):
+        if not MIN_COALESCE_MS <= coalesce_ms <= MAX_COALESCE_MS:
+            logger.warning(f"Inbound coalesce size {coalesce_ms} ms outside {MIN_COALESCE_MS}-{MAX_COALESCE_MS} ms. Clamping.")
+            coalesce_ms = min(max(coalesce_ms, MIN_COALESCE_MS), MAX_COALESCE_MS)
+        self.coalesce_ms = coalesce_ms
+        self.target_bytes = GEMINI_INPUT_SAMPLE_RATE * GEMINI_INPUT_SAMPLE_WIDTH * coalesce_ms // 1000
+        self.deadline = (deadline_ms if deadline_ms is not None else coalesce_ms) / 1000.0
+        self.speech_threshold_dbfs = speech_threshold_dbfs
+        self._buffer = bytearray()
+        self._first_frame_at = None
+        self._in_speech = False
+        self.last_frame_speech = False # Speech decision for the most recent frame
+        # Counters
+        self.frames_in = 0
+        self.payloads_out = 0
+
+    def add(self, pcm_frame: bytes, is_speech: bool = None):
+        """
+        Buffers one frame.
+
+        Args:
+            pcm_frame: PCM 16kHz audio.
+            is_speech: Speech decision from an upstream VAD, if there is one;
+                otherwise the frame's level is checked here.
+
+        Returns:
+            The coalesced payload if this frame completed one, else None.
+        """
+        if not pcm_frame:
+            return None
+        self.frames_in += 1
+        if not self._buffer:
+            self._first_frame_at = time.monotonic()
+        self._buffer += pcm_frame
+
+        if is_speech is None:
+            is_speech = pcm16_level_dbfs(pcm_frame) >= self.speech_threshold_dbfs
+        speech_ended = self._in_speech and not is_speech
+        self._in_speech = is_speech
+        self.last_frame_speech = is_speech
+
+        if speech_ended or len(self._buffer) >= self.target_bytes:
+            return self.flush()
+        return None
+
+    def time_until_deadline(self):
+        """Seconds until the buffered audio must be flushed, or None if the buffer is empty."""
+        if not self._buffer:
+            return None
+        return max(0.0, self._first_frame_at + self.deadline - time.monotonic())
+
+    def flush_due(self) -> bool:
+        return bool(self._buffer) and time.monotonic() - self._first_frame_at >= self.deadline
+
+    def flush(self):
+        """Returns everything buffered as one payload (None if empty) and clears the buffer."""
+        if not self._buffer:
+            return None
+        payload = bytes(self._buffer)
+        self._buffer.clear()
+        self._first_frame_at = None
+        self.payloads_out += 1
+        return payload
+
+
+# Voice activity detection modes
+VAD_OFF = "off"           # Forward every frame
+VAD_SUPPRESS = "suppress" # Drop silence after the hangover; send audio_stream_end when speech stops
+VAD_ACTIVITY = "activity" # Drop silence and send explicit activity_start/activity_end to Gemini
+VAD_MODES = (VAD_OFF, VAD_SUPPRESS, VAD_ACTIVITY)
+
+# VoiceActivityDetector.process() events
+SPEECH_START = "speech_start"
+SPEECH_END = "speech_end"
+
+
+class VoiceActivityDetector:
+    """
+    Lightweight energy VAD for inbound mulaw (or PCM16) frames, with pre-roll and hangover.
+
+    Each mulaw frame's level comes from a μ-law power table (one vectorized
+    lookup, no decoding); PCM16 frames are measured directly. A frame is speech when it is `margin_db` above an adaptive
+    noise floor and above `threshold_dbfs`. Speech stays open for
+    `hangover_ms` after the last voiced frame so word gaps and the trailing
+    silence Gemini needs are still sent. While closed, the last `preroll_ms`
+    of audio is kept so onsets are not clipped; everything older is suppressed.
+
+    Args:
+        threshold_dbfs: Absolute minimum level for speech.
+        margin_db: How far above the noise floor speech must be.
+        hangover_ms: Silence forwarded after speech before suppressing.
+        preroll_ms: Audio replayed from before a detected onset.
+        frame_ms: Duration of one inbound frame.
+        pcm16: Frames are 16 kHz PCM16 (raw PCM streams) instead of 8 kHz mulaw.
+    """
+
+    def __init__(self, threshold_dbfs: float = DEFAULT_SPEECH_THRESHOLD_DBFS, margin_db: float = 9.0,
+                 hangover_ms: int = 400, preroll_ms: int = 200, frame_ms: int = 20, pcm16: bool = False):
+        self.pcm16 = pcm16
+        self.bytes_per_second = GEMINI_INPUT_SAMPLE_RATE * GEMINI_INPUT_SAMPLE_WIDTH if pcm16 else TWILIO_SAMPLE_RATE
+        self.threshold_dbfs = threshold_dbfs
+        self.margin_db = margin_db
+        self.frame_ms = frame_ms
+        self.hangover_frames = max(1, hangover_ms // frame_ms)
+        self._preroll = deque(maxlen=max(0, preroll_ms // frame_ms))
+        self.noise_floor_dbfs = threshold_dbfs - margin_db
+        self.in_speech = False
+        self.voiced = False # The most recent frame was above threshold (excludes hangover)
+        self._silent_run = 0
+        # Per-call counters
+        self.frames_total = 0
+        self.frames_suppressed = 0
+        self.bytes_suppressed = 0
+        self.speech_segments = 0
+
+    def _update_noise_floor(self, level: float):
+        if level == float("-inf"):
+            return
+        if level < self.noise_floor_dbfs:
+            self.noise_floor_dbfs = 0.7 * self.noise_floor_dbfs + 0.3 * level # Fall quickly
+        elif not self.in_speech:
+            self.noise_floor_dbfs += 0.02 * (level - self.noise_floor_dbfs) # Rise slowly in silence only
+
+    def process(self, frame: bytes) -> tuple:
+        """
+        Classifies one frame.
+
+        Returns:
+            (frames, event): the frames to forward now (pre-roll + this frame
+            at an onset, this frame during speech, nothing while suppressed)
+            and SPEECH_START, SPEECH_END or None.
+        """
+        self.frames_total += 1
+        level = pcm16_level_dbfs(frame) if self.pcm16 else mulaw_level_dbfs(np.frombuffer(frame, dtype=np.uint8))
+        voiced = level >= max(self.threshold_dbfs, self.noise_floor_dbfs + self.margin_db)
+        self.voiced = voiced
+        self._update_noise_floor(level)
+
+        if self.in_speech:
+            if voiced:
+                self._silent_run = 0
+                return [frame], None
+            self._silent_run += 1
+            if self._silent_run <= self.hangover_frames:
+                return [frame], None
+            self.in_speech = False
+            self._suppress(frame)
+            return [], SPEECH_END
+
+        if voiced:
+            self.in_speech = True
+            self._silent_run = 0
+            self.speech_segments += 1
+            frames = list(self._preroll) + [frame]
+            # Pre-roll frames were counted as suppressed when they were held back
+            self.frames_suppressed -= len(self._preroll)
+            self.bytes_suppressed -= sum(len(frame) for frame in self._preroll)
+            self._preroll.clear()
+            return frames, SPEECH_START
+
+        self._suppress(frame)
+        return [], None
+
+    def _suppress(self, frame: bytes):
+        self._preroll.append(frame)
+        self.frames_suppressed += 1
+        self.bytes_suppressed += len(frame)
+
+    def suppressed_seconds(self) -> float:
+        return self.bytes_suppressed / self.bytes_per_second
+
+    def stats(self) -> dict:
+        return {
+            "frames_total": self.frames_total,
+            "frames_suppressed": self.frames_suppressed,
+            "suppressed_seconds": self.suppressed_seconds(),
+            "speech_segments": self.speech_segments,
+            "noise_floor_dbfs": self.noise_floor_dbfs,
+        }
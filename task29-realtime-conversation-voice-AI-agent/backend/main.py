@@ -1,16 +1,38 @@
 import asyncio
-import base64
+import importlib
+import itertools
 import json
 import os
 import logging
+import time
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from fastapi import FastAPI, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.responses import PlainTextResponse
 from twilio.twiml.voice_response import VoiceResponse, Connect
 from google import genai
 from google.genai import types
-from utils import mulaw8k_to_pcm16k, pcm24k_to_mulaw8k
-from function_calling_utils import getMenu  # Import your function here
+from utils import AudioPipeline
+from transcoder import BatchTranscoder
+from inbound import (SPEECH_END, SPEECH_START, VAD_ACTIVITY, VAD_MODES, VAD_OFF,
+                     InboundCoalescer, VoiceActivityDetector, pcm16_level_dbfs)
+from outbound import MEDIA, OutboundScheduler
+from metrics import CallLatencyTracker, MetricsRegistry
+import event_log as ev
+from event_log import CallEventLog
+from gemini_sessions import GeminiSessionPool
+from context import MODEL, USER, ContextMonitor, ConversationTranscript
+from admission import AdmissionController
+from clips import APOLOGY, BUSY, FILLER, GREETING, HOLD, ClipCache
+from config_snapshots import SnapshotStore
+from drain import DrainController, DrainingServer
+from diagnostics import LoopLagMonitor, SlowCallbackDetector, call_task_name, tasks_per_call
+from audio_queues import (BACKPRESSURE, DROP_OLDEST, DROP_SILENCE, MULAW_BYTES_PER_MS, QUEUE_POLICIES,
+                          BoundedAudioQueue, mulaw_bytes_level_dbfs)
+from twilio_framing import TwilioMessageFormatter, parse_twilio_message
+from pcm_framing import INPUT_BYTES_PER_MS, OUTPUT_BYTES_PER_MS, InboundFramer, PcmMessageFormatter, parse_pcm_message
+import function_calling_utils # Tool functions, registered with their declarations
+from menu import menus # Menu data behind getMenu, reloaded from MENU_SOURCE when it changes
 
 # --- Configuration & Setup ---
 load_dotenv() # Load environment variables from .env file
@@ -30,7 +52,10 @@ if "YOUR_NGROK_OR_DEPLOYMENT_HOSTNAME" in YOUR_PUBLIC_HOSTNAME:
      logger.warning("PUBLIC_HOSTNAME not set in environment. Using placeholder. Replace with your actual ngrok or deployment hostname.")
 
 
-TWILIO_WEBSOCKET_URL = f"wss://{YOUR_PUBLIC_HOSTNAME}/audio_stream"
+# Under cluster.py each worker process gets a WORKER_ID; its stream URL routes the call's
+# media back to the worker that leased the call's Gemini session
+WORKER_ID = os.getenv("WORKER_ID")
+TWILIO_WEBSOCKET_URL = f"wss://{YOUR_PUBLIC_HOSTNAME}/audio_stream" + (f"/w{WORKER_ID}" if WORKER_ID is not None else "")
 logger.info(f"Twilio WebSocket URL: {TWILIO_WEBSOCKET_URL}")
 
 logger.debug(f"WebSocket URL for Twilio: {TWILIO_WEBSOCKET_URL}")
@@ -38,76 +63,7 @@ logger.debug(f"WebSocket URL for Twilio: {TWILIO_WEBSOCKET_URL}")
 GEMINI_MODEL_NAME = "gemini-2.0-flash-live-001"
 GEMINI_VOICE_NAME = "Puck"
 
-with open("system.md", "r") as f:
-    GEMINI_SYSTEM_PROMPT = f.read().strip()
-
-tools = [
-    types.Tool(
-        function_declarations=[
-            types.FunctionDeclaration(
-                name="getMenu",
-                description="gets the menu for the restaurant",
-                parameters=genai.types.Schema(
-                    type = genai.types.Type.OBJECT,
-                    properties = {
-                        "cuisine": genai.types.Schema(
-                            type = genai.types.Type.STRING,
-                        ),
-                        "dietary_restrictions": genai.types.Schema(
-                            type = genai.types.Type.STRING,
-                            enum = [
-                                "vegetarian",
-                                "vegan",
-                                "gluten-free",
-                                "nut-free",
-                                "dairy-free",
-                                "halal",
-                                "no restrictions"
-                            ],
-                        ),
-                    },
-                ),
-            ),
-        ],
-    ),
-    types.Tool(
-        function_declarations=[
-            types.FunctionDeclaration(
-                name="getSpecialOffers",
-                description="retrieves current special offers for the restaurant",
-                parameters=genai.types.Schema(
-                    type=genai.types.Type.OBJECT,
-                    properties={},
-                ),
-            ),
-        ],
-    ),
-    types.Tool(
-        function_declarations=[
-            types.FunctionDeclaration(
-                name="reserveTable",
-                description="reserves a table at the restaurant",
-                parameters=genai.types.Schema(
-                    type=genai.types.Type.OBJECT,
-                    properties={
-                        "date": genai.types.Schema(
-                            type=genai.types.Type.STRING,
-                            description="Date for the reservation in YYYY-MM-DD format",
-                        ),
-                        "time": genai.types.Schema(
-                            type=genai.types.Type.STRING,
-                            description="Time for the reservation in HH:MM format",
-                        ),
-                        "party_size": genai.types.Schema(
-                            type=genai.types.Type.INTEGER,
-                            description="Number of people for the reservation",
-                        ),
-                    },
-                ),
-            ),
-        ],
-    ),
-]
+SYSTEM_PROMPT_PATH = "system.md"
 
 # Audio Format Specifics
 TWILIO_SAMPLE_RATE = 8000
@@ -116,6 +72,140 @@ GEMINI_INPUT_SAMPLE_RATE = 16000
 GEMINI_OUTPUT_SAMPLE_RATE = 24000
 GEMINI_AUDIO_FORMAT = "audio/pcm" # Gemini uses Linear16 PCM
 
+# Cross-call batched transcoding: collect frames from all calls for this many ms
+# and convert them in one vectorized pass (0 = convert inline per call, max 20 ms)
+TRANSCODE_BATCH_WINDOW_MS = float(os.getenv("TRANSCODE_BATCH_WINDOW_MS", "5"))
+# Where conversion runs: "inline" (event loop), "thread" (thread pool) or "process" (process pool + shared memory)
+TRANSCODE_MODE = os.getenv("TRANSCODE_MODE", "inline")
+TRANSCODE_WORKERS = int(os.getenv("TRANSCODE_WORKERS", "0")) or None # 0 = one per CPU
+
+# Inbound coalescing: audio per send_realtime_input call (40-100 ms), and the longest
+# a buffered frame may wait before it is sent anyway
+INBOUND_COALESCE_MS = int(os.getenv("INBOUND_COALESCE_MS", "60"))
+INBOUND_FLUSH_DEADLINE_MS = float(os.getenv("INBOUND_FLUSH_DEADLINE_MS", str(INBOUND_COALESCE_MS)))
+
+# Inbound voice activity detection: "off", "suppress" (drop silence, send audio_stream_end)
+# or "activity" (drop silence, send explicit activity start/end and disable Gemini's own VAD)
+VAD_MODE = os.getenv("VAD_MODE", "off")
+if VAD_MODE not in VAD_MODES:
+    raise ValueError(f"VAD_MODE must be one of {', '.join(VAD_MODES)}, got '{VAD_MODE}'.")
+VAD_THRESHOLD_DBFS = float(os.getenv("VAD_THRESHOLD_DBFS", "-45"))
+VAD_HANGOVER_MS = int(os.getenv("VAD_HANGOVER_MS", "400")) # Silence still sent after speech
+VAD_PREROLL_MS = int(os.getenv("VAD_PREROLL_MS", "200"))   # Audio replayed from before an onset
+
+# Outbound pacing: how much audio may be queued at Twilio ahead of real-time playback
+OUTBOUND_LEAD_MS = int(os.getenv("OUTBOUND_LEAD_MS", "60"))
+NO_AUDIO = object() # Sentinel: the sender woke up to pace a frame, not because audio arrived
+
+# Per-call queue bounds. Policies: "drop_oldest", "drop_silence" (silent audio goes first)
+# or "backpressure" (the producer waits, which stops reading from the upstream socket).
+# Inbound defaults to shedding: stale caller audio is worthless once Gemini falls behind.
+# Outbound defaults to backpressure: Gemini speaks faster than real time, so its reply is
+# held back instead of being cut. Only the outbound converter waits on it; the Gemini reader
+# hands audio to a separate queue (GEMINI_AUDIO_QUEUE_MS, which sheds the oldest audio if a
+# reply ever outgrows it) and never blocks, so interruptions and tool calls are seen at once.
+INBOUND_QUEUE_MS = int(os.getenv("INBOUND_QUEUE_MS", "1000"))
+INBOUND_QUEUE_POLICY = os.getenv("INBOUND_QUEUE_POLICY", DROP_SILENCE)
+OUTBOUND_QUEUE_MS = int(os.getenv("OUTBOUND_QUEUE_MS", "2000"))
+OUTBOUND_QUEUE_POLICY = os.getenv("OUTBOUND_QUEUE_POLICY", BACKPRESSURE)
+GEMINI_AUDIO_QUEUE_MS = int(os.getenv("GEMINI_AUDIO_QUEUE_MS", "60000"))
+for _policy in (INBOUND_QUEUE_POLICY, OUTBOUND_QUEUE_POLICY):
+    if _policy not in QUEUE_POLICIES:
+        raise ValueError(f"Queue policies must be one of {', '.join(QUEUE_POLICIES)}, got '{_policy}'.")
+# Audio the sender stages in the scheduler ahead of pacing; the rest stays in the bounded queue
+OUTBOUND_STAGING_MS = int(os.getenv("OUTBOUND_STAGING_MS", "200"))
+
+# Event-loop diagnostics: lag sampling period, and how long one callback may block
+# the loop before it is reported. The slow-callback detector is opt-in (0 = off): it
+# hooks asyncio's own loop, so enabling it runs the server without uvloop.
+LOOP_LAG_INTERVAL_MS = float(os.getenv("LOOP_LAG_INTERVAL_MS", "100"))
+SLOW_CALLBACK_MS = float(os.getenv("SLOW_CALLBACK_MS", "0"))
+
+# Per-call hot-path event ring: events kept, log one event in N as a sample (0 = off),
+# and the level the ring is written at when a call ends (errors always flush at ERROR)
+EVENT_LOG_CAPACITY = int(os.getenv("EVENT_LOG_CAPACITY", "1024"))
+EVENT_LOG_SAMPLE_EVERY = int(os.getenv("EVENT_LOG_SAMPLE_EVERY", "0"))
+EVENT_LOG_FLUSH_LEVEL = logging.getLevelName(os.getenv("EVENT_LOG_FLUSH_LEVEL", "DEBUG").upper())
+
+# Gemini session pool: idle sessions kept connected ahead of calls, how long an idle one
+# is kept, and how long a session leased at /incoming_call waits for its stream
+SESSION_POOL_SIZE = int(os.getenv("SESSION_POOL_SIZE", "2"))
+SESSION_IDLE_TTL_S = float(os.getenv("SESSION_IDLE_TTL_S", "120"))
+SESSION_LEASE_TTL_S = float(os.getenv("SESSION_LEASE_TTL_S", "30"))
+# Long-call context management. Server-side sliding window: compress once the context
+# reaches CONTEXT_TRIGGER_TOKENS, down to CONTEXT_TARGET_TOKENS (0 disables). As a backstop,
+# a call whose prompt still reaches CONTEXT_COMPACT_TOKENS is moved to a fresh session
+# seeded with a text transcript of recent turns (0 disables; enables audio transcription).
+CONTEXT_TRIGGER_TOKENS = int(os.getenv("CONTEXT_TRIGGER_TOKENS", "16000"))
+CONTEXT_TARGET_TOKENS = int(os.getenv("CONTEXT_TARGET_TOKENS", "8000"))
+CONTEXT_COMPACT_TOKENS = int(os.getenv("CONTEXT_COMPACT_TOKENS", "24000"))
+# Pre-rendered prompt clips (render_clips.py) played instead of TwiML <Say>, and how long a
+# tool call may keep the line silent before the filler clip covers it (0 disables the filler)
+CLIPS_DIR = os.getenv("CLIPS_DIR", "clips")
+TOOL_FILLER_MS = float(os.getenv("TOOL_FILLER_MS", "700"))
+# Move calls to a resumed session on GoAway / connection drops instead of ending them
+GEMINI_SESSION_RESUMPTION = os.getenv("GEMINI_SESSION_RESUMPTION", "true").lower() in ("1", "true", "yes")
+
+# Admission control at /incoming_call (0 disables a limit): concurrent calls, worst recent
+# event-loop lag, and audio backed up in any call's inbound queue. Refused callers are
+# redirected to ADMISSION_OVERFLOW_URL if set, else hear a hold message and retry every
+# ADMISSION_HOLD_SECONDS, up to ADMISSION_MAX_HOLDS times.
+ADMISSION_MAX_CALLS = int(os.getenv("ADMISSION_MAX_CALLS", "50"))
+ADMISSION_MAX_LOOP_LAG_MS = float(os.getenv("ADMISSION_MAX_LOOP_LAG_MS", "50"))
+ADMISSION_MAX_INBOUND_BACKLOG_MS = float(os.getenv("ADMISSION_MAX_INBOUND_BACKLOG_MS", "500"))
+ADMISSION_OVERFLOW_URL = os.getenv("ADMISSION_OVERFLOW_URL", "")
+ADMISSION_HOLD_SECONDS = int(os.getenv("ADMISSION_HOLD_SECONDS", "10"))
+ADMISSION_MAX_HOLDS = int(os.getenv("ADMISSION_MAX_HOLDS", "6"))
+
+# Drain on SIGTERM or POST /admin/drain: refuse new calls, give calls in progress up to
+# DRAIN_DEADLINE_S to finish, then exit. Admin endpoints need ADMIN_TOKEN (X-Admin-Token
+# header) if set, else are only served to localhost.
+DRAIN_DEADLINE_S = float(os.getenv("DRAIN_DEADLINE_S", "300"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# How often system.md and function_calling_utils.py are checked for changes (0 = only via POST /admin/reload)
+CONFIG_RELOAD_INTERVAL_S = float(os.getenv("CONFIG_RELOAD_INTERVAL_S", "2"))
+
+def build_live_config(system_prompt: str, tools: list) -> types.LiveConnectConfig:
+    """Builds the Gemini Live session config (prompt, voice, tools). Done once per config version."""
+    return types.LiveConnectConfig( # Use types.
+        response_modalities=["AUDIO"],
+        speech_config=types.SpeechConfig( # Use types.
+            voice_config=types.VoiceConfig( # Use types.
+            prebuilt_voice_config=types.PrebuiltVoiceConfig(voice_name=GEMINI_VOICE_NAME) # Use types.
+            ),
+            # language_code="te-IN", # Optional
+        ),
+        system_instruction=types.Content( # Use types.
+            parts=[types.Part(text=system_prompt)] # Use types.
+        ),
+        tools=tools, # Use types.
+        # With explicit activity signals, our VAD replaces Gemini's automatic detection
+        realtime_input_config=types.RealtimeInputConfig(
+            automatic_activity_detection=types.AutomaticActivityDetection(disabled=True)
+        ) if VAD_MODE == VAD_ACTIVITY else None,
+        # Ask for resumption handles so a call can move to a new session on GoAway or a drop
+        session_resumption=types.SessionResumptionConfig() if GEMINI_SESSION_RESUMPTION else None,
+        # Keep long calls' context bounded so latency stays flat
+        context_window_compression=types.ContextWindowCompressionConfig(
+            trigger_tokens=CONTEXT_TRIGGER_TOKENS,
+            sliding_window=types.SlidingWindow(target_tokens=CONTEXT_TARGET_TOKENS or None),
+        ) if CONTEXT_TRIGGER_TOKENS else None,
+        # Text transcripts of both sides seed a fresh session when a call is compacted
+        input_audio_transcription=types.AudioTranscriptionConfig() if CONTEXT_COMPACT_TOKENS else None,
+        output_audio_transcription=types.AudioTranscriptionConfig() if CONTEXT_COMPACT_TOKENS else None,
+    )
+
+def resume_live_config(live_config: types.LiveConnectConfig, handle: str) -> types.LiveConnectConfig:
+    """A call's prebuilt config, resuming the session state identified by `handle`."""
+    return live_config.model_copy(update={"session_resumption": types.SessionResumptionConfig(handle=handle)})
+
+def load_call_config():
+    """Reads the system prompt and (re)imports the tools; the config snapshot builder."""
+    with open(SYSTEM_PROMPT_PATH, "r") as f:
+        system_prompt = f.read().strip()
+    tools = importlib.reload(function_calling_utils).registry
+    return system_prompt, tools, build_live_config(system_prompt, tools.declarations())
+
 # Initialize Gemini Client
 try:
     client = genai.Client(api_key=GEMINI_API_KEY)
@@ -123,19 +213,111 @@ except Exception as e:
     logger.error(f"Failed to initialize Google GenAI Client: {e}")
     raise
 
-# State variable for audioop resampling
-resample_state_8k_to_16k = None
-resample_state_24k_to_8k = None
+# Shared by every call handled by this worker
+transcoder = BatchTranscoder(window_ms=TRANSCODE_BATCH_WINDOW_MS, mode=TRANSCODE_MODE, workers=TRANSCODE_WORKERS)
+
+# Latency histograms and gauges for every call on this worker, served at /metrics
+metrics = MetricsRegistry()
+
+# Greeting, filler, apology and hold audio, loaded once and shared by every call
+clips = ClipCache(CLIPS_DIR)
+
+# Versioned prompt + tool declarations; each call keeps the version its session opened with
+config_store = SnapshotStore(load_call_config, [SYSTEM_PROMPT_PATH, function_calling_utils.__file__],
+                             poll_interval_s=CONFIG_RELOAD_INTERVAL_S, registry=metrics)
+lag_monitor = LoopLagMonitor(interval_ms=LOOP_LAG_INTERVAL_MS, registry=metrics)
+slow_callbacks = SlowCallbackDetector(threshold_ms=SLOW_CALLBACK_MS, registry=metrics) if SLOW_CALLBACK_MS > 0 else None
+
+# Gemini sessions connected ahead of calls; leased at /incoming_call by call SID
+session_pool = GeminiSessionPool(
+    lambda config: client.aio.live.connect(model=GEMINI_MODEL_NAME, config=config),
+    lambda: config_store.current,
+    size=SESSION_POOL_SIZE, idle_ttl_s=SESSION_IDLE_TTL_S, lease_ttl_s=SESSION_LEASE_TTL_S, registry=metrics,
+)
+
+# Calls in progress on this worker: call tag -> live per-call state for diagnostics
+active_calls = {}
+call_counter = itertools.count(1)
+
+admission = AdmissionController(max_calls=ADMISSION_MAX_CALLS, max_loop_lag_ms=ADMISSION_MAX_LOOP_LAG_MS,
+                                max_inbound_backlog_ms=ADMISSION_MAX_INBOUND_BACKLOG_MS,
+                                lag_monitor=lag_monitor, registry=metrics)
+
+def admission_load():
+    """(calls, audio queues) on this worker; answered calls still connecting count as calls."""
+    calls = len(active_calls) + session_pool.leased
+    return calls, [queue for call in active_calls.values() for queue in call["queues"]]
+
+drain = DrainController(DRAIN_DEADLINE_S, live_calls=lambda: admission_load()[0], registry=metrics)
 
 # --- FastAPI Application ---
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info(f"Audio conversion mode: {TRANSCODE_MODE}, batch window: {TRANSCODE_BATCH_WINDOW_MS} ms")
+    if slow_callbacks:
+        slow_callbacks.install()
+    lag_monitor.start()
+    config_store.start()
+    menus.start()
+    await session_pool.start()
+    yield
+    await session_pool.close()
+    await config_store.stop()
+    await menus.stop()
+    await lag_monitor.stop()
+    if slow_callbacks:
+        slow_callbacks.uninstall()
+    logger.info(f"Transcoder stats at shutdown: {transcoder.stats()}")
+    transcoder.close()
+
+app = FastAPI(lifespan=lifespan)
+
+def clip_url(name: str) -> str:
+    return f"https://{YOUR_PUBLIC_HOSTNAME}/clips/{name}.wav"
+
+@app.get("/clips/{name}.wav")
+async def clip_wav(name: str):
+    """A prompt clip as 8 kHz mulaw WAV, for TwiML <Play>."""
+    wav = clips.wav(name)
+    if wav is None:
+        raise HTTPException(status_code=404, detail="No such clip")
+    return Response(content=wav, media_type="audio/wav", headers={"Cache-Control": "public, max-age=3600"})
+
+def overflow_twiml(hold: int) -> str:
+    """TwiML for a call refused by admission control: overflow, hold and retry, or apologise."""
+    response = VoiceResponse()
+    if ADMISSION_OVERFLOW_URL:
+        response.redirect(ADMISSION_OVERFLOW_URL, method="POST")
+    elif hold < ADMISSION_MAX_HOLDS:
+        if hold == 0:
+            if clips.has(HOLD):
+                response.play(clip_url(HOLD))
+            else:
+                response.say("All of our assistants are busy right now. Please hold.", voice='Polly.Joanna-Neural')
+        response.pause(length=ADMISSION_HOLD_SECONDS)
+        response.redirect(f"/incoming_call?hold={hold + 1}", method="POST") # Retry admission
+    else:
+        if clips.has(BUSY):
+            response.play(clip_url(BUSY))
+        else:
+            response.say("Sorry, we can't take your call right now. Please try again later.", voice='Polly.Joanna-Neural')
+        response.hangup()
+    return str(response)
 
 @app.post("/incoming_call", response_class=PlainTextResponse)
-async def incoming_call(request: Request):
+async def incoming_call(request: Request, hold: int = 0):
     """Handles incoming Twilio call and connects it to the WebSocket stream."""
     logger.info(f"Incoming call from: {request.client.host}") # Log caller IP or identifier if available
+    form = await request.form()
+    refused = "draining" if drain.draining else admission.check(*admission_load())
+    if refused:
+        logger.warning(f"Call {form.get('CallSid')} not admitted ({refused}), hold #{hold}")
+        return Response(content=overflow_twiml(hold), media_type="application/xml")
+    # Start (or hand over a warm) Gemini session now, so it is ready while the greeting plays
+    session_pool.lease(form.get("CallSid"))
     response = VoiceResponse()
-    response.say("Hello! Please wait while I connect you to our AI assistant.", voice='Polly.Joanna-Neural') # Example voice
+    if not clips.has(GREETING): # With a greeting clip, it is streamed as soon as the stream starts
+        response.say("Hello! Please wait while I connect you to our AI assistant.", voice='Polly.Joanna-Neural') # Example voice
     connect = Connect()
     connect.stream(url=TWILIO_WEBSOCKET_URL)
     response.append(connect)
@@ -146,30 +328,172 @@ async def incoming_call(request: Request):
     return Response(content=twiml_response, media_type="application/xml")
 
 
+@app.get("/metrics")
+async def metrics_endpoint(format: str = "prometheus"):
+    """Latency percentiles (p50/p95/p99) and gauges, as Prometheus text or JSON (?format=json)."""
+    if format == "json":
+        return metrics.snapshot()
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+def require_admin(request: Request):
+    """Admin endpoints take the ADMIN_TOKEN header if one is configured, else only localhost."""
+    if ADMIN_TOKEN:
+        allowed = request.headers.get("x-admin-token") == ADMIN_TOKEN
+    else:
+        allowed = request.client is not None and request.client.host in ("127.0.0.1", "::1")
+    if not allowed:
+        raise HTTPException(status_code=403, detail="Admin access denied")
+
+@app.post("/admin/drain")
+async def admin_drain(request: Request):
+    """Starts draining this worker; it exits once its calls end or the deadline passes."""
+    require_admin(request)
+    drain.begin("admin request")
+    return drain.stats()
+
+@app.get("/admin/drain")
+async def admin_drain_status(request: Request):
+    require_admin(request)
+    return drain.stats()
+
+@app.post("/admin/reload")
+async def admin_reload(request: Request):
+    """Reloads system.md, the tool declarations and the menu now, instead of at the next poll."""
+    require_admin(request)
+    reloaded = config_store.reload()
+    menu_reloaded = await asyncio.to_thread(menus.reload)
+    return {"reloaded": reloaded, **config_store.stats(), "menu": {"reloaded": menu_reloaded, **menus.stats()}}
+
+@app.get("/admission")
+async def admission_endpoint():
+    """Admission limits, current usage against them, and admitted/refused call counts."""
+    return admission.stats(*admission_load())
+
+@app.get("/diagnostics")
+async def diagnostics_endpoint():
+    """Event-loop health for this worker: lag, recent slow callbacks, and live tasks per call."""
+    now = time.monotonic()
+    lag_percentiles = metrics.snapshot()["histograms"].get("loop_lag_seconds", {})
+    task_counts = tasks_per_call()
+    return {
+        "loop_lag": {**lag_monitor.stats(), **lag_percentiles},
+        "slow_callbacks": {
+            "threshold_ms": SLOW_CALLBACK_MS,
+            "total": slow_callbacks.count if slow_callbacks else None,
+            "recent": list(slow_callbacks.recent) if slow_callbacks else [],
+        },
+        "tasks": {"total": sum(task_counts.values()), "per_call": task_counts},
+        "calls": {
+            tag: {
+                "stream_sid": call["stream_sid"](),
+                "age_seconds": now - call["started_at"],
+                "tasks": task_counts.get(tag, 0),
+                "config_version": call["config_version"](),
+                "queues": [queue.stats() for queue in call["queues"]],
+            }
+            for tag, call in active_calls.items()
+        },
+        "transcoder": transcoder.stats(),
+        "session_pool": session_pool.stats(),
+        "admission": admission.stats(*admission_load()),
+        "drain": drain.stats(),
+        "config": config_store.stats(),
+        "menu": menus.stats(),
+        "clips": clips.stats(),
+    }
+
 @app.websocket("/audio_stream")
+@app.websocket("/audio_stream/{worker_path}") # /audio_stream/w<index>, routed by cluster.py
 async def audio_stream_websocket(websocket: WebSocket):
     """Handles the bidirectional audio stream between Twilio and Gemini."""
+    await handle_call(websocket, raw_pcm=False)
+
+@app.websocket("/pcm_stream")
+@app.websocket("/pcm_stream/{worker_path}") # /pcm_stream/w<index>, routed by cluster.py
+async def pcm_stream_websocket(websocket: WebSocket):
+    """
+    Bidirectional raw PCM stream for non-Twilio clients (web, SIP bridges).
+
+    Binary frames of 16 kHz PCM16 in, 24 kHz PCM16 out (Gemini's own formats,
+    see pcm_framing.py): no base64, JSON or resampling, otherwise the same call
+    handling as /audio_stream. `?call_sid=` claims a session leased at /incoming_call.
+    """
+    await handle_call(websocket, raw_pcm=True)
+
+async def handle_call(websocket: WebSocket, raw_pcm: bool = False):
+    """Runs one call between a client stream (Twilio, or raw PCM) and Gemini."""
     await websocket.accept()
-    logger.info(f"WebSocket connection established from: {websocket.client.host}")
+    logger.info(f"WebSocket connection established from: {websocket.client.host} ({'raw PCM' if raw_pcm else 'Twilio'})")
 
     stream_sid = None
+    call_sid = None # Twilio call SID; claims the Gemini session leased at /incoming_call
+    formatter = None # Preformatted outbound messages, built once the stream SID is known
     gemini_session = None
-    audio_queue = asyncio.Queue() # Queue for Twilio -> Gemini audio chunks
-    twilio_send_queue = asyncio.Queue() # Queue for Gemini -> Twilio audio chunks
+    # Bounded queues for client -> Gemini and Gemini -> client audio chunks
+    # (raw PCM streams queue PCM16, so DROP_SILENCE measures it as such)
+    level_dbfs = pcm16_level_dbfs if raw_pcm else mulaw_bytes_level_dbfs
+    audio_queue = BoundedAudioQueue(INBOUND_QUEUE_MS, policy=INBOUND_QUEUE_POLICY, name="inbound",
+                                    bytes_per_ms=INPUT_BYTES_PER_MS if raw_pcm else MULAW_BYTES_PER_MS, level_dbfs=level_dbfs)
+    twilio_send_queue = BoundedAudioQueue(OUTBOUND_QUEUE_MS, policy=OUTBOUND_QUEUE_POLICY, name="outbound",
+                                          bytes_per_ms=OUTPUT_BYTES_PER_MS if raw_pcm else MULAW_BYTES_PER_MS, level_dbfs=level_dbfs)
+    # Gemini audio (PCM 24kHz) on its way to the outbound converter; the Gemini reader never waits on it
+    gemini_audio_queue = BoundedAudioQueue(GEMINI_AUDIO_QUEUE_MS, policy=DROP_OLDEST, name="gemini_audio",
+                                           bytes_per_ms=OUTPUT_BYTES_PER_MS)
     stream_active = asyncio.Event() # Flag to signal when Twilio stream has started
 
-    # reset_resample_states() # Reset audio conversion state for this new call
+    # Per-call streaming converters; they carry filter state across chunks (unused for raw PCM)
+    inbound_pipeline = AudioPipeline.inbound()   # Twilio mulaw 8kHz -> Gemini PCM 16kHz
+    outbound_pipeline = AudioPipeline.outbound() # Gemini PCM 24kHz -> Twilio mulaw 8kHz
+    # Groups 20 ms Twilio frames into fewer, larger sends to Gemini
+    coalescer = InboundCoalescer(coalesce_ms=INBOUND_COALESCE_MS, deadline_ms=INBOUND_FLUSH_DEADLINE_MS)
+    # Optional inbound VAD; None forwards every frame to Gemini
+    vad = VoiceActivityDetector(
+        threshold_dbfs=VAD_THRESHOLD_DBFS, hangover_ms=VAD_HANGOVER_MS, preroll_ms=VAD_PREROLL_MS, pcm16=raw_pcm
+    ) if VAD_MODE != VAD_OFF else None
+    # Paces Gemini audio out to Twilio in 20 ms frames and tracks playback via marks
+    scheduler = OutboundScheduler(lead_ms=OUTBOUND_LEAD_MS,
+                                  bytes_per_second=(OUTPUT_BYTES_PER_MS if raw_pcm else MULAW_BYTES_PER_MS) * 1000)
+    framer = InboundFramer() if raw_pcm else None # Raw PCM arrives in any size; Twilio sends 20 ms frames
+    barge_in_latencies = [] # Seconds from Gemini's interruption to the line going silent
+    latency = CallLatencyTracker(metrics) # Per-call timestamps feeding the /metrics histograms
+    call_tag = f"call-{next(call_counter)}" # Names this call's tasks so loop diagnostics can attribute them
+    events = CallEventLog(call_tag, capacity=EVENT_LOG_CAPACITY, sample_every=EVENT_LOG_SAMPLE_EVERY,
+                          flush_level=EVENT_LOG_FLUSH_LEVEL) # Hot-path events, logged in bulk
+    context_monitor = ContextMonitor(compact_tokens=CONTEXT_COMPACT_TOKENS, registry=metrics)
+    transcript = ConversationTranscript() # Seeds a fresh session if the call is compacted
+    active_calls[call_tag] = {
+        "stream_sid": lambda: stream_sid,
+        "transport": "pcm" if raw_pcm else "twilio",
+        "config_version": lambda: gemini_session.snapshot.version if gemini_session else None,
+        "started_at": time.monotonic(),
+        "queues": (audio_queue, gemini_audio_queue, twilio_send_queue),
+    }
+    metrics.add_gauge("active_calls", 1)
+
+    async def next_message() -> tuple:
+        """(event, data, audio) for the client's next message, in its stream's framing."""
+        if raw_pcm:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            return parse_pcm_message(message)
+        message_str = await websocket.receive_text()
+        # logger.debug(f"Raw Twilio message: {message_str[:200]}...") # Log truncated message
+        # Media frames are sliced out without a full JSON parse; other events are parsed
+        return parse_twilio_message(message_str)
 
     async def twilio_receiver():
-        """Receives messages from Twilio WebSocket."""
-        nonlocal stream_sid
+        """Receives messages from the client WebSocket (Twilio, or a raw PCM client)."""
+        nonlocal stream_sid, call_sid, formatter
         logger.info("Twilio receiver task started.")
         try:
+            if raw_pcm: # No 'start' event: the stream starts with the connection
+                stream_sid, call_sid = call_tag, websocket.query_params.get("call_sid")
+                formatter = PcmMessageFormatter()
+                await play_clip(GREETING)
+                stream_active.set()
             while True:
-                message_str = await websocket.receive_text()
-                # logger.debug(f"Raw Twilio message: {message_str[:200]}...") # Log truncated message
-                data = json.loads(message_str)
-                event = data.get("event")
+                event, data, audio_bytes = await next_message()
 
                 if event == "connected":
                     logger.info("Twilio 'connected' event received.")
@@ -177,8 +501,11 @@ async def audio_stream_websocket(websocket: WebSocket):
                     # Correctly extract the nested streamSid (Standard Twilio Format)
                     start_data = data.get("start", {}) # Get the nested "start" object, default to {} if missing
                     stream_sid = start_data.get("streamSid") # Get streamSid from the nested object
+                    call_sid = start_data.get("callSid")
                     logger.info(f"Twilio 'start' event received. SID: {stream_sid}")
                     if stream_sid:
+                        formatter = TwilioMessageFormatter(stream_sid)
+                        await play_clip(GREETING)
                         # Signal that we can now start the Gemini session
                         stream_active.set()
                     else:
@@ -189,17 +516,27 @@ async def audio_stream_websocket(websocket: WebSocket):
                     if not stream_sid:
                         logger.warning("Received 'media' event before 'start'. Ignoring.")
                         continue
-                    payload = data["media"]["payload"]
-                    mulaw_bytes = base64.b64decode(payload)
-                    # logger.debug(f"Received {len(mulaw_bytes)} bytes of mulaw audio from Twilio.")
-                    await audio_queue.put(mulaw_bytes)
+                    events.record(ev.TWILIO_MEDIA_IN, len(audio_bytes))
+                    if framer:
+                        for frame in framer.add(audio_bytes):
+                            await audio_queue.put(frame)
+                    else:
+                        await audio_queue.put(audio_bytes)
                 elif event == "stop":
                     logger.info("Twilio 'stop' event received.")
+                    if framer and (tail := framer.flush()):
+                        await audio_queue.put(tail)
                     await audio_queue.put(None) # Signal end of audio from Twilio
                     break # Stop receiving from Twilio
                 elif event == "mark":
-                    mark_name = data.get("mark", {}).get("name")
-                    logger.info(f"Twilio 'mark' event received: {mark_name}")
+                    mark_name = data.get("name") if raw_pcm else data.get("mark", {}).get("name")
+                    remaining_playback = scheduler.on_mark(mark_name)
+                    if remaining_playback is not None:
+                        latency.playback_complete(mark_name)
+                        events.record(ev.MARK_ECHO, mark_name, round(remaining_playback * 1000))
+                        logger.info(f"Twilio playback reached mark '{mark_name}' {remaining_playback * 1000:.0f} ms after it was sent")
+                    else:
+                        logger.info(f"Twilio 'mark' event received: {mark_name}")
                 else:
                     logger.warning(f"Received unknown Twilio event: {event}")
         except WebSocketDisconnect:
@@ -207,15 +544,61 @@ async def audio_stream_websocket(websocket: WebSocket):
             await audio_queue.put(None) # Signal end if Twilio disconnects abruptly
         except json.JSONDecodeError as e:
             logger.error(f"Failed to decode JSON from Twilio: {e}")
+            events.flush(logging.ERROR, "Twilio receiver error")
             await audio_queue.put(None)
         except Exception as e:
             logger.error(f"Error in Twilio receiver: {type(e).__name__} - {e}", exc_info=True)
+            events.flush(logging.ERROR, "Twilio receiver error")
             await audio_queue.put(None) # Signal end on other errors
         finally:
             logger.info("Twilio receiver task finished.")
             stream_active.set() # Ensure other tasks can exit if receiver fails early
             await audio_queue.put(None) # Final signal just in case
 
+    async def play_clip(name: str) -> bool:
+        """Queues a pre-rendered clip for twilio_sender, as is. Returns False if there is no such clip."""
+        clip = clips.get(name, pcm24k=raw_pcm)
+        if clip is None:
+            return False
+        events.record(ev.CLIP_PLAYED, name, len(clip))
+        await twilio_send_queue.put(clip)
+        return True
+
+    def line_quiet() -> bool:
+        """Nothing queued for the caller and (almost) nothing left playing."""
+        return (gemini_audio_queue.empty() and twilio_send_queue.empty() and not scheduler.has_pending()
+                and scheduler.buffered_seconds() < 0.1)
+
+    async def send_audio_to_gemini(session, pcm16k_payload) -> bool:
+        """Sends one coalesced PCM 16kHz payload to Gemini. Returns False if the session is unusable."""
+        if not pcm16k_payload:
+            return True
+        events.record(ev.GEMINI_AUDIO_OUT, len(pcm16k_payload))
+        try:
+            await session.send_realtime_input(
+                audio=types.Blob(data=pcm16k_payload, mime_type=f"{GEMINI_AUDIO_FORMAT};rate={GEMINI_INPUT_SAMPLE_RATE}") # Use types.
+            )
+            return True
+        except Exception as gemini_send_e:
+            logger.error(f"Error sending audio to Gemini: {gemini_send_e}", exc_info=True)
+            return False
+
+    async def send_activity_signal(session, vad_event: str) -> bool:
+        """Tells Gemini that caller speech started/ended, according to VAD_MODE."""
+        try:
+            if VAD_MODE == VAD_ACTIVITY:
+                if vad_event == SPEECH_START:
+                    await session.send_realtime_input(activity_start=types.ActivityStart())
+                else:
+                    await session.send_realtime_input(activity_end=types.ActivityEnd())
+            elif vad_event == SPEECH_END:
+                # Audio pauses while we suppress silence; let Gemini flush what it has cached
+                await session.send_realtime_input(audio_stream_end=True)
+            return True
+        except Exception as e:
+            logger.error(f"Error sending {vad_event} signal to Gemini: {e}", exc_info=True)
+            return False
+
     async def gemini_processor():
         """Connects to Gemini, processes audio from queue, starts receiver task."""
         nonlocal gemini_session
@@ -225,54 +608,75 @@ async def audio_stream_websocket(websocket: WebSocket):
              logger.error("Twilio stream did not start correctly. Aborting Gemini processor.")
              return
 
-        logger.info("Twilio stream started. Connecting to Gemini Live API...")
+        logger.info(f"Twilio stream started. Claiming Gemini Live session for call {call_sid}...")
 
         try:
-            config = types.LiveConnectConfig( # Use types.
-                response_modalities=["AUDIO"],
-                speech_config=types.SpeechConfig( # Use types.
-                    voice_config=types.VoiceConfig( # Use types.
-                    prebuilt_voice_config=types.PrebuiltVoiceConfig(voice_name=GEMINI_VOICE_NAME) # Use types.
-                    ),
-                    # language_code="te-IN", # Optional
-                ),
-                system_instruction=types.Content( # Use types.
-                    parts=[types.Part(text=GEMINI_SYSTEM_PROMPT)] # Use types.
-                ),
-                tools=tools, # Use types.
-            )
-
-            # Connect using the config object
-            async with client.aio.live.connect(model=GEMINI_MODEL_NAME, config=config) as session:
+            # Take the session leased for this call at /incoming_call (usually already connected)
+            # It is resumable: GoAway and connection drops switch it to a new session mid-call
+            async with session_pool.session(
+                call_sid, resume_config=resume_live_config if GEMINI_SESSION_RESUMPTION else None
+            ) as session:
                 gemini_session = session
-                logger.info("Connected to Gemini Live API.")
-                gemini_receiver_task = asyncio.create_task(gemini_audio_receiver(session))
+                logger.info(f"Connected to Gemini Live API (call config version {session.snapshot.version}).")
+                gemini_receiver_task = asyncio.create_task(
+                    gemini_audio_receiver(session), name=call_task_name(call_tag, "gemini_audio_receiver"))
 
                 while True:
-                    mulaw_chunk = await audio_queue.get()
-                    if mulaw_chunk is None:
+                    # Wake up in time to flush a partially filled payload on its deadline
+                    try:
+                        inbound_chunk = await asyncio.wait_for(audio_queue.get(), timeout=coalescer.time_until_deadline())
+                    except asyncio.TimeoutError:
+                        if not await send_audio_to_gemini(session, coalescer.flush()):
+                            break
+                        continue
+
+                    if inbound_chunk is None:
                         logger.info("End of Twilio audio stream signaled.")
+                        await send_audio_to_gemini(session, coalescer.flush()) # Don't lose the tail
                         break # Exit loop when Twilio audio ends
 
-                    # 1. Convert mulaw 8kHz to PCM 16kHz
-                    pcm16k_chunk = mulaw8k_to_pcm16k(mulaw_chunk)
-
-                    # 2. Send to Gemini if conversion was successful
-                    if pcm16k_chunk:
-                        # logger.debug(f"Sending {len(pcm16k_chunk)} bytes of PCM 16kHz audio to Gemini.")
-                        try:
-                             # Send audio optimized for responsiveness
-                             await session.send_realtime_input(
-                                audio=types.Blob(data=pcm16k_chunk, mime_type=f"{GEMINI_AUDIO_FORMAT};rate={GEMINI_INPUT_SAMPLE_RATE}") # Use types.
-                            )
-                        except Exception as gemini_send_e:
-                            logger.error(f"Error sending audio to Gemini: {gemini_send_e}", exc_info=True)
-                            # Decide how to handle: break, retry, log?
+                    # 1. Voice activity detection: hold back silence, replay pre-roll at speech onsets
+                    vad_event = None
+                    if vad:
+                        frames, vad_event = vad.process(inbound_chunk)
+                        if vad_event:
+                            events.record(ev.VAD_EVENT, vad_event)
+                        if vad.voiced:
+                            latency.speech_frame()
+                        if vad_event == SPEECH_START and VAD_MODE == VAD_ACTIVITY:
+                            if not await send_audio_to_gemini(session, coalescer.flush()):
+                                break
+                            if not await send_activity_signal(session, SPEECH_START):
+                                break
+                        inbound_chunk = b"".join(frames)
+
+                    if inbound_chunk:
+                        # 2. Convert mulaw 8kHz to PCM 16kHz (batched with other calls' frames); raw PCM already is
+                        if raw_pcm:
+                            pcm16k_chunk = inbound_chunk
+                        else:
+                            convert_started = time.perf_counter()
+                            pcm16k_chunk = await transcoder.convert(inbound_pipeline, inbound_chunk)
+                            latency.conversion("inbound", time.perf_counter() - convert_started)
+                        if not pcm16k_chunk:
+                            logger.warning("Skipping empty chunk after audio conversion.")
+                            continue
+
+                        # 3. Coalesce 20 ms frames into one larger payload, then send it to Gemini
+                        payload = coalescer.add(pcm16k_chunk, is_speech=vad.in_speech if vad else None)
+                        if not vad and coalescer.last_frame_speech:
+                            latency.speech_frame()
+                        if payload is None and coalescer.flush_due():
+                            payload = coalescer.flush()
+                        if payload and not await send_audio_to_gemini(session, payload):
                             break
-                    else:
-                         logger.warning("Skipping empty chunk after audio conversion.")
 
-                    await asyncio.sleep(0.005) # Small sleep to yield control
+                    # 4. Speech ended (hangover elapsed): send what's buffered and signal the end
+                    if vad_event == SPEECH_END:
+                        if not await send_audio_to_gemini(session, coalescer.flush()):
+                            break
+                        if not await send_activity_signal(session, SPEECH_END):
+                            break
 
                 logger.info("Waiting for Gemini receiver task to complete...")
                 # Wait for the Gemini receiver to finish processing any remaining audio from Gemini
@@ -280,65 +684,75 @@ async def audio_stream_websocket(websocket: WebSocket):
 
         except Exception as e:
             logger.error(f"Error in Gemini processor: {type(e).__name__} - {e}", exc_info=True)
+            events.flush(logging.ERROR, "Gemini processor error")
+            await play_clip(APOLOGY)
         finally:
             logger.info("Gemini processor task finished.")
-            # Ensure the queue has a final None signal for the Twilio sender
-            await twilio_send_queue.put(None)
-
+            # Ensure the outbound path gets a final None signal (behind any audio still being converted)
+            gemini_audio_queue.put_nowait(None)
+
+
+    async def run_tool(tools, fc):
+        """Runs one function call with the call's tool registry version, timing it and noting the result."""
+        logger.info(f"Processing function call: {fc.name} with args: {fc.args}")
+        latency.tool_start(fc.id or fc.name)
+        function_response = await tools.call(fc)
+        latency.tool_end(fc.id or fc.name, fc.name)
+        transcript.add_note(f"{fc.name}({dict(fc.args or {})}) returned: {function_response.response}")
+        return function_response
+
+    async def run_tools(tools, function_calls):
+        """
+        Runs every function call of a tool_call at once, each under its tool's timeout.
+
+        If they are still running after TOOL_FILLER_MS, the filler clip plays as
+        soon as the line goes quiet, so the caller doesn't sit in dead air.
+        """
+        calls = asyncio.gather(*(run_tool(tools, fc) for fc in function_calls))
+        try:
+            if TOOL_FILLER_MS > 0 and clips.has(FILLER):
+                done, _ = await asyncio.wait({calls}, timeout=TOOL_FILLER_MS / 1000)
+                while not done:
+                    if line_quiet():
+                        logger.info(f"Tool call still running after {TOOL_FILLER_MS:.0f} ms; playing filler")
+                        await play_clip(FILLER)
+                        break
+                    done, _ = await asyncio.wait({calls}, timeout=0.05)
+            return await calls
+        except asyncio.CancelledError:
+            calls.cancel()
+            raise
 
     async def gemini_audio_receiver(session):
         """Receives audio and potentially function calls from Gemini and queues audio for sending back to Twilio."""
         logger.info("Gemini receiver task started.")
+        connection_error = None
+
+        async def responses():
+            """One turn of Gemini responses; a dropped connection ends it early when the session can be resumed."""
+            nonlocal connection_error
+            try:
+                async for response in session.receive():
+                    yield response
+            except Exception as e:
+                if not session.can_resume:
+                    raise
+                connection_error = e
+
         try:
             while True:
                 complete_flag = False
                 function_call_in_progress = False # Flag to track if we are waiting for function results
+                connection_error = None
 
-                async for response in session.receive():
+                async for response in responses():
                     # logger.info(f"Received response from Gemini: {response}")
 
                     # --- Handle Function Calls ---
                     if response.tool_call:
                         logger.info(f"Received tool call from Gemini: {response.tool_call}")
                         function_call_in_progress = True # Mark that we are processing a function call
-                        function_responses = []
-                        for fc in response.tool_call.function_calls:
-                            logger.info(f"Processing function call: {fc.name} with args: {fc.args}")
-                            if fc.name == "getMenu":
-                                try:
-                                    # Extract arguments safely
-                                    cuisine = fc.args.get("cuisine")
-                                    dietary_restrictions = fc.args.get("dietary_restrictions", "no restrictions") # Default if not provided
-
-                                    # Call the actual function
-                                    menu_result = getMenu(cuisine=cuisine, dietary_restrictions=dietary_restrictions)
-                                    logger.info(f"Function 'getMenu' returned: {menu_result}")
-
-                                    # Prepare the response for Gemini
-                                    function_response = types.FunctionResponse(
-                                        id=fc.id,
-                                        name=fc.name,
-                                        response={"result": menu_result} # Send the actual result back
-                                    )
-                                    function_responses.append(function_response)
-                                except Exception as func_e:
-                                    logger.error(f"Error executing function {fc.name}: {func_e}", exc_info=True)
-                                    # Optionally send an error response back to Gemini
-                                    function_response = types.FunctionResponse(
-                                        id=fc.id,
-                                        name=fc.name,
-                                        response={"error": f"Failed to execute function: {str(func_e)}"}
-                                    )
-                                    function_responses.append(function_response)
-                            else:
-                                logger.warning(f"Received unknown function call: {fc.name}")
-                                # Handle unknown functions if necessary, maybe send an error response
-                                function_response = types.FunctionResponse(
-                                    id=fc.id,
-                                    name=fc.name,
-                                    response={"error": f"Function '{fc.name}' is not implemented."}
-                                )
-                                function_responses.append(function_response)
+                        function_responses = await run_tools(session.snapshot.tools, response.tool_call.function_calls)
 
                         # Send the collected responses back to Gemini
                         if function_responses:
@@ -352,16 +766,14 @@ async def audio_stream_websocket(websocket: WebSocket):
 
                         if part.inline_data and part.inline_data.mime_type.startswith("audio/"):
                             pcm24k_chunk = part.inline_data.data
-                            # logger.debug(f"Received audio chunk from Gemini: {len(pcm24k_chunk)} bytes") # Debug level
+                            events.record(ev.GEMINI_AUDIO_IN, len(pcm24k_chunk))
 
-                            # Convert Gemini's PCM 24kHz to Twilio's mulaw 8kHz
-                            mulaw8k_chunk = pcm24k_to_mulaw8k(pcm24k_chunk)
+                            latency.gemini_audio()
+                            # Audio after a tool response is the answer itself; its turn needs an end marker
+                            function_call_in_progress = False
 
-                            if mulaw8k_chunk:
-                                # logger.debug(f"Converted audio to mulaw: {len(mulaw8k_chunk)} bytes") # Debug level
-                                await twilio_send_queue.put(mulaw8k_chunk)
-                            else:
-                                logger.warning("Audio conversion resulted in empty chunk.")
+                            # Converted and queued by outbound_converter; never wait here on playback
+                            gemini_audio_queue.put_nowait(pcm24k_chunk)
                         elif part.text:
                             logger.info(f"Gemini Text Response: {part.text}")
                             # Note: Currently not sending text back via audio, only logging.
@@ -370,23 +782,58 @@ async def audio_stream_websocket(websocket: WebSocket):
                         #     logger.warning(f"Received part with no audio or text: {part}")
 
                     # --- Handle Other Events ---
+                    if response.server_content and response.server_content.input_transcription:
+                        transcript.add(USER, response.server_content.input_transcription.text)
+                    if response.server_content and response.server_content.output_transcription:
+                        transcript.add(MODEL, response.server_content.output_transcription.text)
                     if response.server_content and response.server_content.interrupted:
-                        logger.warning("Gemini generation interrupted.")
+                        logger.warning("Gemini generation interrupted. Flushing queued audio.")
+                        complete_flag = True # An interrupted turn ends with turn_complete but no generation_complete
+                        await barge_in()
+                    if response.server_content and response.server_content.turn_complete:
+                        complete_flag = True
                     if response.server_content and response.server_content.generation_complete:
                         logger.info("Gemini generation complete event received.")
                         complete_flag = True
+                        latency.end_turn()
                         if not function_call_in_progress: # Only send end-of-turn marker if not waiting for function result processing
-                             await twilio_send_queue.put(b"") # Send empty chunk as end-of-turn marker
+                             gemini_audio_queue.put_nowait(b"") # Send empty chunk as end-of-turn marker
                         function_call_in_progress = False # Reset flag after completion
 
+                    if response.session_resumption_update:
+                        session.on_resumption_update(response.session_resumption_update)
+
                     if response.go_away:
                         logger.warning(f"Gemini GoAway received: TimeLeft={response.go_away.time_left}. Connection will close.")
-                        return  # Exit the entire function
+                        session.on_go_away(response.go_away.time_left) # Connects the replacement in the background
+                        if not session.can_resume:
+                            return  # Exit the entire function
 
                     if response.usage_metadata:
-                        logger.info(f"Gemini Usage: {response.usage_metadata.total_token_count} total tokens")
+                        context_monitor.on_usage(response.usage_metadata)
+                        logger.info(f"Gemini Usage: {response.usage_metadata.total_token_count} total tokens "
+                                    f"({context_monitor.prompt_tokens} in context)")
 
                 # --- Loop Exit Logic ---
+                if connection_error is not None:
+                    # The connection dropped: resume and keep going
+                    logger.warning(f"Gemini connection lost ({type(connection_error).__name__}). Resuming session.")
+                    if await session.switch("connection drop"):
+                        events.record(ev.SESSION_SWITCH, "drop", round(session.switchover_gaps[-1] * 1000))
+                        continue
+                    break
+                if session.resume_pending:
+                    # GoAway earlier: switch now, between turns where the caller won't notice
+                    # (or because the server has already closed this stream)
+                    if await session.switch("go_away"):
+                        events.record(ev.SESSION_SWITCH, "go_away", round(session.switchover_gaps[-1] * 1000))
+                        if not complete_flag:
+                            continue
+                elif complete_flag and not function_call_in_progress and context_monitor.compaction_due:
+                    # Context still too large: continue on a fresh session that only carries the transcript
+                    if await session.compact(transcript.as_contents()):
+                        context_monitor.compacted()
+                        events.record(ev.SESSION_SWITCH, "compaction", round(session.switchover_gaps[-1] * 1000))
                 if complete_flag:
                     logger.info("Response turn complete. Waiting for next user input or function result...")
                     await asyncio.sleep(0.1) # Small sleep
@@ -399,71 +846,159 @@ async def audio_stream_websocket(websocket: WebSocket):
             logger.info("Gemini receiver task cancelled.")
         except Exception as e:
             logger.error(f"Error receiving from Gemini: {type(e).__name__} - {e}", exc_info=True)
+            events.flush(logging.ERROR, "Gemini receiver error")
+            await play_clip(APOLOGY)
         finally:
             logger.info("Gemini receiver task finished.")
-            # Signal end to the sender queue
-            await twilio_send_queue.put(None)
+            # Signal end to the outbound path
+            gemini_audio_queue.put_nowait(None)
+
+    async def outbound_converter():
+        """
+        Converts Gemini audio for the client and queues it for twilio_sender.
+
+        This is the only producer that waits when the outbound queue is full,
+        so Gemini's reader keeps handling interruptions and tool calls while
+        a long answer plays out. End-of-turn (b"") and end-of-stream (None)
+        signals pass through in order behind the audio.
+        """
+        while True:
+            pcm24k_chunk = await gemini_audio_queue.get()
+            if not pcm24k_chunk:
+                await twilio_send_queue.put(pcm24k_chunk)
+                if pcm24k_chunk is None:
+                    break
+                continue
 
+            # Convert Gemini's PCM 24kHz to Twilio's mulaw 8kHz (batched with other calls);
+            # raw PCM clients take it as is
+            epoch = scheduler.epoch
+            if raw_pcm:
+                outbound_chunk = pcm24k_chunk
+            else:
+                convert_started = time.perf_counter()
+                outbound_chunk = await transcoder.convert(outbound_pipeline, pcm24k_chunk)
+                latency.conversion("outbound", time.perf_counter() - convert_started)
+
+            # A barge-in while converting cancels the conversion (b"") or, if the batch was already
+            # running, leaves a result for the interrupted turn; one while waiting for room in the
+            # outbound queue lets the put through into the emptied queue. Both are discarded here.
+            if scheduler.epoch != epoch:
+                events.record(ev.OUTBOUND_STALE, len(outbound_chunk)) # Converted for an interrupted turn
+            elif outbound_chunk:
+                events.record(ev.OUTBOUND_QUEUED, len(outbound_chunk))
+                await twilio_send_queue.put(outbound_chunk)
+                if scheduler.epoch != epoch and twilio_send_queue.withdraw(outbound_chunk):
+                    events.record(ev.OUTBOUND_STALE, len(outbound_chunk)) # Queued behind a barge-in
+            else:
+                events.record(ev.OUTBOUND_CARRY) # Partial sample carried over, no output yet
+
+
+    async def send_to_twilio(kind: str, data) -> None:
+        """Serializes and sends one paced outbound item (media frame or mark) to the client."""
+        if kind == MEDIA:
+            message = formatter.media(data)
+        else:
+            message = formatter.mark(data)
+            events.record(ev.MARK_SENT, data)
+        if isinstance(message, bytes): # Raw PCM audio goes out in binary frames
+            await websocket.send_bytes(message)
+        else:
+            await websocket.send_text(message)
+        if kind == MEDIA:
+            latency.outbound_frame()
+        else:
+            latency.mark_sent(data)
+
+    async def barge_in():
+        """Silences the caller's line immediately when Gemini reports an interruption."""
+        started = time.monotonic()
+        # 1. Cancel conversions still waiting for a batch and discard queued audio; outbound_converter
+        # discards whatever was already converting or waiting for room in the queue
+        cancelled = transcoder.reset(outbound_pipeline) # Next turn starts from fresh filter state
+        drained = gemini_audio_queue.clear_audio() + twilio_send_queue.clear_audio() # Keeps end-of-turn/shutdown signals
+        dropped_frames = scheduler.clear()
+        latency.interrupted()
+
+        # 2. Tell Twilio to drop what it has buffered
+        if stream_sid:
+            try:
+                await websocket.send_text(formatter.clear())
+            except Exception as e:
+                logger.error(f"Error sending 'clear' to Twilio: {type(e).__name__} - {e}")
+
+        elapsed = time.monotonic() - started
+        barge_in_latencies.append(elapsed)
+        events.record(ev.BARGE_IN, dropped_frames, round(elapsed * 1000, 1))
+        logger.info(f"Barge-in: silenced in {elapsed * 1000:.1f} ms "
+                    f"(dropped {dropped_frames} frames, {drained} queued chunks, {cancelled} pending conversions)")
 
     async def twilio_sender():
-        """Sends audio from the queue back to Twilio WebSocket."""
+        """Re-frames audio from the queue into 20 ms frames and paces them out to the client."""
         logger.info("Twilio sender task started.")
-        while True:
-            mulaw8k_chunk = await twilio_send_queue.get()
-            
+        stream_ended = False
+        while not (stream_ended and not scheduler.has_pending()):
+            # Take new audio from the queue, but only wait as long as the next frame allows.
+            # Only a little audio is staged in the scheduler; the backlog stays in the bounded
+            # queue so its overload policy (and backpressure on Gemini) applies.
+            delay = scheduler.delay()
+            mulaw8k_chunk = NO_AUDIO
+            staging_full = scheduler.queued_seconds() * 1000 >= OUTBOUND_STAGING_MS
+            if not staging_full and not twilio_send_queue.empty():
+                mulaw8k_chunk = twilio_send_queue.get_nowait()
+            elif stream_ended or staging_full:
+                await asyncio.sleep(delay or 0)
+            elif delay is None:
+                mulaw8k_chunk = await twilio_send_queue.get()
+            elif delay > 0:
+                try:
+                    mulaw8k_chunk = await asyncio.wait_for(twilio_send_queue.get(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass # Time to send the next frame
+
             # Check for complete termination signal
             if mulaw8k_chunk is None:
-                logger.info("End of Gemini audio stream signaled.")
-                break # Exit loop
-                
+                logger.info("End of Gemini audio stream signaled. Flushing remaining audio.")
+                scheduler.end_turn()
+                stream_ended = True
             # Check for empty chunk (end of turn, not end of conversation)
-            if len(mulaw8k_chunk) == 0:
+            elif mulaw8k_chunk is not NO_AUDIO and len(mulaw8k_chunk) == 0:
                 logger.info("Empty audio chunk received, signaling end of turn")
-                twilio_send_queue.task_done()
-                continue # Skip this chunk but keep the loop running
+                scheduler.end_turn()
+            elif mulaw8k_chunk is not NO_AUDIO:
+                scheduler.add_audio(mulaw8k_chunk)
 
             if not stream_sid:
                 logger.warning("Twilio stream SID not available. Cannot send media.")
-                twilio_send_queue.task_done()
+                if stream_ended:
+                    break
                 continue
 
-            logger.info(f"Sending {len(mulaw8k_chunk)} bytes of audio to Twilio")
             try:
-                # 1. Encode as Base64
-                base64_audio = base64.b64encode(mulaw8k_chunk).decode('utf-8')
-
-                # 2. Format Twilio WebSocket message
-                twilio_message = json.dumps({
-                    "event": "media",
-                    "streamSid": stream_sid,
-                    "media": {
-                        "payload": base64_audio
-                    }
-                })
-
-                # 3. Send back to Twilio
-                await websocket.send_text(twilio_message)
-                logger.debug(f"Successfully sent audio to Twilio")
-                twilio_send_queue.task_done() # Mark task as done for queue management
-
+                epoch = scheduler.epoch
+                frames_before, marks_before = scheduler.frames_sent, scheduler.marks_sent
+                for kind, data in scheduler.pop_ready():
+                    if scheduler.epoch != epoch:
+                        break # Barge-in cleared the queue while we were sending
+                    await send_to_twilio(kind, data)
+                if scheduler.frames_sent != frames_before:
+                    events.record(ev.TWILIO_FRAMES_OUT, scheduler.frames_sent - frames_before, scheduler.marks_sent - marks_before)
             except WebSocketDisconnect:
                 logger.warning("Twilio WebSocket disconnected while trying to send media.")
-                twilio_send_queue.task_done()
                 break
             except Exception as e:
                 logger.error(f"Error sending audio to Twilio: {type(e).__name__} - {e}", exc_info=True)
-                twilio_send_queue.task_done()
-
-            await asyncio.sleep(0.005) # Small sleep to yield control
+                events.flush(logging.ERROR, "Twilio sender error")
 
-        logger.info("Twilio sender task finished.")
+        logger.info(f"Twilio sender task finished. Sent {scheduler.frames_sent} frames and {scheduler.marks_sent} marks.")
 
 
     # --- Task Management ---
     # Create tasks for handling each direction
-    receiver_twilio_task = asyncio.create_task(twilio_receiver())
-    processor_gemini_task = asyncio.create_task(gemini_processor())
-    sender_twilio_task = asyncio.create_task(twilio_sender())
+    receiver_twilio_task = asyncio.create_task(twilio_receiver(), name=call_task_name(call_tag, "twilio_receiver"))
+    processor_gemini_task = asyncio.create_task(gemini_processor(), name=call_task_name(call_tag, "gemini_processor"))
+    converter_task = asyncio.create_task(outbound_converter(), name=call_task_name(call_tag, "outbound_converter"))
+    sender_twilio_task = asyncio.create_task(twilio_sender(), name=call_task_name(call_tag, "twilio_sender"))
 
     # Wait for Twilio receiver to end (when the actual call ends)
     try:
@@ -473,23 +1008,27 @@ async def audio_stream_websocket(websocket: WebSocket):
         logger.error(f"Twilio receiver task failed with: {e}", exc_info=True)
     finally:
         logger.info("Twilio connection ended. Cleaning up...")
+        metrics.add_gauge("active_calls", -1)
+        active_calls.pop(call_tag, None)
         
         # Cancel the other tasks
-        for task in [processor_gemini_task, sender_twilio_task]:
+        for task in [processor_gemini_task, converter_task, sender_twilio_task]:
             if not task.done():
                 logger.debug(f"Cancelling task: {task}")
                 task.cancel()
 
         # Wait briefly for cancelled tasks to finish cleanup
         try:
-            await asyncio.wait([t for t in [processor_gemini_task, sender_twilio_task] 
+            await asyncio.wait([t for t in [processor_gemini_task, converter_task, sender_twilio_task] 
                             if not t.done()], timeout=5.0)
         except Exception as e:
             logger.error(f"Error waiting for tasks to cancel: {e}")
 
         # Check for exceptions in completed tasks
-        for task in [processor_gemini_task, sender_twilio_task]:
-            if task.cancelled():
+        for task in [processor_gemini_task, converter_task, sender_twilio_task]:
+            if not task.done():
+                logger.warning(f"Task {task.get_name()} still running 5s after cancellation.")
+            elif task.cancelled():
                 logger.debug(f"Task {task} was cancelled.")
             elif task.exception():
                 exc = task.exception()
@@ -504,8 +1043,25 @@ async def audio_stream_websocket(websocket: WebSocket):
         except RuntimeError as e:
             logger.warning(f"Error closing WebSocket (may already be closed): {e}")
 
+    events.flush() # Whatever errors haven't already written out, at EVENT_LOG_FLUSH_LEVEL
+    logger.info(f"Call latency summary ({stream_sid}): {latency.summary()}")
+    logger.info(f"Gemini context: {context_monitor.stats()}")
+    if gemini_session and gemini_session.switchovers:
+        logger.info(f"Gemini session switchovers: {gemini_session.switchovers}, max gap {max(gemini_session.switchover_gaps) * 1000:.0f} ms")
+    if barge_in_latencies:
+        logger.info(f"Barge-ins: {len(barge_in_latencies)}, max interruption-to-silence {max(barge_in_latencies) * 1000:.1f} ms")
+    if vad:
+        vad_stats = vad.stats()
+        logger.info(f"VAD ({VAD_MODE}): suppressed {vad_stats['frames_suppressed']}/{vad_stats['frames_total']} frames "
+                    f"({vad_stats['suppressed_seconds']:.1f} s) across {vad_stats['speech_segments']} speech segments")
+    for queue in (audio_queue, gemini_audio_queue, twilio_send_queue):
+        q = queue.stats()
+        logger.info(f"Queue {q['queue']} ({q['policy']}): high water {q['high_water_ms']:.0f}/{q['capacity_ms']:.0f} ms, "
+                    f"dropped {q['dropped_items']} chunks ({q['dropped_ms']:.0f} ms), producer waited {q['producer_wait_seconds']:.2f} s")
+    logger.info(f"Inbound coalescing: {coalescer.frames_in} frames sent to Gemini as {coalescer.payloads_out} payloads")
+    stats = transcoder.stats()
+    logger.info(f"Transcoder ({stats['mode']}): {stats['batches']} batches, mean loop blocking {stats['mean_loop_blocked_ms']:.3f} ms, max {stats['max_loop_blocked_ms']:.3f} ms")
     logger.info(f"WebSocket handler finished for connection from: {websocket.client.host}")
-    # reset_resample_states() # Clean up audio state
 
 
 # --- Main Execution ---
@@ -517,12 +1073,14 @@ if __name__ == "__main__":
         logger.warning("Reminder: Ensure PUBLIC_HOSTNAME is correctly set and accessible.")
 
     # Use standard uvicorn worker, add keepalive pings for WebSockets
-    uvicorn.run(
+    config = uvicorn.Config(
         "__main__:app",
         host="0.0.0.0",
         port=5000,
         reload=False, # Reload can cause issues with WebSockets/async tasks state
+        loop="asyncio" if slow_callbacks else "auto", # SLOW_CALLBACK_MS > 0 gives up uvloop for the detector
         ws_ping_interval=20, # Send ping every 20s
         ws_ping_timeout=20, # Wait 20s for pong response
-        # workers=1 # Usually 1 worker is fine unless you need high concurrency
-    )
\ No newline at end of file
+        # One process; for more cores run cluster.py, which keeps each call on one worker
+    )
+    DrainingServer(config, drain).run() # SIGTERM drains calls in progress before exiting
\ No newline at end of file
@@ -0,0 +1,308 @@
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+VEGETARIAN = "vegetarian"
+VEGAN = "vegan"
+GLUTEN_FREE = "gluten-free"
+NUT_FREE = "nut-free"
+DAIRY_FREE = "dairy-free"
+HALAL = "halal"
+RESTRICTIONS = (VEGETARIAN, VEGAN, GLUTEN_FREE, NUT_FREE, DAIRY_FREE, HALAL)
+NO_RESTRICTIONS = "no restrictions"
+
+RENDER_CACHE_SIZE = 256 # Formatted answers kept per cuisine
+ATTRIBUTES = re.compile(r"\(([^()]*)\)\s*$") # "Upma (Vegetarian, Contains Nuts - specify nut-free)"
+
+
+def normalize(name: str) -> str:
+    """Lookup key for cuisine names: case- and whitespace-insensitive."""
+    return " ".join(name.split()).casefold()
+
+
+def restriction_tags(attributes: list) -> tuple:
+    """
+    Which dietary restrictions an item satisfies, from its annotations.
+
+    Returns:
+        (frozenset of satisfied restrictions, {restriction: note appended to the item when listed for it})
+    """
+    attrs = set(attributes)
+    vegetarian = VEGETARIAN in attrs
+    vegan_option = "vegan option available" in attrs
+    contains_nuts = any(a.startswith("contains nuts") for a in attrs)
+    tags, notes = set(), {}
+    if vegetarian:
+        tags.add(VEGETARIAN)
+    if VEGAN in attrs or (vegetarian and vegan_option):
+        tags.add(VEGAN)
+    if (GLUTEN_FREE in attrs or "gluten-free option available" in attrs) and "contains gluten" not in attrs:
+        tags.add(GLUTEN_FREE)
+    if not contains_nuts:
+        tags.add(NUT_FREE)
+    elif "contains nuts - specify nut-free" in attrs: # Can be made without nuts on request
+        tags.add(NUT_FREE)
+        notes[NUT_FREE] = " (Specify Nut-Free)"
+    if "contains dairy" not in attrs or vegan_option:
+        tags.add(DAIRY_FREE)
+    if HALAL in attrs:
+        tags.add(HALAL)
+    return frozenset(tags), notes
+
+
+class MenuItem:
+    """One menu line, parsed once: its text, annotations and the restrictions it satisfies."""
+
+    __slots__ = ("label", "attributes", "tags", "notes")
+
+    def __init__(self, label: str):
+        self.label = label
+        match = ATTRIBUTES.search(label)
+        self.attributes = [a.strip().lower() for a in match.group(1).split(",")] if match else []
+        self.tags, self.notes = restriction_tags(self.attributes)
+
+    def line(self, restriction: str = None) -> str:
+        return f"- {self.label}{self.notes.get(restriction, '')}\n"
+
+
+class CuisineMenu:
+    """
+    One cuisine's menu, indexed for getMenu.
+
+    Items are parsed once; `index` maps each restriction to the positions of
+    the items satisfying it (an inverted index), so a filtered menu is a set
+    lookup per category instead of a scan of every item's text. Formatted
+    answers are memoized per (restriction, display name) in a bounded LRU
+    owned by this object: it is immutable, so a changed menu means a new
+    CuisineMenu and a fresh cache.
+
+    Args:
+        name: Display name, e.g. "Andhra Cafe".
+        categories: {category: [item text, ...]}, in menu order.
+    """
+
+    def __init__(self, name: str, categories: dict, cache_size: int = RENDER_CACHE_SIZE):
+        self.name = name
+        self.categories = [(category, [MenuItem(label) for label in labels]) for category, labels in categories.items()]
+        index = {restriction: set() for restriction in RESTRICTIONS}
+        position = 0
+        for _, items in self.categories:
+            for item in items:
+                for tag in item.tags:
+                    index[tag].add(position)
+                position += 1
+        self.index = {tag: frozenset(positions) for tag, positions in index.items()}
+        self.render = functools.lru_cache(maxsize=cache_size)(self._render)
+
+    def __len__(self) -> int:
+        return sum(len(items) for _, items in self.categories)
+
+    def _render(self, dietary_restrictions: str, display_name: str) -> str:
+        restriction = dietary_restrictions.lower() if dietary_restrictions else None
+        filtering = restriction not in (None, NO_RESTRICTIONS)
+        matching = self.index.get(restriction, frozenset()) if filtering else None
+
+        sections = []
+        position = 0
+        for category, items in self.categories:
+            if matching is None:
+                lines = [item.line() for item in items]
+            else:
+                lines = [item.line(restriction) for offset, item in enumerate(items) if position + offset in matching]
+            position += len(items)
+            if lines:
+                sections.append(f"\n**{category}**\n" + "".join(lines))
+
+        if not sections:
+            if filtering:
+                logger.warning(f"No items found matching '{dietary_restrictions}' on the {display_name} menu.")
+                return f"Sorry, we couldn't find any items matching '{dietary_restrictions}' on the {display_name} menu."
+            return f"Sorry, I couldn't find menu items for {display_name} matching your request."
+        header = f"Okay, here is the {display_name} menu" + (f" filtered for {dietary_restrictions}" if filtering else "") + ":\n"
+        return (header + "".join(sections)).strip()
+
+
+class MenuEngine:
+    """
+    All cuisines' menus, looked up by name (case-insensitively).
+
+    Args:
+        cuisines: CuisineMenu objects; the first is the default when no cuisine is asked for.
+    """
+
+    def __init__(self, cuisines: list, version: int = 1, digest: str = ""):
+        self.cuisines = {normalize(menu.name): menu for menu in cuisines}
+        self.default = cuisines[0] if cuisines else None
+        self.version = version
+        self.digest = digest
+
+    @classmethod
+    def from_dict(cls, full_menu: dict) -> "MenuEngine":
+        return cls([CuisineMenu(name, categories) for name, categories in full_menu.items()])
+
+    def names(self) -> list:
+        return [menu.name for menu in self.cuisines.values()]
+
+    def get_menu(self, cuisine: str = None, dietary_restrictions: str = None) -> str:
+        """The getMenu answer: a formatted (optionally filtered) menu, or an apology."""
+        if cuisine:
+            menu = self.cuisines.get(normalize(cuisine))
+            if menu is None:
+                logger.warning(f"Requested cuisine '{cuisine}' not found.")
+                return f"Sorry, we don't have a specific menu for {cuisine}. Available cuisines are: {', '.join(self.names())}."
+            return menu.render(dietary_restrictions, menu.name)
+        if self.default is None:
+            logger.error("No menus loaded.")
+            return "Sorry, there seems to be an issue retrieving the menu right now."
+        return self.default.render(dietary_restrictions, f"{self.default.name} (Default)")
+
+
+# --- Menu sources ---
+
+def load_json(path: str) -> dict:
+    """{cuisine: {category: [item text, ...]}} from a JSON file of that shape."""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_sqlite(path: str) -> dict:
+    """
+    The same shape from a SQLite database with a `menu_items(cuisine, category, item)`
+    table; cuisines, categories and items keep their insertion (rowid) order.
+    """
+    full_menu = {}
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        for cuisine, category, item in connection.execute("SELECT cuisine, category, item FROM menu_items ORDER BY rowid"):
+            full_menu.setdefault(cuisine, {}).setdefault(category, []).append(item)
+    finally:
+        connection.close()
+    return full_menu
+
+
+def loader_for(path: str):
+    return load_sqlite if os.path.splitext(path)[1].lower() in (".db", ".sqlite", ".sqlite3") else load_json
+
+
+def _digest(value) -> str:
+    return hashlib.sha256(json.dumps(value, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class MenuStore:
+    """
+    Holds the current MenuEngine, loaded from a menu file, and replaces it when the file changes.
+
+    Each load is a new immutable, versioned MenuEngine swapped in with one
+    assignment, so getMenu always reads a complete menu from memory and never
+    waits on the disk. A background task checks the source's mtime every
+    `poll_interval_s` and reloads in a worker thread. Cuisines whose contents
+    hash the same as before keep their CuisineMenu (index and answer cache
+    included); only changed or new ones are re-parsed. A source that fails to
+    load (e.g. half-written JSON) is logged and the current version stays in place.
+
+    Args:
+        path: A JSON file, or a SQLite database (.db/.sqlite) with a `menu_items` table.
+        poll_interval_s: How often to look for changes (0 disables the watcher).
+    """
+
+    def __init__(self, path: str, poll_interval_s: float = 2.0):
+        self.path = path
+        self.poll_interval = poll_interval_s
+        self._load = loader_for(path)
+        self._mtimes = None
+        self._current = None
+        self._cuisines = {} # name -> (contents digest, CuisineMenu) of the current version
+        self._lock = threading.Lock() # The watcher thread vs POST /admin/reload
+        self._task = None
+        self.failed_reloads = 0
+        self.rebuilt_cuisines = 0
+        self.reload()
+
+    @property
+    def current(self) -> MenuEngine:
+        return self._current
+
+    def _stat(self) -> list:
+        # A SQLite database in WAL mode takes writes in its -wal file first
+        paths = [self.path, self.path + "-wal"] if self._load is load_sqlite else [self.path]
+        return [os.stat(path).st_mtime_ns if os.path.exists(path) else None for path in paths]
+
+    def reload(self) -> bool:
+        """Loads a new version if the menu's contents changed. Returns True if it did."""
+        with self._lock:
+            self._mtimes = self._stat()
+            try:
+                full_menu = self._load(self.path)
+                digests = {name: _digest(categories) for name, categories in full_menu.items()}
+                digest = _digest(list(digests.items()))
+                if self._current is not None and digest == self._current.digest:
+                    return False
+                cuisines, rebuilt = [], []
+                for name, categories in full_menu.items():
+                    previous = self._cuisines.get(name)
+                    if previous is not None and previous[0] == digests[name]:
+                        cuisines.append(previous[1])
+                    else:
+                        cuisines.append(CuisineMenu(name, categories))
+                        rebuilt.append(name)
+            except Exception as e:
+                if self._current is None:
+                    raise
+                self.failed_reloads += 1
+                logger.error(f"Menu reload failed, keeping version {self._current.version}: {type(e).__name__} - {e}")
+                return False
+            version = self._current.version + 1 if self._current else 1
+            self._cuisines = {menu.name: (digests[menu.name], menu) for menu in cuisines}
+            self._current = MenuEngine(cuisines, version=version, digest=digest)
+            self.rebuilt_cuisines += len(rebuilt)
+            logger.info(f"Menu version {version} loaded from {self.path}: "
+                        f"{len(cuisines)} cuisines, rebuilt {', '.join(rebuilt) or 'none'}")
+            return True
+
+    def changed(self) -> bool:
+        """Cheap check: has the source's mtime moved since the last reload?"""
+        try:
+            return self._stat() != self._mtimes
+        except OSError:
+            return False # Mid-save; look again next time
+
+    def start(self):
+        if self.poll_interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._watch(), name="menu-watcher")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            if self.changed():
+                await asyncio.to_thread(self.reload)
+
+    def stats(self) -> dict:
+        return {
+            "version": self._current.version,
+            "digest": self._current.digest[:12],
+            "source": self.path,
+            "cuisines": self._current.names(),
+            "rebuilt_cuisines": self.rebuilt_cuisines,
+            "failed_reloads": self.failed_reloads,
+        }
+
+
+# Lives outside the (hot-reloadable) tool module, so reloading the tools keeps the loaded menu
+menus = MenuStore(os.getenv("MENU_SOURCE", "menu.json"), poll_interval_s=float(os.getenv("MENU_RELOAD_INTERVAL_S", "2")))
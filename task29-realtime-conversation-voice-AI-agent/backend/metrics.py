@@ -0,0 +1,222 @@
+import logging
+import time
+from collections import deque
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.95, 0.99)
+DEFAULT_WINDOW = 2048 # Most recent samples kept per histogram
+
+
+class LatencyHistogram:
+    """
+    Latency samples for one metric, reported as p50/p95/p99.
+
+    Keeps a running count and sum plus a window of the most recent samples;
+    percentiles are computed from the window when read, so observing is O(1)
+    on the audio path.
+    """
+
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        self._samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def quantiles(self, quantiles=QUANTILES) -> dict:
+        if not self._samples:
+            return {q: float("nan") for q in quantiles}
+        values = np.quantile(np.fromiter(self._samples, dtype=np.float64), quantiles)
+        return {q: float(v) for q, v in zip(quantiles, values)}
+
+    def summary(self) -> dict:
+        if not self._samples:
+            return {"count": 0}
+        samples = list(self._samples)
+        return {
+            "count": len(samples),
+            "mean_ms": 1000.0 * sum(samples) / len(samples),
+            "max_ms": 1000.0 * max(samples),
+        }
+
+
+class MetricsRegistry:
+    """
+    Process-wide latency histograms and gauges, rendered for `/metrics`.
+
+    Histograms are keyed by name plus an optional label tuple, e.g.
+    ("tool_latency_seconds", (("tool", "getMenu"),)).
+    """
+
+    def __init__(self, prefix: str = "voice_gateway"):
+        self.prefix = prefix
+        self._histograms = {}
+        self._gauges = {}
+
+    def histogram(self, name: str, **labels) -> LatencyHistogram:
+        key = (name, tuple(sorted(labels.items())))
+        hist = self._histograms.get(key)
+        if hist is None:
+            hist = self._histograms[key] = LatencyHistogram()
+        return hist
+
+    def observe(self, name: str, seconds: float, **labels):
+        self.histogram(name, **labels).observe(seconds)
+
+    def set_gauge(self, name: str, value: float):
+        self._gauges[name] = value
+
+    def add_gauge(self, name: str, delta: float):
+        self._gauges[name] = self._gauges.get(name, 0) + delta
+
+    def snapshot(self) -> dict:
+        """Percentiles in milliseconds per histogram, plus gauges; for JSON and logs."""
+        histograms = {}
+        for (name, labels), hist in sorted(self._histograms.items()):
+            key = name + "".join(f"[{k}={v}]" for k, v in labels)
+            histograms[key] = {"count": hist.count,
+                               **{f"p{int(q * 100)}_ms": 1000.0 * v for q, v in hist.quantiles().items()}}
+        return {"histograms": histograms, "gauges": dict(self._gauges)}
+
+    def render_prometheus(self) -> str:
+        """Prometheus text exposition: each histogram as a summary with p50/p95/p99 quantiles."""
+        lines = []
+        declared = set()
+        for (name, labels), hist in sorted(self._histograms.items()):
+            metric = f"{self.prefix}_{name}"
+            if metric not in declared:
+                lines.append(f"# TYPE {metric} summary")
+                declared.add(metric)
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+            for q, value in hist.quantiles().items():
+                quantile_labels = ",".join(filter(None, [label_text, f'quantile="{q}"']))
+                lines.append(f"{metric}{{{quantile_labels}}} {value:.6f}")
+            suffix = f"{{{label_text}}}" if label_text else ""
+            lines.append(f"{metric}_sum{suffix} {hist.total:.6f}")
+            lines.append(f"{metric}_count{suffix} {hist.count}")
+        for name, value in sorted(self._gauges.items()):
+            metric = f"{self.prefix}_{name}"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class CallLatencyTracker:
+    """
+    Timestamps the latency-relevant events of one call and feeds the registry.
+
+    Derived latencies:
+      response_latency_seconds:    last caller speech frame -> first outbound Twilio frame
+                                   (what the caller experiences, minus network/jitter buffers)
+      gemini_first_audio_seconds:  last caller speech frame -> first Gemini audio chunk
+      tool_latency_seconds{tool}:  tool call start -> end
+      conversion_seconds{direction}: one audio conversion, including batching wait
+      playback_seconds:            first outbound frame after a mark -> Twilio echoing the next mark
+                                   (the caller has heard the whole response)
+
+    A response is only measured against speech heard since the previous
+    response started, so greetings and tool follow-ups aren't mis-attributed.
+    Per-call samples are kept for the end-of-call summary.
+    """
+
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+        self.started_at = time.monotonic()
+        self.last_speech_at = None
+        self._speech_pending = False # Speech heard since the last response started
+        self._turn_speech_at = None  # Speech end the current response answers
+        self._turn_started = False   # Gemini audio arrived for the current turn
+        self._awaiting_first_frame = False
+        self._playback_started_at = None # First frame sent since the last mark
+        self._marks = {} # mark name -> first frame time of the audio it closes
+        self._tool_started = {}
+        self._call = {} # name -> LatencyHistogram, this call only
+        self.turns = 0
+        self.tool_calls = 0
+
+    def _observe(self, name: str, seconds: float, **labels):
+        self.registry.observe(name, seconds, **labels)
+        key = name + "".join(f"[{v}]" for _, v in sorted(labels.items()))
+        hist = self._call.get(key)
+        if hist is None:
+            hist = self._call[key] = LatencyHistogram(window=1024)
+        hist.observe(seconds)
+
+    # --- Events ---
+
+    def speech_frame(self):
+        """An inbound frame carried caller speech."""
+        self.last_speech_at = time.monotonic()
+        self._speech_pending = True
+
+    def gemini_audio(self):
+        """A Gemini audio chunk arrived; the first one of a turn starts a response."""
+        if self._turn_started:
+            return
+        now = time.monotonic()
+        self._turn_started = True
+        self._awaiting_first_frame = True
+        self.turns += 1
+        self._turn_speech_at = None
+        if self._speech_pending and self.last_speech_at is not None:
+            self._turn_speech_at = self.last_speech_at
+            self._speech_pending = False
+            self._observe("gemini_first_audio_seconds", now - self._turn_speech_at)
+
+    def outbound_frame(self):
+        """A media frame was sent to Twilio."""
+        now = time.monotonic()
+        if self._playback_started_at is None:
+            self._playback_started_at = now
+        if self._awaiting_first_frame:
+            self._awaiting_first_frame = False
+            if self._turn_speech_at is not None:
+                self._observe("response_latency_seconds", now - self._turn_speech_at)
+
+    def end_turn(self):
+        """Gemini finished generating; the next audio starts a new response."""
+        self._turn_started = False
+
+    def mark_sent(self, name: str):
+        """A playback mark was sent to Twilio after the audio it closes."""
+        if self._playback_started_at is not None:
+            self._marks[name] = self._playback_started_at
+            self._playback_started_at = None
+
+    def playback_complete(self, name: str):
+        """Twilio echoed a mark: the caller has heard everything before it."""
+        started = self._marks.pop(name, None)
+        if started is not None:
+            self._observe("playback_seconds", time.monotonic() - started)
+
+    def interrupted(self):
+        """Barge-in: queued audio is dropped and Twilio echoes outstanding marks early."""
+        self._turn_started = False
+        self._awaiting_first_frame = False
+        self._playback_started_at = None
+        self._marks.clear()
+
+    def tool_start(self, call_id: str):
+        self._tool_started[call_id] = time.monotonic()
+
+    def tool_end(self, call_id: str, tool_name: str):
+        started = self._tool_started.pop(call_id, None)
+        if started is not None:
+            self.tool_calls += 1
+            self._observe("tool_latency_seconds", time.monotonic() - started, tool=tool_name)
+
+    def conversion(self, direction: str, seconds: float):
+        self._observe("conversion_seconds", seconds, direction=direction)
+
+    def summary(self) -> dict:
+        return {
+            "duration_seconds": time.monotonic() - self.started_at,
+            "turns": self.turns,
+            "tool_calls": self.tool_calls,
+            **{name: hist.summary() for name, hist in sorted(self._call.items())},
+        }
@@ -0,0 +1,144 @@
+import logging
+import time
+from collections import deque
+from utils import TWILIO_SAMPLE_RATE, TWILIO_SAMPLE_WIDTH
+
+logger = logging.getLogger(__name__)
+
+TWILIO_FRAME_MS = 20
+TWILIO_FRAME_BYTES = TWILIO_SAMPLE_RATE * TWILIO_SAMPLE_WIDTH * TWILIO_FRAME_MS // 1000 # 160 bytes of mulaw
+
+# Outbound queue item kinds
+MEDIA = "media"
+MARK = "mark"
+
+
+class OutboundScheduler:
+    """
+    Re-frames outbound audio into 20 ms frames and paces them in real time.
+
+    Gemini audio arrives in bursts of arbitrary size. The scheduler slices it
+    into 20 ms frames (160 bytes of mulaw for Twilio) and releases them
+    against a monotonic playout clock, keeping at most `lead_ms` of audio
+    queued at Twilio ahead of what the caller is hearing. At the end of each
+    turn it queues a Twilio `mark`; Twilio echoes the mark once everything
+    before it has been played, and `on_mark()` turns that into an accurate
+    end-of-playback timestamp.
+
+    Usage:
+        scheduler.add_audio(mulaw)         # any size
+        scheduler.end_turn()               # flush partial frame + queue mark
+        for kind, data in scheduler.pop_ready(): ...send...
+        await asyncio.sleep(scheduler.delay())
+
+    Args:
+        lead_ms: How far ahead of real time frames may be sent.
+        bytes_per_second: Rate of the outbound audio format (8 kHz mulaw by default).
+    """
+
+    def __init__(self, lead_ms: int = 60, bytes_per_second: int = TWILIO_SAMPLE_RATE * TWILIO_SAMPLE_WIDTH):
+        self.lead = lead_ms / 1000.0
+        self.bytes_per_second = bytes_per_second
+        self.frame_bytes = bytes_per_second * TWILIO_FRAME_MS // 1000
+        self._partial = bytearray()
+        self._items = deque() # (MEDIA, frame bytes) or (MARK, name)
+        self._queued_bytes = 0 # Framed audio not yet sent
+        self._playout_end = 0.0 # Monotonic time Twilio finishes playing what was sent
+        self._turns = 0
+        self.pending_marks = {} # name -> monotonic time the mark was sent
+        self.epoch = 0 # Bumped by clear(); senders stop mid-batch when it changes
+        self.playback_complete_at = None
+        # Counters
+        self.frames_sent = 0
+        self.marks_sent = 0
+
+    def add_audio(self, audio: bytes):
+        """Appends outbound audio; complete 20 ms frames become ready to pace out."""
+        self._partial += audio
+        whole = len(self._partial) - len(self._partial) % self.frame_bytes
+        for start in range(0, whole, self.frame_bytes):
+            self._items.append((MEDIA, bytes(self._partial[start:start + self.frame_bytes])))
+        self._queued_bytes += whole
+        del self._partial[:whole]
+
+    def end_turn(self) -> str:
+        """Flushes the trailing partial frame and queues a mark. Returns the mark name."""
+        if self._partial:
+            self._items.append((MEDIA, bytes(self._partial)))
+            self._queued_bytes += len(self._partial)
+            self._partial.clear()
+        self._turns += 1
+        name = f"turn-{self._turns}"
+        self._items.append((MARK, name))
+        return name
+
+    def has_pending(self) -> bool:
+        return bool(self._items) or bool(self._partial)
+
+    def queued_seconds(self) -> float:
+        """Audio held here that has not been sent to Twilio yet."""
+        return (self._queued_bytes + len(self._partial)) / self.bytes_per_second
+
+    def buffered_seconds(self) -> float:
+        """Audio sent to Twilio that has not been played yet."""
+        return max(0.0, self._playout_end - time.monotonic())
+
+    def delay(self):
+        """Seconds until the next item may be sent, or None if nothing is queued."""
+        if not self._items:
+            return None
+        if self._items[0][0] == MARK:
+            return 0.0
+        return max(0.0, self._playout_end - self.lead - time.monotonic())
+
+    def pop_ready(self) -> list:
+        """Removes and returns every item that may be sent now, advancing the playout clock."""
+        ready = []
+        now = time.monotonic()
+        while self._items:
+            kind, data = self._items[0]
+            if kind == MEDIA:
+                if self._playout_end - now > self.lead:
+                    break
+                self._playout_end = max(self._playout_end, now) + len(data) / self.bytes_per_second
+                self._queued_bytes -= len(data)
+                self.frames_sent += 1
+            else:
+                self.pending_marks[data] = now
+                self.marks_sent += 1
+            ready.append(self._items.popleft())
+        return ready
+
+    def on_mark(self, name: str):
+        """
+        Records Twilio's echo of a mark (i.e. playback reached it).
+
+        Returns:
+            Seconds between sending the mark and Twilio reaching it in
+            playback, or None for marks this scheduler didn't send.
+        """
+        sent_at = self.pending_marks.pop(name, None)
+        if sent_at is None:
+            return None
+        self.playback_complete_at = time.monotonic()
+        return self.playback_complete_at - sent_at
+
+    def clear(self) -> int:
+        """
+        Drops everything not yet sent, for barge-in. Pair with Twilio's `clear` event.
+
+        Twilio discards its own buffer on `clear`, so the playout clock is reset
+        and marks already sent are forgotten (Twilio echoes them immediately,
+        which must not count as playback completing).
+
+        Returns:
+            Number of queued frames that were dropped.
+        """
+        dropped = sum(1 for kind, _ in self._items if kind == MEDIA) + (1 if self._partial else 0)
+        self._items.clear()
+        self._partial.clear()
+        self._queued_bytes = 0
+        self._playout_end = 0.0
+        self.pending_marks.clear()
+        self.epoch += 1
+        return dropped
@@ -0,0 +1,71 @@
+import json
+import logging
+from utils import GEMINI_INPUT_SAMPLE_RATE, GEMINI_INPUT_SAMPLE_WIDTH, GEMINI_OUTPUT_SAMPLE_RATE, GEMINI_OUTPUT_SAMPLE_WIDTH
+
+logger = logging.getLogger(__name__)
+
+# Raw PCM streams (/pcm_stream) carry audio in Gemini's own formats, so nothing is converted:
+#   client -> server: binary frames of 16 kHz PCM16 mono, any length
+#   server -> client: binary frames of 24 kHz PCM16 mono, 20 ms each
+# Control messages are small JSON text frames, as on Twilio streams:
+#   client -> server: {"event": "mark", "name": ...} once playback reaches a mark, {"event": "stop"}
+#   server -> client: {"event": "mark", "name": ...} at the end of each turn, {"event": "clear"} on barge-in
+FRAME_MS = 20
+INPUT_BYTES_PER_MS = GEMINI_INPUT_SAMPLE_RATE * GEMINI_INPUT_SAMPLE_WIDTH // 1000   # 32
+OUTPUT_BYTES_PER_MS = GEMINI_OUTPUT_SAMPLE_RATE * GEMINI_OUTPUT_SAMPLE_WIDTH // 1000 # 48
+INPUT_FRAME_BYTES = INPUT_BYTES_PER_MS * FRAME_MS # 640
+
+
+def parse_pcm_message(message: dict) -> tuple:
+    """
+    Parses one ASGI websocket.receive message from a raw PCM stream.
+
+    Returns:
+        (event, data, payload) like `parse_twilio_message`: binary frames are
+        ("media", None, pcm16k bytes); text frames are parsed as JSON control messages.
+
+    Raises:
+        json.JSONDecodeError: for a text frame that isn't JSON.
+    """
+    if message.get("bytes") is not None:
+        return "media", None, message["bytes"]
+    data = json.loads(message.get("text") or "{}")
+    return data.get("event"), data, None
+
+
+class InboundFramer:
+    """
+    Cuts client audio of any length into 20 ms PCM16 frames, the unit the VAD
+    and the inbound queue work in (Twilio delivers 20 ms frames already).
+    """
+
+    def __init__(self, frame_bytes: int = INPUT_FRAME_BYTES):
+        self.frame_bytes = frame_bytes
+        self._buffer = bytearray()
+
+    def add(self, pcm: bytes) -> list:
+        """Returns the complete frames now available; a trailing partial frame is kept for the next call."""
+        self._buffer += pcm
+        whole = len(self._buffer) - len(self._buffer) % self.frame_bytes
+        frames = [bytes(self._buffer[start:start + self.frame_bytes]) for start in range(0, whole, self.frame_bytes)]
+        del self._buffer[:whole]
+        return frames
+
+    def flush(self) -> bytes:
+        """The trailing partial frame, at the end of the stream."""
+        tail = bytes(self._buffer)
+        self._buffer.clear()
+        return tail
+
+
+class PcmMessageFormatter:
+    """Outbound messages for a raw PCM stream: audio goes out as is, in binary frames."""
+
+    def media(self, pcm24k_frame: bytes) -> bytes:
+        return pcm24k_frame
+
+    def mark(self, name: str) -> str:
+        return json.dumps({"event": "mark", "name": name})
+
+    def clear(self) -> str:
+        return '{"event":"clear"}'
@@ -0,0 +1,64 @@
+"""
+Renders the gateway's prompt clips to 8 kHz mulaw with Gemini text-to-speech.
+
+Each clip is synthesized once, in the agent's voice, as 24 kHz PCM and
+converted with the gateway's own outbound conversion, then written to
+CLIPS_DIR as <name>.ulaw for clips.ClipCache. Re-run it after changing
+the texts or the voice; workers pick the clips up when they start.
+
+Usage: python render_clips.py [--dir clips] [--voice Puck] [--only greeting filler]
+"""
+import argparse
+import os
+from dotenv import load_dotenv
+from google import genai
+from google.genai import types
+from clips import APOLOGY, BUSY, CLIP_EXTENSION, FILLER, GREETING, HOLD
+from utils import pcm24k_to_mulaw8k
+
+TTS_MODEL = "gemini-2.5-flash-preview-tts"
+
+# name -> texts; a second text becomes the variant <name>-2, and so on
+CLIP_TEXTS = {
+    GREETING: ["Hello! Thanks for calling Andhra Cafe. How can I help you today?"],
+    FILLER: ["One moment while I check that for you.", "Just a second, let me look that up."],
+    APOLOGY: ["Sorry, I'm having trouble right now. Please call us back in a few minutes."],
+    HOLD: ["All of our assistants are busy right now. Please hold."],
+    BUSY: ["Sorry, we can't take your call right now. Please try again later."],
+}
+
+
+def synthesize(client: genai.Client, text: str, voice: str) -> bytes:
+    """24 kHz PCM16 speech for `text`."""
+    response = client.models.generate_content(
+        model=TTS_MODEL,
+        contents=text,
+        config=types.GenerateContentConfig(
+            response_modalities=["AUDIO"],
+            speech_config=types.SpeechConfig(
+                voice_config=types.VoiceConfig(prebuilt_voice_config=types.PrebuiltVoiceConfig(voice_name=voice))
+            ),
+        ),
+    )
+    return response.candidates[0].content.parts[0].inline_data.data
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dir", default=os.getenv("CLIPS_DIR", "clips"))
+    parser.add_argument("--voice", default="Puck") # GEMINI_VOICE_NAME in main.py
+    parser.add_argument("--only", nargs="+", choices=sorted(CLIP_TEXTS))
+    args = parser.parse_args()
+
+    client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+    os.makedirs(args.dir, exist_ok=True)
+    for name, texts in CLIP_TEXTS.items():
+        if args.only and name not in args.only:
+            continue
+        for variant, text in enumerate(texts, start=1):
+            mulaw = pcm24k_to_mulaw8k(synthesize(client, text, args.voice))
+            path = os.path.join(args.dir, (name if variant == 1 else f"{name}-{variant}") + CLIP_EXTENSION)
+            with open(path, "wb") as f:
+                f.write(mulaw)
+            print(f"{path}: {len(mulaw) / 8000:.1f} s  \"{text}\"")
@@ -0,0 +1,151 @@
+import asyncio
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+SLOT_FORMAT = "%Y-%m-%d %H:%M" # Sorts like the times it names, so slot ranges are index range scans
+FIRST_RESERVATION_ID = 1001
+# A booking gives up if it can't start (wait its turn on the database thread) within
+# START_DEADLINE_S, or can't get the write lock from another process within BUSY_TIMEOUT_S.
+# Together with the queries themselves (milliseconds) that stays inside reserveTable's 3 s
+# tool timeout, so the tool never abandons a booking that is still going to commit.
+START_DEADLINE_S = 1.0
+BUSY_TIMEOUT_S = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS slots (
+    slot TEXT PRIMARY KEY,
+    seats_booked INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS reservations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    slot TEXT NOT NULL,
+    party_size INTEGER NOT NULL,
+    name TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reservations_by_slot ON reservations (slot);
+"""
+
+
+class ReservationBook:
+    """
+    Table reservations in an embedded SQLite database (WAL mode), kept outside
+    the (hot-reloadable) tool module so reloading the tools doesn't touch them.
+
+    `slots` holds the seats booked per slot, keyed by its start time: it is
+    the capacity index. Booking is one conditional UPDATE on a slot's row
+    inside an immediate (write-locked) transaction, so the capacity check and
+    the booking can't be split by another booking, whether from this worker
+    or another process of the cluster sharing the database file. Looking for
+    other free slots reads a range of `slots` on the primary key; it never
+    scans the reservations.
+
+    The async methods run the queries on one dedicated thread, so the event
+    loop never waits on the database and there is one connection per book.
+    A booking is bounded in time (START_DEADLINE_S, BUSY_TIMEOUT_S): it
+    either commits while its caller still waits for the answer, or fails
+    without booking anything, so a retry can't book the table twice.
+
+    Args:
+        path: SQLite database file (":memory:" for a throwaway book).
+        slot_minutes: Length of a seating slot; bookings are rounded down to one.
+        seats_per_slot: Seats the restaurant can seat per slot.
+    """
+
+    def __init__(self, path: str, slot_minutes: int = 30, seats_per_slot: int = 40):
+        self.path = path
+        self.slot_minutes = slot_minutes
+        self.seats_per_slot = seats_per_slot
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reservations")
+        self._lock = threading.Lock() # Guards the connection for the sync methods
+        self._db = sqlite3.connect(path, timeout=BUSY_TIMEOUT_S, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL") # Durable across crashes of the process; enough for bookings
+        with self._lock:
+            self._db.executescript(SCHEMA)
+            self._db.execute("INSERT INTO sqlite_sequence (name, seq) SELECT 'reservations', ? WHERE NOT EXISTS "
+                             "(SELECT 1 FROM sqlite_sequence WHERE name = 'reservations')", (FIRST_RESERVATION_ID - 1,))
+
+    def slot_for(self, when: datetime.datetime) -> datetime.datetime:
+        return when.replace(minute=when.minute - when.minute % self.slot_minutes, second=0, microsecond=0)
+
+    def book_sync(self, when: datetime.datetime, party_size: int, name: str = None, start_by: float = None) -> int:
+        """
+        Books `party_size` seats in the slot containing `when`. Returns a reservation number, or None if full.
+
+        Raises:
+            sqlite3.OperationalError: if the database stays locked, or the booking
+                couldn't start by `start_by` (a time.monotonic() value); nothing is booked.
+        """
+        slot = self.slot_for(when).strftime(SLOT_FORMAT)
+        with self._lock:
+            if start_by is not None and time.monotonic() > start_by:
+                raise sqlite3.OperationalError("database is busy: the booking couldn't start in time")
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("INSERT INTO slots (slot, seats_booked) VALUES (?, 0) ON CONFLICT DO NOTHING", (slot,))
+                booked = self._db.execute(
+                    "UPDATE slots SET seats_booked = seats_booked + ? WHERE slot = ? AND seats_booked + ? <= ?",
+                    (party_size, slot, party_size, self.seats_per_slot),
+                ).rowcount
+                if not booked:
+                    self._db.execute("ROLLBACK")
+                    return None
+                reservation_id = self._db.execute(
+                    "INSERT INTO reservations (slot, party_size, name, created_at) VALUES (?, ?, ?, ?)",
+                    (slot, party_size, name, datetime.datetime.now().isoformat(timespec="seconds")),
+                ).lastrowid
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return reservation_id
+
+    def seats_free_sync(self, first: datetime.datetime, last: datetime.datetime) -> dict:
+        """Free seats in each slot from `first` to `last` (inclusive), slot start -> seats."""
+        first, last = self.slot_for(first), self.slot_for(last)
+        with self._lock:
+            rows = dict(self._db.execute("SELECT slot, seats_booked FROM slots WHERE slot BETWEEN ? AND ?",
+                                         (first.strftime(SLOT_FORMAT), last.strftime(SLOT_FORMAT))))
+        free, slot = {}, first
+        while slot <= last:
+            free[slot] = self.seats_per_slot - rows.get(slot.strftime(SLOT_FORMAT), 0)
+            slot += datetime.timedelta(minutes=self.slot_minutes)
+        return free
+
+    def alternatives_sync(self, when: datetime.datetime, party_size: int, first: datetime.datetime,
+                          last: datetime.datetime, limit: int = 3) -> list:
+        """Up to `limit` other slots between `first` and `last` with room for the party, nearest to `when` first."""
+        requested = self.slot_for(when)
+        free = self.seats_free_sync(first, last)
+        candidates = [slot for slot, seats in free.items() if seats >= party_size and slot != requested]
+        return sorted(sorted(candidates, key=lambda slot: abs(slot - requested))[:limit])
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def book(self, when: datetime.datetime, party_size: int, name: str = None) -> int:
+        return await self._run(self.book_sync, when, party_size, name, time.monotonic() + START_DEADLINE_S)
+
+    async def seats_free(self, first: datetime.datetime, last: datetime.datetime) -> dict:
+        return await self._run(self.seats_free_sync, first, last)
+
+    async def alternatives(self, when: datetime.datetime, party_size: int, first: datetime.datetime,
+                           last: datetime.datetime, limit: int = 3) -> list:
+        return await self._run(self.alternatives_sync, when, party_size, first, last, limit)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._db.close()
+
+
+book = ReservationBook(os.getenv("RESERVATIONS_DB", "reservations.db"),
+                       slot_minutes=int(os.getenv("RESERVATION_SLOT_MINUTES", "30")),
+                       seats_per_slot=int(os.getenv("RESERVATION_SEATS_PER_SLOT", "40")))
@@ -0,0 +1,168 @@
+import asyncio
+import inspect
+import logging
+import re
+import time
+import types as pytypes
+import typing
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_TYPES = {
+    str: types.Type.STRING,
+    int: types.Type.INTEGER,
+    float: types.Type.NUMBER,
+    bool: types.Type.BOOLEAN,
+}
+ARGS_SECTION = re.compile(r"^\s*Args:\s*$", re.MULTILINE)
+SECTION_END = re.compile(r"^\s*(Returns|Raises|Yields|Examples?|Notes?):\s*$", re.MULTILINE)
+ARG_LINE = re.compile(r"^\s{4,}(\w+)(?:\s*\([^)]*\))?:\s*(.*)$")
+
+
+def _schema_for(annotation) -> types.Schema:
+    """Gemini Schema for a parameter annotation: str/int/float/bool, Literal[...] (enum), list[...], Optional[...]."""
+    origin = typing.get_origin(annotation)
+    if origin in (typing.Union, pytypes.UnionType):
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        if len(args) == 1:
+            return _schema_for(args[0])
+    if origin is typing.Literal:
+        values = typing.get_args(annotation)
+        return types.Schema(type=SCHEMA_TYPES[type(values[0])], enum=[str(v) for v in values])
+    if origin is list:
+        (item,) = typing.get_args(annotation) or (str,)
+        return types.Schema(type=types.Type.ARRAY, items=_schema_for(item))
+    if annotation in SCHEMA_TYPES:
+        return types.Schema(type=SCHEMA_TYPES[annotation])
+    raise TypeError(f"Unsupported tool parameter type: {annotation!r}")
+
+
+def parse_docstring(doc: str) -> tuple:
+    """Splits a Google-style docstring into (summary, {param: description})."""
+    doc = inspect.cleandoc(doc or "")
+    args_match = ARGS_SECTION.search(doc)
+    if not args_match:
+        end = SECTION_END.search(doc)
+        return (doc[:end.start()] if end else doc).strip(), {}
+    summary = doc[:args_match.start()].strip()
+    rest = doc[args_match.end():]
+    end = SECTION_END.search(rest)
+    params, current = {}, None
+    for line in (rest[:end.start()] if end else rest).splitlines():
+        match = ARG_LINE.match(line)
+        if match and len(line) - len(line.lstrip()) <= 4:
+            current = match.group(1)
+            params[current] = match.group(2).strip()
+        elif current and line.strip():
+            params[current] += " " + line.strip() # Continuation line
+    return summary, params
+
+
+def function_declaration(func, name: str = None) -> types.FunctionDeclaration:
+    """
+    Derives a Gemini FunctionDeclaration from a function's signature and docstring.
+
+    Parameters without a default are required; descriptions come from the
+    docstring summary and its `Args:` section.
+    """
+    summary, param_docs = parse_docstring(func.__doc__)
+    hints = typing.get_type_hints(func)
+    properties, required = {}, []
+    for param in inspect.signature(func).parameters.values():
+        schema = _schema_for(hints.get(param.name, str))
+        if param.name in param_docs:
+            schema.description = param_docs[param.name]
+        properties[param.name] = schema
+        if param.default is inspect.Parameter.empty:
+            required.append(param.name)
+    return types.FunctionDeclaration(
+        name=name or func.__name__,
+        description=summary,
+        parameters=types.Schema(type=types.Type.OBJECT, properties=properties, required=required or None),
+    )
+
+
+class RegisteredTool:
+    def __init__(self, func, name: str, timeout_s: float, inline: bool = False):
+        self.func = func
+        self.name = name
+        self.timeout = timeout_s
+        self.is_async = inspect.iscoroutinefunction(func)
+        self.inline = inline and not self.is_async
+        self.declaration = function_declaration(func, name)
+
+
+class ToolRegistry:
+    """
+    Tools Gemini can call, each registered once with `@registry.tool()`.
+
+    The registry provides the tool declarations for the Live config and runs
+    the calls in a `tool_call` (the caller gathers them, so they run concurrently):
+      - async tools run on the event loop, sync ones in the loop's thread pool
+        (so a slow lookup never stalls audio for other calls), unless
+        registered `inline=True`: for in-memory lookups that take microseconds,
+        the thread hand-off would cost more than the call,
+      - each call is bounded by its tool's timeout. A timed-out sync tool's
+        thread finishes in the background, but Gemini gets an error right away.
+    Failures and timeouts become `{"error": ...}` responses, so the model can
+    tell the caller instead of the turn hanging.
+
+    Args:
+        default_timeout_s: Timeout for tools registered without one.
+    """
+
+    def __init__(self, default_timeout_s: float = 5.0):
+        self.default_timeout = default_timeout_s
+        self._tools = {}
+        self.timeouts = 0
+        self.errors = 0
+
+    def tool(self, name: str = None, timeout_s: float = None, inline: bool = False):
+        """Decorator registering a function as a tool (under its own name unless `name` is given)."""
+        def register(func):
+            tool = RegisteredTool(func, name or func.__name__, timeout_s or self.default_timeout, inline)
+            self._tools[tool.name] = tool
+            return func
+        return register
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._tools
+
+    def names(self) -> list:
+        return list(self._tools)
+
+    def declarations(self) -> list:
+        """The `tools` value for LiveConnectConfig."""
+        return [types.Tool(function_declarations=[tool.declaration for tool in self._tools.values()])]
+
+    async def call(self, function_call: types.FunctionCall) -> types.FunctionResponse:
+        """Runs one function call and returns the response for Gemini (never raises)."""
+        tool = self._tools.get(function_call.name)
+        args = dict(function_call.args or {})
+        if tool is None:
+            logger.warning(f"Received unknown function call: {function_call.name}")
+            return self._response(function_call, {"error": f"Function '{function_call.name}' is not implemented."})
+        started = time.perf_counter()
+        try:
+            if tool.inline:
+                result = tool.func(**args) # No timeout: it can't be interrupted, and must not need one
+            elif tool.is_async:
+                result = await asyncio.wait_for(tool.func(**args), timeout=tool.timeout)
+            else:
+                loop = asyncio.get_running_loop()
+                result = await asyncio.wait_for(loop.run_in_executor(None, lambda: tool.func(**args)), timeout=tool.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.error(f"Tool {tool.name} timed out after {tool.timeout:.1f} s")
+            return self._response(function_call, {"error": f"{tool.name} took too long to respond. Please try again."})
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Error executing function {tool.name}: {e}", exc_info=True)
+            return self._response(function_call, {"error": f"Failed to execute function: {e}"})
+        logger.info(f"Function '{tool.name}' returned in {(time.perf_counter() - started) * 1000:.0f} ms: {result}")
+        return self._response(function_call, result if isinstance(result, dict) else {"result": result})
+
+    @staticmethod
+    def _response(function_call: types.FunctionCall, response: dict) -> types.FunctionResponse:
+        return types.FunctionResponse(id=function_call.id, name=function_call.name, response=response)
@@ -0,0 +1,386 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from utils import AudioPipeline, convert_batch
+
+logger = logging.getLogger(__name__)
+
+# Never hold a frame longer than one Twilio frame (20 ms), whatever is configured
+MAX_BATCH_WINDOW_MS = 20.0
+
+# Where the conversion step runs
+MODE_INLINE = "inline"   # On the event loop (lowest overhead, blocks the loop while converting)
+MODE_THREAD = "thread"   # In a thread pool (NumPy releases the GIL in the heavy kernels)
+MODE_PROCESS = "process" # In a process pool, audio passed through shared memory
+CONVERSION_MODES = (MODE_INLINE, MODE_THREAD, MODE_PROCESS)
+
+# Don't split a batch across processes into shards smaller than this
+MIN_CHUNKS_PER_SHARD = 32
+
+
+class BatchTranscoder:
+    """
+    Shared transcoding service that converts audio for all active calls in batches.
+
+    Calls submit chunks through `convert()`. The first chunk to arrive in an
+    empty batch opens a collection window; when it closes (or the batch is
+    full) every pending chunk from every call is converted in one vectorized
+    `convert_batch` pass and each caller's future is resolved with its bytes.
+    A window of 0 converts each chunk as soon as it is submitted.
+
+    The conversion itself runs according to `mode` (see CONVERSION_MODES).
+    Batches are converted one at a time, in order, so a call's chunks always
+    see its pipeline state in sequence. Time the event loop spends blocked on
+    conversion work is recorded for every mode and reported by `stats()`.
+
+    Args:
+        window_ms: How long to collect chunks before converting, clamped to
+            `MAX_BATCH_WINDOW_MS` so no frame waits longer than that.
+        max_batch: Convert immediately once this many chunks are pending.
+        mode: "inline", "thread" or "process".
+        workers: Pool size for the thread/process modes (default: CPU count).
+    """
+
+    def __init__(self, window_ms: float = 5.0, max_batch: int = 512, mode: str = MODE_INLINE, workers: int = None):
+        if window_ms > MAX_BATCH_WINDOW_MS:
+            logger.warning(f"Transcoder batch window {window_ms} ms exceeds the {MAX_BATCH_WINDOW_MS} ms bound. Clamping.")
+        if mode not in CONVERSION_MODES:
+            raise ValueError(f"Unknown conversion mode '{mode}'. Expected one of: {', '.join(CONVERSION_MODES)}")
+        self.window = max(0.0, min(window_ms, MAX_BATCH_WINDOW_MS)) / 1000.0
+        self.max_batch = max_batch
+        self.mode = mode
+        self.workers = workers or os.cpu_count() or 1
+        self._pending = [] # (pipeline, chunk, future)
+        self._flush_handle = None
+        self._batch_lock = asyncio.Lock()
+        self._batch_tasks = set()
+        self._executor = None
+        self._shared_slots = [] # One SharedAudioSlot per concurrent process shard
+        # Counters for observability
+        self.batches = 0
+        self.chunks = 0
+        self.convert_seconds = 0.0       # Wall time from batch start to results ready
+        self.loop_blocked_seconds = 0.0  # Part of that spent blocking the event loop
+        self.max_loop_blocked_seconds = 0.0
+
+    async def convert(self, pipeline: AudioPipeline, chunk: bytes) -> bytes:
+        """Queues a chunk for the next batch and waits for its converted bytes."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((pipeline, chunk, future))
+        if self.window == 0 or len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+        return await future
+
+    def cancel(self, pipeline: AudioPipeline) -> int:
+        """
+        Drops a pipeline's chunks that are still waiting for a batch, e.g. on barge-in.
+
+        Their callers receive b"". Chunks already in a running batch can't be
+        recalled; callers should discard those results themselves.
+
+        Returns:
+            Number of chunks dropped.
+        """
+        kept = []
+        dropped = 0
+        for item in self._pending:
+            if item[0] is pipeline:
+                dropped += 1
+                if not item[2].done():
+                    item[2].set_result(b"")
+            else:
+                kept.append(item)
+        self._pending = kept
+        return dropped
+
+    def reset(self, pipeline: AudioPipeline) -> int:
+        """
+        Cancels a pipeline's pending chunks (see `cancel`) and resets its filter
+        state, e.g. on barge-in.
+
+        A batch already converting (in a thread or process) may still be using
+        the pipeline, so then the reset waits for the batch lock: it runs after
+        the batches queued before it and before any queued after it.
+
+        Returns:
+            Number of chunks dropped.
+        """
+        dropped = self.cancel(pipeline)
+        if not self._batch_tasks:
+            pipeline.reset()
+        else:
+            task = asyncio.ensure_future(self._reset_after_batches(pipeline))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+        return dropped
+
+    async def _reset_after_batches(self, pipeline: AudioPipeline):
+        async with self._batch_lock:
+            pipeline.reset()
+
+    def _flush(self):
+        """Hands every pending chunk to the configured conversion mode as one batch."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        if self.mode == MODE_INLINE:
+            started = time.perf_counter()
+            results = self._convert_inline(pending)
+            self._resolve(pending, results)
+            elapsed = time.perf_counter() - started
+            self._record(len(pending), elapsed, elapsed)
+            return
+
+        task = asyncio.ensure_future(self._run_batch(pending))
+        self._batch_tasks.add(task) # Keep a reference until the batch is done
+        task.add_done_callback(self._batch_tasks.discard)
+
+    async def _run_batch(self, pending: list):
+        async with self._batch_lock:
+            started = time.perf_counter()
+            try:
+                if self.mode == MODE_THREAD:
+                    blocked, results = await self._convert_in_thread(pending)
+                elif self.mode == MODE_PROCESS:
+                    blocked, results = await self._convert_in_processes(pending)
+                else:
+                    results = self._convert_inline(pending)
+                    blocked = time.perf_counter() - started
+            except Exception as e:
+                logger.error(f"Transcoding batch failed in {self.mode} mode: {type(e).__name__} - {e}", exc_info=True)
+                results, blocked = [b""] * len(pending), 0.0
+            resolve_started = time.perf_counter()
+            self._resolve(pending, results)
+            blocked += time.perf_counter() - resolve_started
+            self._record(len(pending), time.perf_counter() - started, blocked)
+
+    def _convert_inline(self, pending: list) -> list:
+        try:
+            return convert_batch([item[0] for item in pending], [item[1] for item in pending])
+        except Exception as e:
+            logger.error(f"Batched transcoding failed: {type(e).__name__} - {e}", exc_info=True)
+            return [b""] * len(pending)
+
+    async def _convert_in_thread(self, pending: list) -> tuple:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="transcoder")
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        future = loop.run_in_executor(
+            self._executor, convert_batch, [item[0] for item in pending], [item[1] for item in pending]
+        )
+        blocked = time.perf_counter() - started
+        return blocked, await future
+
+    async def _convert_in_processes(self, pending: list) -> tuple:
+        if self._executor is None:
+            # spawn: never fork a process that is running an event loop and server threads
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        loop = asyncio.get_running_loop()
+
+        # Split by pipeline so every shard owns its pipelines' full state
+        num_shards = max(1, min(self.workers, len(pending) // MIN_CHUNKS_PER_SHARD))
+        shard_of = {}
+        shards = [[] for _ in range(num_shards)]
+        for index, item in enumerate(pending):
+            shard = shard_of.setdefault(id(item[0]), len(shard_of) % num_shards)
+            shards[shard].append(index)
+        shards = [shard for shard in shards if shard]
+        while len(self._shared_slots) < len(shards):
+            self._shared_slots.append(SharedAudioSlot())
+
+        blocked = 0.0
+        started = time.perf_counter()
+        jobs = []
+        for slot, shard in zip(self._shared_slots, shards):
+            job = slot.pack([pending[index][0] for index in shard], [pending[index][1] for index in shard])
+            jobs.append(loop.run_in_executor(self._executor, _convert_shared_job, job))
+        blocked += time.perf_counter() - started
+
+        replies = await asyncio.gather(*jobs)
+
+        started = time.perf_counter()
+        results = [b""] * len(pending)
+        for slot, shard, reply in zip(self._shared_slots, shards, replies):
+            for index, result in zip(shard, slot.unpack(reply)):
+                results[index] = result
+        blocked += time.perf_counter() - started
+        return blocked, results
+
+    def _resolve(self, pending: list, results: list):
+        for (_, _, future), result in zip(pending, results):
+            if not future.done(): # The waiting call may have been cancelled
+                future.set_result(result)
+
+    def _record(self, num_chunks: int, elapsed: float, blocked: float):
+        self.batches += 1
+        self.chunks += num_chunks
+        self.convert_seconds += elapsed
+        self.loop_blocked_seconds += blocked
+        self.max_loop_blocked_seconds = max(self.max_loop_blocked_seconds, blocked)
+
+    def close(self):
+        """Shuts down worker pools and releases shared memory."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        for slot in self._shared_slots:
+            slot.close()
+        self._shared_slots = []
+
+    def stats(self) -> dict:
+        """Returns batch and loop-blocking counters for monitoring."""
+        return {
+            "mode": self.mode,
+            "window_ms": self.window * 1000.0,
+            "batches": self.batches,
+            "chunks": self.chunks,
+            "mean_batch_size": self.chunks / self.batches if self.batches else 0.0,
+            "convert_seconds": self.convert_seconds,
+            "loop_blocked_seconds": self.loop_blocked_seconds,
+            "mean_loop_blocked_ms": self.loop_blocked_seconds / self.batches * 1000.0 if self.batches else 0.0,
+            "max_loop_blocked_ms": self.max_loop_blocked_seconds * 1000.0,
+        }
+
+
+# --- Process mode: shared-memory transport ---
+
+HISTORY_DTYPE = np.float32
+
+
+class SharedAudioSlot:
+    """
+    Parent-side shared-memory segment for one in-flight process shard.
+
+    `pack` writes the shard's audio and each pipeline's state into the
+    segment and returns a small picklable job description; the worker
+    converts in place and `unpack` reads the outputs and new state back.
+    Only offsets, lengths and scalars cross the process boundary by pickle.
+    The segment is reused across batches and grown when a batch needs more.
+    """
+
+    def __init__(self, size: int = 1 << 20):
+        self.shm = SharedMemory(create=True, size=size)
+        self._pipelines = [] # Unique pipelines of the packed shard, in state order
+
+    def _ensure_capacity(self, size: int):
+        if size > self.shm.size:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = SharedMemory(create=True, size=max(size, self.shm.size * 2))
+
+    def pack(self, pipelines: list, chunks: list) -> dict:
+        state_index = {}
+        self._pipelines = []
+        for pipeline in pipelines:
+            if id(pipeline) not in state_index:
+                state_index[id(pipeline)] = len(self._pipelines)
+                self._pipelines.append(pipeline)
+
+        history_bytes = sum(p.resampler.history_length for p in self._pipelines) * np.dtype(HISTORY_DTYPE).itemsize
+        input_bytes = sum(len(chunk) for chunk in chunks)
+        # Inbound output is 4x its input (2x rate, 2x width); outbound is well under 1x
+        output_bytes = sum(4 * len(chunk) if p.direction == AudioPipeline.INBOUND else len(chunk) // 6 + 2
+                           for p, chunk in zip(pipelines, chunks))
+        self._ensure_capacity(history_bytes + input_bytes + output_bytes)
+        buf = self.shm.buf
+
+        offset = 0
+        states = []
+        for pipeline in self._pipelines:
+            history, position, carry = pipeline.get_state()
+            size = history.nbytes
+            buf[offset:offset + size] = history.tobytes()
+            states.append((id(pipeline), pipeline.direction, offset, len(history), position, carry))
+            offset += size
+
+        inputs = []
+        for pipeline, chunk in zip(pipelines, chunks):
+            buf[offset:offset + len(chunk)] = chunk
+            inputs.append((state_index[id(pipeline)], offset, len(chunk)))
+            offset += len(chunk)
+
+        return {"shm": self.shm.name, "states": states, "inputs": inputs, "output_offset": offset}
+
+    def unpack(self, reply: dict) -> list:
+        buf = self.shm.buf
+        for pipeline, (history_offset, history_length, position, carry) in zip(self._pipelines, reply["states"]):
+            history = np.frombuffer(buf, dtype=HISTORY_DTYPE, count=history_length, offset=history_offset).copy()
+            pipeline.set_state(history, position, carry)
+        results = [bytes(buf[offset:offset + length]) for offset, length in reply["outputs"]]
+        self._pipelines = []
+        return results
+
+    def close(self):
+        try:
+            self.shm.close()
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+# Worker-process caches: attached segments and reusable pipeline objects
+_worker_segments = {}
+_worker_pipelines = {}
+MAX_WORKER_PIPELINES = 4096
+
+
+def _attach_segment(name: str) -> SharedMemory:
+    shm = _worker_segments.get(name)
+    if shm is None:
+        if len(_worker_segments) >= 16: # Parent replaced its segments; drop stale mappings
+            for stale in _worker_segments.values():
+                stale.close()
+            _worker_segments.clear()
+        # Spawned workers share the parent's resource tracker, so the parent's
+        # unlink() is the only cleanup needed
+        shm = SharedMemory(name=name)
+        _worker_segments[name] = shm
+    return shm
+
+
+def _convert_shared_job(job: dict) -> dict:
+    """Worker entry point: converts a packed shard in place in shared memory."""
+    buf = _attach_segment(job["shm"]).buf
+
+    if len(_worker_pipelines) > MAX_WORKER_PIPELINES:
+        _worker_pipelines.clear()
+    pipelines = []
+    for key, direction, history_offset, history_length, position, carry in job["states"]:
+        pipeline = _worker_pipelines.get(key)
+        if pipeline is None or pipeline.direction != direction:
+            pipeline = _worker_pipelines[key] = AudioPipeline(direction)
+        history = np.frombuffer(buf, dtype=HISTORY_DTYPE, count=history_length, offset=history_offset)
+        pipeline.set_state(history, position, carry)
+        del history # Don't hold views into the segment
+        pipelines.append(pipeline)
+
+    chunks = [bytes(buf[offset:offset + length]) for _, offset, length in job["inputs"]]
+    results = convert_batch([pipelines[state] for state, _, _ in job["inputs"]], chunks)
+
+    outputs = []
+    offset = job["output_offset"]
+    for result in results:
+        buf[offset:offset + len(result)] = result
+        outputs.append((offset, len(result)))
+        offset += len(result)
+
+    states = []
+    for pipeline, (_, _, history_offset, history_length, _, _) in zip(pipelines, job["states"]):
+        history, position, carry = pipeline.get_state()
+        buf[history_offset:history_offset + history.nbytes] = history.tobytes()
+        states.append((history_offset, history_length, position, carry))
+
+    return {"outputs": outputs, "states": states}
@@ -0,0 +1,73 @@
+import binascii
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Twilio sends compact JSON with "event" as the first key, e.g.
+# {"event":"media","sequenceNumber":"3","media":{"track":"inbound","chunk":"1","timestamp":"5","payload":"..."},"streamSid":"MZ..."}
+MEDIA_EVENT_MARKER = '"event":"media"'
+PAYLOAD_MARKER = '"payload":"'
+
+
+def parse_twilio_message(message: str) -> tuple:
+    """
+    Parses one Twilio Media Streams message.
+
+    Media frames (the 50-per-second case) take a fast path: the base64
+    payload is sliced straight out of the string and decoded, with no
+    generic JSON parse. Base64 never contains quotes, so the payload ends at
+    the next quote; if it contains a backslash (an escaped "/"), or the
+    layout is not what we expect, the message falls back to `json.loads`.
+    Every other event is parsed normally.
+
+    Returns:
+        (event, data, payload): `data` is the parsed dict (None on the fast
+        path) and `payload` the decoded media bytes (None for non-media events).
+
+    Raises:
+        json.JSONDecodeError: if the fallback parse fails.
+    """
+    if MEDIA_EVENT_MARKER in message:
+        start = message.find(PAYLOAD_MARKER)
+        if start != -1:
+            start += len(PAYLOAD_MARKER)
+            end = message.find('"', start)
+            if end != -1 and message.find("\\", start, end) == -1:
+                try:
+                    return "media", None, binascii.a2b_base64(message[start:end])
+                except binascii.Error:
+                    pass # Let the slow path report it
+
+    data = json.loads(message)
+    event = data.get("event")
+    payload = None
+    if event == "media":
+        payload = binascii.a2b_base64(data["media"]["payload"])
+    return event, data, payload
+
+
+class TwilioMessageFormatter:
+    """
+    Preformatted outbound messages for one Twilio stream.
+
+    The JSON around the payload never changes within a stream, so it is
+    built once and each media frame is a single string concatenation around
+    the base64 text instead of a dict build plus `json.dumps`.
+    """
+
+    def __init__(self, stream_sid: str):
+        sid = json.dumps(stream_sid) # Quoted and escaped once
+        self._media_prefix = '{"event":"media","streamSid":' + sid + ',"media":{"payload":"'
+        self._media_suffix = '"}}'
+        self._mark_prefix = '{"event":"mark","streamSid":' + sid + ',"mark":{"name":'
+        self._clear = '{"event":"clear","streamSid":' + sid + '}'
+
+    def media(self, mulaw_frame: bytes) -> str:
+        return self._media_prefix + binascii.b2a_base64(mulaw_frame, newline=False).decode("ascii") + self._media_suffix
+
+    def mark(self, name: str) -> str:
+        return self._mark_prefix + json.dumps(name) + "}}"
+
+    def clear(self) -> str:
+        return self._clear
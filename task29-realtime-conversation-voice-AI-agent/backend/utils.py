@@ -1,7 +1,6 @@
 import logging
-from pydub import AudioSegment
-from pydub.exceptions import CouldntDecodeError
-import io
+import numpy as np
+from audio_codec import StreamingResampler, mulaw_decode, mulaw_encode, polyphase_resample, resample_batch
 
 logger = logging.getLogger(__name__)
 
@@ -18,48 +17,34 @@ GEMINI_OUTPUT_SAMPLE_RATE = 24000
 GEMINI_OUTPUT_CHANNELS = 1
 GEMINI_OUTPUT_SAMPLE_WIDTH = 2 # bytes per sample for 16-bit PCM
 
-# No longer needed with pydub's approach
-# def reset_resample_states():
-#     pass # Keep the function signature if called elsewhere, but do nothing
+# Resampling ratios (up, down) between the two sides
+INBOUND_RESAMPLE_RATIO = (GEMINI_INPUT_SAMPLE_RATE // TWILIO_SAMPLE_RATE, 1)   # 8k -> 16k
+OUTBOUND_RESAMPLE_RATIO = (1, GEMINI_OUTPUT_SAMPLE_RATE // TWILIO_SAMPLE_RATE) # 24k -> 8k
+
 
 def mulaw8k_to_pcm16k(mulaw_data: bytes) -> bytes:
-    """Convert 8-bit mulaw@8kHz/mono to 16-bit PCM@16kHz/mono using pydub"""
+    """Convert 8-bit mulaw@8kHz/mono to 16-bit PCM@16kHz/mono (in-process, table-driven)"""
     if not mulaw_data:
         return b""
     try:
-        # 1. Create AudioSegment from raw mulaw data
-        audio_segment = AudioSegment(
-            data=mulaw_data,
-            sample_width=TWILIO_SAMPLE_WIDTH,
-            frame_rate=TWILIO_SAMPLE_RATE,
-            channels=TWILIO_CHANNELS
-        )
-
-        # 2. Resample to Gemini's input rate (16kHz)
-        # Pydub handles conversion to PCM implicitly when changing sample rate/width
-        audio_segment = audio_segment.set_frame_rate(GEMINI_INPUT_SAMPLE_RATE)
-
-        # 3. Ensure it's 16-bit (set_sample_width)
-        audio_segment = audio_segment.set_sample_width(GEMINI_INPUT_SAMPLE_WIDTH)
-
-        # 4. Ensure mono
-        audio_segment = audio_segment.set_channels(GEMINI_INPUT_CHANNELS)
-
-        # 5. Get the raw PCM data
-        pcm_16k_data = audio_segment.raw_data
+        # 1. Decode mulaw bytes to 16-bit PCM via the lookup table
+        pcm_8k = mulaw_decode(np.frombuffer(mulaw_data, dtype=np.uint8))
+
+        # 2. Upsample to Gemini's input rate (16kHz) with the polyphase filter
+        pcm_16k = polyphase_resample(pcm_8k, *INBOUND_RESAMPLE_RATIO)
+
+        # 3. Get the raw little-endian PCM data
+        pcm_16k_data = pcm_16k.astype("<i2", copy=False).tobytes()
         # logger.debug(f"Converted {len(mulaw_data)} mulaw bytes to {len(pcm_16k_data)} PCM 16kHz bytes")
         return pcm_16k_data
 
-    except CouldntDecodeError as e:
-        logger.error(f"Pydub couldn't decode mulaw data: {e}")
-        return b""
     except Exception as e:
-        logger.error(f"Error during mulaw->pcm16k conversion with pydub: {type(e).__name__} - {e}", exc_info=True)
+        logger.error(f"Error during mulaw->pcm16k conversion: {type(e).__name__} - {e}", exc_info=True)
         return b""
 
 
 def pcm24k_to_mulaw8k(pcm_data: bytes) -> bytes:
-    """Convert 16-bit PCM@24kHz/mono to 8-bit mulaw@8kHz/mono using pydub"""
+    """Convert 16-bit PCM@24kHz/mono to 8-bit mulaw@8kHz/mono (in-process, table-driven)"""
     if not pcm_data:
         # logger.warning("Received empty PCM data for conversion")
         return b""
@@ -74,37 +59,186 @@ def pcm24k_to_mulaw8k(pcm_data: bytes) -> bytes:
 
     try:
         # logger.debug(f"Converting {len(pcm_data)} bytes of PCM 24kHz data")
-        # 1. Create AudioSegment from raw PCM data
-        audio_segment = AudioSegment(
-            data=pcm_data,
-            sample_width=GEMINI_OUTPUT_SAMPLE_WIDTH,
-            frame_rate=GEMINI_OUTPUT_SAMPLE_RATE,
-            channels=GEMINI_OUTPUT_CHANNELS
-        )
-
-        # 2. Resample down to Twilio's rate (8kHz)
-        audio_segment = audio_segment.set_frame_rate(TWILIO_SAMPLE_RATE)
-
-        # 3. Ensure mono
-        audio_segment = audio_segment.set_channels(TWILIO_CHANNELS)
-
-        # 4. Export as mulaw
-        # We use BytesIO to capture the output of export
-        buffer = io.BytesIO()
-        # Specify codec explicitly for raw mulaw output
-        audio_segment.export(buffer, format="mulaw", codec="pcm_mulaw")
-        mulaw_data = buffer.getvalue()
-        buffer.close()
+        # 1. View raw bytes as little-endian 16-bit samples (no copy)
+        pcm_24k = np.frombuffer(pcm_data, dtype="<i2")
+
+        # 2. Resample down to Twilio's rate (8kHz); the filter also acts as anti-aliasing low-pass
+        pcm_8k = polyphase_resample(pcm_24k, *OUTBOUND_RESAMPLE_RATIO)
+
+        # 3. Encode as mulaw via the lookup table
+        mulaw_data = mulaw_encode(pcm_8k).tobytes()
 
         # logger.debug(f"Converted to {len(mulaw_data)} bytes of μ-law 8kHz")
         return mulaw_data
 
-    except CouldntDecodeError as e:
-        logger.error(f"Pydub couldn't decode PCM data: {e}")
-        return b""
     except Exception as e:
-        logger.error(f"Error during pcm24k->mulaw8k conversion with pydub: {type(e).__name__} - {e}", exc_info=True)
+        logger.error(f"Error during pcm24k->mulaw8k conversion: {type(e).__name__} - {e}", exc_info=True)
         # Dump first few bytes for debugging
         if pcm_data:
             logger.error(f"First 20 bytes of problematic PCM data: {pcm_data[:20].hex()}")
-        return b""
\ No newline at end of file
+        return b""
+
+
+class AudioPipeline:
+    """
+    Streaming converter for one direction of one call.
+
+    Unlike the one-shot functions above, the pipeline keeps resampler filter
+    history and grid position across chunks (no clicks at chunk boundaries)
+    and carries a trailing odd byte of PCM over to the next chunk instead of
+    dropping it. Codec scratch buffers are preallocated and reused.
+
+    Create one per direction per websocket with `AudioPipeline.inbound()` or
+    `AudioPipeline.outbound()`.
+    """
+
+    INBOUND = "inbound"    # Twilio mulaw@8kHz -> Gemini PCM@16kHz
+    OUTBOUND = "outbound"  # Gemini PCM@24kHz -> Twilio mulaw@8kHz
+
+    def __init__(self, direction: str, max_block: int = 4800):
+        if direction == self.INBOUND:
+            self.resampler = StreamingResampler(*INBOUND_RESAMPLE_RATIO, max_block=max_block)
+            self._scratch = np.empty(max_block, dtype=np.int16)       # decoded mulaw
+        elif direction == self.OUTBOUND:
+            self.resampler = StreamingResampler(*OUTBOUND_RESAMPLE_RATIO, max_block=max_block)
+            self._scratch = np.empty(max_block, dtype=np.uint8)       # encoded mulaw
+        else:
+            raise ValueError(f"Unknown audio pipeline direction: {direction}")
+        self.direction = direction
+        self._carry = b"" # Trailing odd PCM byte held for the next chunk
+
+    @classmethod
+    def inbound(cls) -> "AudioPipeline":
+        return cls(cls.INBOUND)
+
+    @classmethod
+    def outbound(cls) -> "AudioPipeline":
+        return cls(cls.OUTBOUND)
+
+    def _scratch_view(self, length: int) -> np.ndarray:
+        if length > len(self._scratch):
+            self._scratch = np.empty(length, dtype=self._scratch.dtype)
+        return self._scratch[:length]
+
+    def convert(self, data: bytes) -> bytes:
+        """Converts the next chunk of the stream. Returns b"" if nothing could be produced yet."""
+        if self.direction == self.INBOUND:
+            return self._mulaw8k_to_pcm16k(data)
+        return self._pcm24k_to_mulaw8k(data)
+
+    def reset(self) -> None:
+        """Drops carried state, e.g. when queued audio is discarded mid-stream."""
+        self.resampler.reset()
+        self._carry = b""
+
+    def get_state(self) -> tuple:
+        """Returns (history, position, carry) so the stream can be continued by another pipeline."""
+        history, position = self.resampler.get_state()
+        return history, position, self._carry
+
+    def set_state(self, history: np.ndarray, position: int, carry: bytes) -> None:
+        """Restores state captured by `get_state`."""
+        self.resampler.set_state(history, position)
+        self._carry = carry
+
+    def _mulaw8k_to_pcm16k(self, mulaw_data: bytes) -> bytes:
+        if not mulaw_data:
+            return b""
+        try:
+            pcm_8k = mulaw_decode(np.frombuffer(mulaw_data, dtype=np.uint8), out=self._scratch_view(len(mulaw_data)))
+            return self.resampler.process(pcm_8k).astype("<i2", copy=False).tobytes()
+        except Exception as e:
+            logger.error(f"Error during streaming mulaw->pcm16k conversion: {type(e).__name__} - {e}", exc_info=True)
+            return b""
+
+    def _take_pcm_samples(self, pcm_data: bytes):
+        """Applies the odd-byte carry and returns whole 16-bit samples, or None if there are none."""
+        if self._carry:
+            pcm_data = self._carry + pcm_data
+            self._carry = b""
+        if len(pcm_data) % GEMINI_OUTPUT_SAMPLE_WIDTH != 0:
+            # Hold the odd byte; it is the first half of the next chunk's first sample
+            self._carry = pcm_data[-1:]
+            pcm_data = pcm_data[:-1]
+        if not pcm_data:
+            return None
+        return np.frombuffer(pcm_data, dtype="<i2")
+
+    def _pcm24k_to_mulaw8k(self, pcm_data: bytes) -> bytes:
+        pcm_24k = self._take_pcm_samples(pcm_data)
+        if pcm_24k is None:
+            return b""
+        try:
+            pcm_8k = self.resampler.process(pcm_24k)
+            return mulaw_encode(pcm_8k, out=self._scratch_view(len(pcm_8k))).tobytes()
+        except Exception as e:
+            logger.error(f"Error during streaming pcm24k->mulaw8k conversion: {type(e).__name__} - {e}", exc_info=True)
+            return b""
+
+
+def convert_batch(pipelines: list, chunks: list) -> list:
+    """
+    Converts one chunk for each of many pipelines, vectorizing across calls.
+
+    `pipelines[i]` converts `chunks[i]`; a pipeline may appear more than once
+    and its chunks are then applied in list order. Chunks of the same
+    direction, length and resampler position (e.g. every 160-byte Twilio
+    frame) are stacked and pushed through the codec tables and polyphase
+    filter as one 2-D block; anything left over falls back to per-pipeline
+    `convert`. Results match calling `convert` on each pipeline in order.
+
+    Returns:
+        A list of converted byte strings aligned with `chunks`.
+    """
+    results = [b""] * len(chunks)
+
+    # A pipeline's k-th chunk goes in round k so its own chunks stay ordered
+    rounds = []
+    occurrences = {}
+    for index, pipeline in enumerate(pipelines):
+        round_number = occurrences.get(id(pipeline), 0)
+        occurrences[id(pipeline)] = round_number + 1
+        if round_number == len(rounds):
+            rounds.append([])
+        rounds[round_number].append(index)
+
+    for round_indices in rounds:
+        groups = {}
+        for index in round_indices:
+            pipeline = pipelines[index]
+            if pipeline.direction == AudioPipeline.INBOUND:
+                if not chunks[index]:
+                    continue
+                samples = np.frombuffer(chunks[index], dtype=np.uint8)
+            else:
+                samples = pipeline._take_pcm_samples(chunks[index])
+                if samples is None:
+                    continue
+            key = (pipeline.direction, len(samples), pipeline.resampler._position)
+            groups.setdefault(key, []).append((index, samples))
+
+        for (direction, _, _), members in groups.items():
+            group_pipelines = [pipelines[index] for index, _ in members]
+            try:
+                if len(members) == 1:
+                    index, samples = members[0]
+                    pipeline = group_pipelines[0]
+                    if direction == AudioPipeline.INBOUND:
+                        results[index] = pipeline._mulaw8k_to_pcm16k(chunks[index])
+                    else:
+                        pcm_8k = pipeline.resampler.process(samples)
+                        results[index] = mulaw_encode(pcm_8k).tobytes()
+                    continue
+
+                block = np.stack([samples for _, samples in members])
+                resamplers = [pipeline.resampler for pipeline in group_pipelines]
+                if direction == AudioPipeline.INBOUND:
+                    converted = resample_batch(resamplers, mulaw_decode(block)).astype("<i2", copy=False)
+                else:
+                    converted = mulaw_encode(resample_batch(resamplers, block))
+                for row, (index, _) in enumerate(members):
+                    results[index] = converted[row].tobytes()
+            except Exception as e:
+                logger.error(f"Error during batched {direction} conversion of {len(members)} chunks: {type(e).__name__} - {e}", exc_info=True)
+
+    return results